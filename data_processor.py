@@ -2,60 +2,292 @@ import pandas as pd
 import numpy as np
 import json
 import os
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
 import seaborn as sns
 from collections import defaultdict
+from table_cache import TableCache, PARQUET_AVAILABLE
+from streaming_stats import RunningMoments
+from table_schemas import schema_read_options
+from incremental import (IncrementalState, add_total, add_counts, sorted_counts, add_to_sketch, load_sketch,
+                         merge_states)
+from sketches import QuantileSketch, GroupedQuantileSketch, HyperLogLog
+from json_export import write_json, write_shards, dumps
+from pipeline import StagePipeline
+from query_backend import create_backend, diff_results
+from derived import DerivedColumns, AGE_BINS, AGE_LABELS
+from occupancy import Occupancy
+from stay_index import StayIndex
+from fluid_balance import FluidBalance
+from medications import MedicationAnalytics, pushdown
+from event_tables import EVENT_TABLES, EVENT_SECTIONS, EventAggregator, read_options, section_inputs
+from dictionaries import DictionaryLookup, DICTIONARIES
+from icd_categories import DiagnosisCategorizer
+from lab_analytics import LabAnalytics, DAY_NAMES
 import warnings
 warnings.filterwarnings('ignore')
 
 class HospitalDataProcessor:
-    def __init__(self, hosp_dir='hosp', icu_dir='icu'):
+    # Common vital sign item IDs (simplified)
+    VITAL_SIGN_ITEMS = {
+        'Heart Rate': [220045, 220050],
+        'Blood Pressure': [220179, 220180],
+        'Respiratory Rate': [220210, 224690],
+        'Temperature': [223761, 223762],
+        'SpO2': [220277, 220278]
+    }
+    
+    # Map common ICD categories to readable names
+    ICD_CATEGORY_NAMES = {
+        '410': 'Acute Myocardial Infarction',
+        '428': 'Heart Failure',
+        '486': 'Pneumonia',
+        '038': 'Septicemia',
+        '518': 'Respiratory Failure',
+        '584': 'Acute Kidney Failure',
+        '250': 'Diabetes Mellitus',
+        '427': 'Cardiac Dysrhythmias'
+    }
+    
+    # Map care units to room types from room-content.js
+    ROOM_MAPPING = {
+        'Emergency Department': 'emergency',
+        'Medical Intensive Care Unit (MICU)': 'monitoring',
+        'Surgical Intensive Care Unit (SICU)': 'surgery',
+        'Coronary Care Unit (CCU)': 'cardiac',
+        'Neuro Stepdown': 'neurology',
+        'Medicine': 'treatment',
+        'Surgery': 'surgery'
+    }
+    
+    # Beds per care unit, where known; utilization is None for units without one
+    UNIT_CAPACITY = {}
+    
+    # Bin width of census series (pandas frequency, e.g. '1h', '15min', '1D')
+    OCCUPANCY_RESOLUTION = '1h'
+    
+    # Row order in which consecutive transfers of an admission form an edge
+    TRANSFER_ORDER = ['subject_id', 'hadm_id', 'intime', 'transfer_id']
+    
+    # Percentiles reported for length-of-stay distributions
+    LOS_PERCENTILES = (0.25, 0.5, 0.75, 0.9)
+    
+    # Stage -> (method, input tables and dictionaries, upstream stages); each
+    # stage writes processed_data[<stage>]. Run through pipeline.StagePipeline.
+    STAGES = {
+        'demographics': ('process_demographics', ['patients'], []),
+        'admissions': ('process_admissions', ['admissions'], []),
+        'icu': ('process_icu_data', ['icustays'], []),
+        'transfers': ('process_transfers', ['transfers'], []),
+        'lab_events': ('process_lab_events', ['labevents'], []),
+        'lab_analytics': ('process_lab_analytics', ['labevents', 'd_labitems'], []),
+        'diagnoses': ('process_diagnoses', ['diagnoses_icd', 'd_icd_diagnoses'], []),
+        'vital_signs': ('process_vital_signs', ['chartevents'], []),
+        'occupancy': ('process_occupancy', ['transfers', 'icustays'], []),
+        'fluid_balance': ('process_fluid_balance',
+                          ['ingredientevents', 'inputevents', 'outputevents', 'icustays', 'd_items'], []),
+        'medications': ('process_medications', ['prescriptions', 'pharmacy', 'emar'], []),
+        'microbiology': ('process_microbiology', section_inputs('microbiology'), []),
+        'procedures': ('process_procedures', section_inputs('procedures'), []),
+        'datetime_events': ('process_datetime_events', section_inputs('datetime_events'), []),
+        'room_analytics': ('generate_room_based_analytics', ['transfers', 'services'], ['transfers'])
+    }
+    
+    # Output section -> (source table, high-water mark column) for incremental mode; for
+    # INCREMENTAL_KEYED_TABLES the column is a key whose folded values are kept instead
+    INCREMENTAL_SECTIONS = {
+        'admissions': ('admissions', 'admittime'),
+        'icu': ('icustays', 'intime'),
+        'transfers': ('transfers', 'intime'),
+        'lab_events': ('labevents', 'charttime'),
+        'diagnoses': ('diagnoses_icd', 'hadm_id')
+    }
+    
+    # hadm_ids are random, so a high-water mark would drop diagnoses of lower ids appended later
+    INCREMENTAL_KEYED_TABLES = {'diagnoses_icd'}
+    
+    # Streamed stages without incremental state: recomputed in full in incremental mode
+    # (or reused from the stage cache while their inputs are unchanged)
+    INCREMENTAL_FULL_STAGES = ['lab_analytics', 'fluid_balance', 'medications'] + list(EVENT_SECTIONS)
+    
+    def __init__(self, hosp_dir='hosp', icu_dir='icu', cache_dir='.table_cache', rebuild_cache=False,
+                 backend='pandas', backend_options=None):
         self.hosp_dir = hosp_dir
         self.icu_dir = icu_dir
         self.data = {}
         self.processed_data = {}
         
-    def load_data(self):
-        """Load all CSV files from hospital and ICU directories"""
-        print("Loading hospital and ICU data...")
+        # Resolved source file of every table found by load_data
+        self.table_paths = {}
         
-        # Load hospital data
-        hosp_files = {
-            'patients': 'patients.csv',
-            'admissions': 'admissions.csv',
-            'transfers': 'transfers.csv',
-            'labevents': 'labevents.csv',
-            'diagnoses_icd': 'diagnoses_icd.csv',
-            'services': 'services.csv'
-        }
+        # Files written by the last export_for_visualization call
+        self.exported_files = []
         
-        for key, filename in hosp_files.items():
-            filepath = os.path.join(self.hosp_dir, filename)
+        # Interval index over transfers/icustays, built on demand by build_stay_index
+        self.stay_index = None
+        
+        # Features derived from the loaded tables, computed once and kept off the frames
+        self.derived = DerivedColumns(self)
+        
+        # Columnar cache of parsed tables (pass cache_dir=None to disable)
+        self.cache = TableCache(cache_dir, rebuild=rebuild_cache) if cache_dir else None
+        
+        # Code -> label lookups (d_icd_diagnoses, d_labitems, ...), loaded on first use
+        self.dictionaries = DictionaryLookup(hosp_dir, icu_dir, cache=self.cache)
+        self.categorizer = DiagnosisCategorizer(self.dictionaries, fallback_names=self.ICD_CATEGORY_NAMES)
+        
+        # Engine running the pipeline's stages: 'pandas' (reference) or 'duckdb' (out-of-core SQL)
+        self.backend = create_backend(backend, self, **(backend_options or {}))
+    
+    # Source formats in order of preference when several copies of a table exist
+    TABLE_EXTENSIONS = ('.parquet', '.csv.gz', '.csv')
+    
+    def _resolve_table(self, directory, name):
+        """Find the source file for a table (.parquet, .csv.gz or .csv)"""
+        for ext in self.TABLE_EXTENSIONS:
+            filepath = os.path.join(directory, name + ext)
             if os.path.exists(filepath):
+                return filepath
+        return None
+    
+    def _csv_options(self, filepath, read_options):
+        """Reader options for a CSV source; gzip is decompressed as a stream"""
+        options = {'low_memory': False}
+        if filepath.endswith('.gz'):
+            options['compression'] = 'gzip'
+        options.update(read_options)
+        return options
+    
+    def _table_columns(self, filepath):
+        """Column names of a table source, read from its header only"""
+        if filepath.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            return pq.read_schema(filepath).names
+        return pd.read_csv(filepath, nrows=0, **self._csv_options(filepath, {})).columns
+    
+    def _table_options(self, key, filepath):
+        """Schema-driven read options: column pruning, compact dtypes and dates"""
+        return schema_read_options(key, self._table_columns(filepath))
+    
+    def _read_table(self, key, filepath, **read_options):
+        """Read a table, going through the columnar cache when enabled"""
+        if filepath.endswith('.parquet'):
+            # Already columnar, nothing to cache
+            return pd.read_parquet(filepath, columns=read_options.get('usecols'))
+        
+        if self.cache is not None:
+            df = self.cache.load(key, filepath, read_options)
+            if df is not None:
+                return df
+        
+        df = pd.read_csv(filepath, **self._csv_options(filepath, read_options))
+        
+        if self.cache is not None:
+            self.cache.store(key, filepath, df, read_options)
+        return df
+    
+    def _iter_table(self, filepath, chunksize=1_000_000, **read_options):
+        """Yield a CSV table in chunks so memory stays bounded by the chunk size"""
+        if filepath.endswith('.parquet'):
+            yield pd.read_parquet(filepath, columns=read_options.get('usecols'))
+            return
+        
+        options = self._csv_options(filepath, read_options)
+        options['chunksize'] = chunksize
+        with pd.read_csv(filepath, **options) as reader:
+            for chunk in reader:
+                yield chunk
+        
+    def _table_source(self, name):
+        """Source file of a table or dictionary in the hosp or icu directory"""
+        if name in self.table_paths:
+            return self.table_paths[name]
+        return self._resolve_table(self.hosp_dir, name) or self._resolve_table(self.icu_dir, name)
+    
+    def load_data(self, workers=1, tables=None):
+        """Load all tables from hospital and ICU directories
+        
+        With workers > 1 independent tables are parsed concurrently in a
+        process pool and handed back as Arrow IPC files instead of pickles.
+        Pass tables to load only those tables.
+        """
+        print("Loading hospital and ICU data...")
+        
+        # The cache report covers the tables of this call only
+        if self.cache is not None:
+            self.cache.stats.clear()
+        
+        hosp_tables = ['patients', 'admissions', 'transfers', 'labevents',
+                       'diagnoses_icd', 'services']
+        icu_tables = ['icustays', 'chartevents', 'inputevents', 'ingredientevents', 'outputevents']
+        
+        # Tables too large to hold in memory; their process_* stage streams them
+        streamed_tables = {'chartevents', 'inputevents', 'ingredientevents', 'outputevents'}
+        
+        table_dirs = ([(key, self.hosp_dir) for key in hosp_tables] +
+                      [(key, self.icu_dir) for key in icu_tables])
+        if tables is not None:
+            table_dirs = [(key, directory) for key, directory in table_dirs if key in tables]
+        
+        jobs = []
+        for key, directory in table_dirs:
+            filepath = self._resolve_table(directory, key)
+            if filepath is None:
+                print(f"Table not found: {key}")
+                continue
+            self.table_paths[key] = filepath
+            if key in streamed_tables:
+                print(f"Streaming {key} from {filepath}")
+                continue
+            jobs.append((key, filepath))
+        
+        if workers > 1 and len(jobs) > 1:
+            if PARQUET_AVAILABLE:
+                self._load_parallel(jobs, workers)
+            else:
+                print("pyarrow not installed - loading tables sequentially")
+                workers = 1
+        
+        if workers <= 1 or len(jobs) <= 1:
+            for key, filepath in jobs:
+                start = time.perf_counter()
                 try:
-                    self.data[key] = pd.read_csv(filepath, low_memory=False)
-                    print(f"Loaded {key}: {len(self.data[key])} records")
+                    self.data[key] = self._read_table(key, filepath, **self._table_options(key, filepath))
+                    print(f"Loaded {key}: {len(self.data[key])} records "
+                          f"({time.perf_counter() - start:.2f}s)")
                 except Exception as e:
                     print(f"Error loading {key}: {e}")
         
-        # Load ICU data
-        icu_files = {
-            'icustays': 'icustays.csv',
-            'chartevents': 'chartevents.csv',
-            'inputevents': 'inputevents.csv'
-        }
+        if self.cache is not None:
+            self.cache.report()
+    
+    def _load_parallel(self, jobs, workers):
+        """Parse tables in a process pool, receiving each one as an Arrow IPC file"""
+        import pyarrow as pa
         
-        for key, filename in icu_files.items():
-            filepath = os.path.join(self.icu_dir, filename)
-            if os.path.exists(filepath):
+        cache_dir = self.cache.cache_dir if self.cache is not None else None
+        rebuild_cache = self.cache.rebuild if self.cache is not None else False
+        processor_args = (self.hosp_dir, self.icu_dir, cache_dir, rebuild_cache)
+        
+        with tempfile.TemporaryDirectory() as ipc_dir, \
+                ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_load_table_job, processor_args, key, filepath, ipc_dir): key
+                for key, filepath in jobs
+            }
+            
+            for future in as_completed(futures):
+                key = futures[future]
                 try:
-                    if key == 'chartevents':
-                        # Sample chartevents due to large size
-                        self.data[key] = pd.read_csv(filepath, nrows=10000, low_memory=False)
-                    else:
-                        self.data[key] = pd.read_csv(filepath, low_memory=False)
-                    print(f"Loaded {key}: {len(self.data[key])} records")
+                    ipc_path, elapsed, cache_status = future.result()
+                    with pa.memory_map(ipc_path) as source:
+                        self.data[key] = pa.ipc.open_file(source).read_all().to_pandas()
+                    if self.cache is not None and cache_status is not None:
+                        self.cache.stats[key] = cache_status
+                    print(f"Loaded {key}: {len(self.data[key])} records ({elapsed:.2f}s)")
                 except Exception as e:
                     print(f"Error loading {key}: {e}")
     
@@ -66,49 +298,48 @@ class HospitalDataProcessor:
             
             demographics = {
                 'gender_distribution': patients['gender'].value_counts().to_dict(),
-                'age_distribution': self._get_age_distribution(patients),
+                'age_distribution': self._get_age_distribution(),
                 'total_patients': len(patients),
                 'mortality_count': len(patients[patients['dod'].notna()])
             }
             
             self.processed_data['demographics'] = demographics
     
-    def _get_age_distribution(self, patients):
-        """Get age distribution in bins"""
-        age_bins = [0, 18, 30, 40, 50, 60, 70, 80, 100]
-        age_labels = ['0-17', '18-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
-        
-        patients['age_group'] = pd.cut(patients['anchor_age'], bins=age_bins, labels=age_labels, right=False)
-        return patients['age_group'].value_counts().to_dict()
+    def _get_age_distribution(self):
+        """Get age distribution in bins (derived.AGE_BINS)"""
+        return self.derived.get('patients', 'age_group').value_counts().to_dict()
     
     def process_admissions(self):
         """Process admission data"""
         if 'admissions' in self.data:
             admissions = self.data['admissions']
             
-            # Convert datetime columns
-            admissions['admittime'] = pd.to_datetime(admissions['admittime'])
-            admissions['dischtime'] = pd.to_datetime(admissions['dischtime'])
+            # Length of stay in whole days (derived once, not added to the frame)
+            los = self.derived.get('admissions', 'los')
             
-            # Calculate length of stay
-            admissions['los'] = (admissions['dischtime'] - admissions['admittime']).dt.days
+            # Percentiles and distinct patients from mergeable sketches
+            los_days = QuantileSketch()
+            los_days.update(self.derived.get('admissions', 'stay_days'))
+            patients = HyperLogLog()
+            patients.update(admissions['subject_id'])
             
             admission_stats = {
                 'total_admissions': len(admissions),
                 'admission_types': admissions['admission_type'].value_counts().to_dict(),
                 'admission_locations': admissions['admission_location'].value_counts().to_dict(),
                 'discharge_locations': admissions['discharge_location'].value_counts().to_dict(),
-                'avg_length_of_stay': admissions['los'].mean(),
+                'avg_length_of_stay': los.mean(),
+                'los_percentiles': los_days.summary(self.LOS_PERCENTILES),
+                'unique_patients': patients.count(),
                 'mortality_rate': (admissions['hospital_expire_flag'].sum() / len(admissions)) * 100,
-                'seasonal_patterns': self._get_seasonal_patterns(admissions)
+                'seasonal_patterns': self._get_seasonal_patterns()
             }
             
             self.processed_data['admissions'] = admission_stats
     
-    def _get_seasonal_patterns(self, admissions):
+    def _get_seasonal_patterns(self):
         """Get seasonal admission patterns"""
-        admissions['month'] = admissions['admittime'].dt.month
-        monthly_counts = admissions['month'].value_counts().sort_index()
+        monthly_counts = self.derived.get('admissions', 'month').value_counts().sort_index()
         
         months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
                  'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
@@ -120,11 +351,21 @@ class HospitalDataProcessor:
         if 'icustays' in self.data:
             icu_stays = self.data['icustays']
             
+            los = QuantileSketch()
+            los.update(icu_stays['los'])
+            los_by_unit = GroupedQuantileSketch()
+            los_by_unit.update(icu_stays['first_careunit'].astype(object), icu_stays['los'])
+            patients = HyperLogLog()
+            patients.update(icu_stays['subject_id'])
+            
             icu_stats = {
                 'total_icu_stays': len(icu_stays),
                 'care_units': icu_stays['first_careunit'].value_counts().to_dict(),
                 'avg_icu_los': icu_stays['los'].mean(),
-                'los_by_unit': icu_stays.groupby('first_careunit')['los'].mean().to_dict()
+                'los_by_unit': icu_stays.groupby('first_careunit')['los'].mean().to_dict(),
+                'los_percentiles': los.summary(self.LOS_PERCENTILES),
+                'los_percentiles_by_unit': los_by_unit.summary(self.LOS_PERCENTILES),
+                'unique_patients': patients.count()
             }
             
             self.processed_data['icu'] = icu_stats
@@ -135,12 +376,14 @@ class HospitalDataProcessor:
             transfers = self.data['transfers']
             
             # Get transfer flow between units
-            transfer_flow = defaultdict(lambda: defaultdict(int))
+            transfer_flow = defaultdict(dict)
             
-            # Group transfers by patient to get sequential transfers
-            patient_transfers = transfers.groupby('subject_id').apply(
-                lambda x: x.sort_values('intime') if 'intime' in x.columns else x
-            ).reset_index(drop=True)
+            ordered = transfers.sort_values(self.TRANSFER_ORDER, kind='stable')
+            edges = self._transfer_edges(ordered)
+            
+            flow_counts = edges.groupby(['from_unit', 'to_unit'], observed=True).size()
+            for (from_unit, to_unit), count in flow_counts.items():
+                transfer_flow[from_unit][to_unit] = count
             
             # Create flow data
             care_units = transfers['careunit'].value_counts().to_dict()
@@ -153,23 +396,35 @@ class HospitalDataProcessor:
             
             self.processed_data['transfers'] = transfer_stats
     
+    def _transfer_edges(self, ordered):
+        """(from_unit, to_unit) pairs of consecutive transfers of the same admission
+        
+        Expects rows sorted by TRANSFER_ORDER; every row is paired with
+        the next row via a vectorized shift, no per-patient callbacks.
+        Rows without an admission (ED visits that were not admitted) and
+        the step from one admission to the patient's next form no edge.
+        """
+        same_admission = ordered['hadm_id'].eq(ordered['hadm_id'].shift(-1)).to_numpy(dtype=bool, na_value=False)
+        return pd.DataFrame({
+            'from_unit': ordered['careunit'],
+            'to_unit': ordered['careunit'].shift(-1)
+        })[same_admission].dropna()
+    
     def process_lab_events(self):
         """Process laboratory events"""
         if 'labevents' in self.data:
             lab_events = self.data['labevents']
             
-            # Convert charttime to datetime
-            lab_events['charttime'] = pd.to_datetime(lab_events['charttime'])
-            lab_events['hour'] = lab_events['charttime'].dt.hour
-            lab_events['day_of_week'] = lab_events['charttime'].dt.day_name()
-            
-            # Get lab test frequency by hour and day
-            hourly_freq = lab_events['hour'].value_counts().sort_index().to_dict()
-            daily_freq = lab_events['day_of_week'].value_counts().to_dict()
+            # Integer hour / day-of-week codes; day names only for the output keys
+            hourly_freq = self.derived.get('labevents', 'hour').value_counts().sort_index().to_dict()
+            daily_freq = {DAY_NAMES[int(day)]: count
+                          for day, count in self.derived.get('labevents', 'day_of_week').value_counts().items()}
             
             # Most common lab tests
             if 'itemid' in lab_events.columns:
-                common_tests = lab_events['itemid'].value_counts().head(10).to_dict()
+                # Ties broken by itemid so every backend reports the same ten
+                common_tests = (lab_events['itemid'].value_counts().sort_index()
+                                .sort_values(ascending=False, kind='stable').head(10).to_dict())
             else:
                 common_tests = {}
             
@@ -182,78 +437,560 @@ class HospitalDataProcessor:
             
             self.processed_data['lab_events'] = lab_stats
     
+    def process_lab_analytics(self, chunksize=1_000_000, top_items=25):
+        """Lab turnaround, abnormal-flag rates and per-test value distributions
+        
+        Uses the loaded labevents frame, or streams the source file in
+        chunks when it was not loaded.
+        """
+        analytics = self._lab_analytics(chunksize)
+        if analytics is not None:
+            self.processed_data['lab_analytics'] = self._lab_analytics_summary(analytics, top_items)
+    
+    def _lab_analytics(self, chunksize=1_000_000):
+        """LabAnalytics accumulator over labevents, or None without the table"""
+        if 'labevents' in self.data:
+            chunks = [self.data['labevents']]
+        elif 'labevents' in self.table_paths:
+            filepath = self.table_paths['labevents']
+            chunks = self._iter_table(filepath, chunksize, **self._table_options('labevents', filepath))
+        else:
+            return None
+        
+        analytics = LabAnalytics()
+        for chunk in chunks:
+            analytics.update(chunk)
+        return analytics
+    
+    def _lab_analytics_summary(self, analytics, top_items=25):
+        lab_stats = analytics.summary(top_items)
+        
+        # Test volume by specimen fluid (Blood, Urine, ...) for the Test Types chart
+        try:
+            item_fluids = self.dictionaries.labels('d_labitems', analytics.item_counts.index, column='fluid')
+            lab_stats['tests_by_fluid'] = (pd.Series(analytics.item_counts.to_numpy())
+                                           .groupby(item_fluids.fillna('Unknown').to_numpy()).sum()
+                                           .sort_values(ascending=False).to_dict())
+        except FileNotFoundError:
+            pass
+        return lab_stats
+    
     def process_diagnoses(self):
-        """Process diagnosis data"""
+        """Process diagnosis data at the ICD chapter, category and code levels"""
         if 'diagnoses_icd' in self.data:
             diagnoses = self.data['diagnoses_icd']
             
-            # Group diagnoses by category (first 3 characters of ICD code)
-            diagnoses['category'] = diagnoses['icd_code'].astype(str).str[:3]
-            
-            # Map common ICD categories to readable names
-            icd_mapping = {
-                '410': 'Acute Myocardial Infarction',
-                '428': 'Heart Failure',
-                '486': 'Pneumonia',
-                '038': 'Septicemia',
-                '518': 'Respiratory Failure',
-                '584': 'Acute Kidney Failure',
-                '250': 'Diabetes Mellitus',
-                '427': 'Cardiac Dysrhythmias'
-            }
-            
-            category_counts = diagnoses['category'].value_counts().head(20)
+            rollup = self.categorizer.rollup(diagnoses, top=20)
             
             diagnosis_stats = {
                 'total_diagnoses': len(diagnoses),
-                'top_categories': {icd_mapping.get(cat, cat): count 
-                                for cat, count in category_counts.items()},
+                'top_categories': rollup['category'],
+                'chapters': rollup['chapter'],
+                'blocks': rollup['block'],
+                'top_codes': rollup['code'],
                 'diagnoses_per_admission': diagnoses.groupby('hadm_id').size().mean()
             }
             
             self.processed_data['diagnoses'] = diagnosis_stats
     
-    def process_vital_signs(self):
-        """Process vital signs from chart events"""
+    def process_vital_signs(self, chunksize=1_000_000):
+        """Process vital signs from chart events in a single streaming pass"""
+        if 'chartevents' not in self.data and 'chartevents' not in self.table_paths:
+            return
+        
+        # Exact per-itemid moments; memory is bounded by the chunk size
+        moments = RunningMoments()
+        self._accumulate_vitals(moments, chunksize)
+        
+        self.processed_data['vital_signs'] = self._summarize_vitals(moments)
+    
+    def _accumulate_vitals(self, moments, chunksize, track_time=False, since=None):
+        """Fold vital sign values from chartevents into per-itemid moments
+        
+        With track_time, rows charted at or before since are skipped and the
+        latest charttime seen is returned.
+        """
+        all_item_ids = [item_id for item_ids in self.VITAL_SIGN_ITEMS.values() for item_id in item_ids]
+        
         if 'chartevents' in self.data:
-            chart_events = self.data['chartevents']
-            
-            # Common vital sign item IDs (simplified)
-            vital_signs_items = {
-                'Heart Rate': [220045, 220050],
-                'Blood Pressure': [220179, 220180],
-                'Respiratory Rate': [220210, 224690],
-                'Temperature': [223761, 223762],
-                'SpO2': [220277, 220278]
-            }
-            
-            vital_stats = {}
-            
-            for vital_name, item_ids in vital_signs_items.items():
-                vital_data = chart_events[chart_events['itemid'].isin(item_ids)]
-                if len(vital_data) > 0 and 'valuenum' in vital_data.columns:
-                    vital_stats[vital_name] = {
-                        'mean': vital_data['valuenum'].mean(),
-                        'std': vital_data['valuenum'].std(),
-                        'count': len(vital_data)
-                    }
+            chunks = [self.data['chartevents']]
+        else:
+            filepath = self.table_paths['chartevents']
+            options = self._table_options('chartevents', filepath)
+            if track_time:
+                options['usecols'] = options['usecols'] + ['charttime']
+                options['parse_dates'] = options['parse_dates'] + ['charttime']
+            chunks = self._iter_table(filepath, chunksize, **options)
+        
+        latest = None
+        for chunk in chunks:
+            if 'valuenum' not in chunk.columns:
+                continue
+            if track_time:
+                charttime = pd.to_datetime(chunk['charttime'])
+                if since is not None:
+                    chunk = chunk[charttime > since]
+                    charttime = charttime[charttime > since]
+                chunk_latest = charttime.max()
+                if pd.notna(chunk_latest) and (latest is None or chunk_latest > latest):
+                    latest = chunk_latest
+            chunk = chunk[chunk['itemid'].isin(all_item_ids)]
+            moments.update(chunk['itemid'], chunk['valuenum'])
+        
+        return latest
+    
+    def _summarize_vitals(self, moments):
+        """Per-vital pooled statistics with a per-itemid breakdown"""
+        item_stats = moments.summary()
+        vital_stats = {}
+        
+        for vital_name, item_ids in self.VITAL_SIGN_ITEMS.items():
+            pooled = moments.combined(item_ids)
+            if pooled is not None:
+                pooled['items'] = {int(item_id): item_stats[item_id]
+                                   for item_id in item_ids if item_id in item_stats}
+                vital_stats[vital_name] = pooled
+        
+        return vital_stats
+    
+    def process_fluid_balance(self, chunksize=1_000_000, bin_seconds=3600):
+        """ICU intake/output/net fluid balance per stay, streamed from the ICU event tables"""
+        balance = self._fluid_balance(chunksize, bin_seconds)
+        if balance is not None:
+            stay_starts = self.data['icustays'].set_index('stay_id')['intime'] if 'icustays' in self.data else None
+            self.processed_data['fluid_balance'] = self._fluid_balance_summary(balance, stay_starts)
+    
+    def _fluid_balance(self, chunksize=1_000_000, bin_seconds=3600):
+        """FluidBalance accumulator over the ICU event tables, or None without any of them"""
+        balance = FluidBalance(bin_seconds)
+        updates = [('ingredientevents', balance.update_ingredients),
+                   ('inputevents', balance.update_inputs),
+                   ('outputevents', balance.update_outputs)]
+        
+        found = False
+        for table, update in updates:
+            if table in self.data:
+                chunks = [self.data[table]]
+            elif table in self.table_paths:
+                filepath = self.table_paths[table]
+                chunks = self._iter_table(filepath, chunksize, **self._table_options(table, filepath))
+            else:
+                continue
+            found = True
+            for chunk in chunks:
+                update(chunk)
+        
+        return balance if found else None
+    
+    def _fluid_balance_summary(self, balance, stay_starts=None):
+        try:
+            items = np.union1d(balance.output_items.index.to_numpy(dtype='int64'),
+                               balance.ingredients.index.get_level_values(0).to_numpy(dtype='int64'))
+            labels = self.dictionaries.labels('d_items', items)
+            item_labels = {item: label for item, label in zip(items.tolist(), labels) if pd.notna(label)}
+        except FileNotFoundError:
+            item_labels = None
+        
+        return balance.summary(stay_starts, item_labels)
+    
+    def process_medications(self, chunksize=1_000_000, hadm_ids=None, start=None, end=None, top_drugs=25):
+        """Drug administration volumes, order-to-dose latency and pharmacy workload
+        
+        Streams emar through a join with pharmacy and prescriptions; hadm_ids
+        and the [start, end) window are applied to every chunk as it is read.
+        """
+        analytics = self._medication_analytics(chunksize, hadm_ids, start, end)
+        if analytics is not None:
+            self.processed_data['medications'] = analytics.summary(top_drugs)
+    
+    def _medication_analytics(self, chunksize=1_000_000, hadm_ids=None, start=None, end=None):
+        """MedicationAnalytics over prescriptions, pharmacy and emar, or None without pharmacy/emar"""
+        sources = {table: self._table_source(table) for table in ('prescriptions', 'pharmacy', 'emar')}
+        if sources['pharmacy'] is None or sources['emar'] is None:
+            return None
+        
+        # Order side first, then the administrations are probed against it
+        analytics = MedicationAnalytics()
+        steps = [('prescriptions', None, analytics.add_prescriptions),
+                 ('pharmacy', 'entertime', analytics.add_pharmacy),
+                 ('emar', 'charttime', analytics.update)]
+        
+        for table, time_column, consume in steps:
+            filepath = sources[table]
+            if filepath is None:
+                continue
+            for chunk in self._iter_table(filepath, chunksize, **self._table_options(table, filepath)):
+                consume(pushdown(chunk, hadm_ids, time_column, start, end))
+        return analytics
+    
+    def process_microbiology(self):
+        """Cultures by specimen, test and organism, with organism growth rates"""
+        self._process_event_section('microbiology')
+    
+    def process_procedures(self):
+        """ICD, ICU and HCPCS procedures by code, with ICU procedure durations"""
+        self._process_event_section('procedures')
+    
+    def process_datetime_events(self):
+        """Date-valued ICU charting (e.g. last dose, line insertion) by item"""
+        self._process_event_section('datetime_events')
+    
+    def _process_event_section(self, section, chunksize=1_000_000, top=20):
+        """Stream every event table of a section through its EVENT_TABLES spec"""
+        aggregators = self._event_aggregators(section, chunksize)
+        if aggregators:
+            self.processed_data[section] = self._event_section_summary(aggregators, top)
+    
+    def _event_aggregators(self, section, chunksize=1_000_000):
+        """EventAggregator per event table of a section that has a source"""
+        aggregators = {}
+        for table in EVENT_SECTIONS[section]:
+            filepath = self._table_source(table)
+            if filepath is None:
+                continue
             
-            self.processed_data['vital_signs'] = vital_stats
+            spec = EVENT_TABLES[table]
+            aggregator = EventAggregator(spec)
+            options = read_options(spec, self._table_columns(filepath))
+            for chunk in self._iter_table(filepath, chunksize, **options):
+                aggregator.update(chunk)
+            aggregators[table] = aggregator
+        return aggregators
+    
+    def _event_section_summary(self, aggregators, top=20):
+        return {table: aggregator.summary(top, self._dictionary_labels) for table, aggregator in aggregators.items()}
+    
+    def _dictionary_labels(self, dictionary, keys):
+        """Labels of keys given as one array per dictionary key column (None without the dictionary)"""
+        spec = DICTIONARIES[dictionary]
+        key_values = [pd.Series(values).astype(spec['dtypes'].get(key, object))
+                      for key, values in zip(spec['key'], keys)]
+        try:
+            return self.dictionaries.labels(dictionary, *key_values)
+        except FileNotFoundError:
+            return None
+    
+    def process_incremental(self, state_file='incremental_state.json', chunksize=1_000_000):
+        """Fold rows past each table's high-water mark into saved per-section aggregates
+        
+        Covers the admissions, icu, transfers, lab_events, diagnoses and
+        vital_signs sections; the cost of a run is proportional to the new rows.
+        """
+        state = IncrementalState(state_file)
+        
+        for section, (table, mark_column) in self.INCREMENTAL_SECTIONS.items():
+            if table not in self.data:
+                continue
+            if table in self.INCREMENTAL_KEYED_TABLES:
+                rows = state.unseen_rows(table, self.data[table], mark_column)
+            else:
+                rows = state.new_rows(table, self.data[table], mark_column)
+            section_state = state.section(section)
+            getattr(self, f'_fold_{section}')(section_state, rows)
+            self.processed_data[section] = getattr(self, f'_finalize_{section}')(section_state)
+            print(f"{section}: folded {len(rows)} new {table} rows")
+        
+        if 'chartevents' in self.data or 'chartevents' in self.table_paths:
+            section_state = state.section('vital_signs')
+            moments = RunningMoments.from_dict(section_state.get('moments'))
+            latest = self._accumulate_vitals(moments, chunksize, track_time=True,
+                                             since=state.watermark('chartevents'))
+            state.advance('chartevents', latest)
+            section_state['moments'] = moments.to_dict()
+            self.processed_data['vital_signs'] = self._summarize_vitals(moments)
+        
+        state.save()
+    
+    def _fold_demographics(self, state, rows):
+        add_total(state, 'total', len(rows))
+        add_total(state, 'deaths', int(rows['dod'].notna().sum()))
+        add_counts(state, 'genders', rows['gender'].value_counts())
+        add_counts(state, 'age_groups', pd.cut(rows['anchor_age'], bins=AGE_BINS, labels=AGE_LABELS,
+                                               right=False).value_counts())
+    
+    def _finalize_demographics(self, state):
+        age_groups = state.get('age_groups', {})
+        
+        return {
+            'gender_distribution': sorted_counts(state.get('genders', {})),
+            'age_distribution': sorted_counts({label: age_groups.get(label, 0) for label in AGE_LABELS}),
+            'total_patients': state['total'],
+            'mortality_count': state['deaths']
+        }
+    
+    def _fold_admissions(self, state, rows):
+        admittime = pd.to_datetime(rows['admittime'])
+        los = (pd.to_datetime(rows['dischtime']) - admittime).dt.days
+        
+        add_total(state, 'total', len(rows))
+        add_counts(state, 'admission_types', rows['admission_type'].value_counts())
+        add_counts(state, 'admission_locations', rows['admission_location'].value_counts())
+        add_counts(state, 'discharge_locations', rows['discharge_location'].value_counts())
+        add_total(state, 'los_sum', float(los.sum()))
+        add_total(state, 'los_count', int(los.count()))
+        add_total(state, 'expired', int(rows['hospital_expire_flag'].sum()))
+        add_counts(state, 'monthly', admittime.dt.month.value_counts())
+        add_to_sketch(state, 'los_days_sketch', QuantileSketch,
+                      (pd.to_datetime(rows['dischtime']) - admittime).dt.total_seconds() / 86400)
+        add_to_sketch(state, 'patients_sketch', HyperLogLog, rows['subject_id'])
+    
+    def _finalize_admissions(self, state):
+        months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 
+                 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+        monthly = sorted((int(month), count) for month, count in state.get('monthly', {}).items())
+        
+        return {
+            'total_admissions': state['total'],
+            'admission_types': sorted_counts(state.get('admission_types', {})),
+            'admission_locations': sorted_counts(state.get('admission_locations', {})),
+            'discharge_locations': sorted_counts(state.get('discharge_locations', {})),
+            'avg_length_of_stay': state['los_sum'] / state['los_count'] if state['los_count'] else np.nan,
+            'los_percentiles': load_sketch(state, 'los_days_sketch', QuantileSketch).summary(self.LOS_PERCENTILES),
+            'unique_patients': load_sketch(state, 'patients_sketch', HyperLogLog).count(),
+            'mortality_rate': (state['expired'] / state['total']) * 100 if state['total'] else np.nan,
+            'seasonal_patterns': {months[month - 1]: count for month, count in monthly}
+        }
+    
+    def _fold_icu(self, state, rows):
+        add_total(state, 'total', len(rows))
+        add_counts(state, 'care_units', rows['first_careunit'].value_counts())
+        add_total(state, 'los_sum', float(rows['los'].sum()))
+        add_total(state, 'los_count', int(rows['los'].count()))
+        
+        by_unit = rows.groupby('first_careunit', observed=True)['los']
+        add_counts(state, 'los_sum_by_unit', by_unit.sum())
+        add_counts(state, 'los_count_by_unit', by_unit.count())
+        
+        add_to_sketch(state, 'los_sketch', QuantileSketch, rows['los'])
+        add_to_sketch(state, 'los_by_unit_sketch', GroupedQuantileSketch,
+                      rows['first_careunit'].astype(object), rows['los'])
+        add_to_sketch(state, 'patients_sketch', HyperLogLog, rows['subject_id'])
+    
+    def _finalize_icu(self, state):
+        los_sums = state.get('los_sum_by_unit', {})
+        
+        return {
+            'total_icu_stays': state['total'],
+            'care_units': sorted_counts(state.get('care_units', {})),
+            'avg_icu_los': state['los_sum'] / state['los_count'] if state['los_count'] else np.nan,
+            'los_by_unit': {unit: los_sums.get(unit, 0) / count
+                            for unit, count in sorted(state.get('los_count_by_unit', {}).items())},
+            'los_percentiles': load_sketch(state, 'los_sketch', QuantileSketch).summary(self.LOS_PERCENTILES),
+            'los_percentiles_by_unit': load_sketch(state, 'los_by_unit_sketch',
+                                                   GroupedQuantileSketch).summary(self.LOS_PERCENTILES),
+            'unique_patients': load_sketch(state, 'patients_sketch', HyperLogLog).count()
+        }
+    
+    def _fold_transfers(self, state, rows):
+        add_total(state, 'total', len(rows))
+        add_counts(state, 'care_unit_volumes', rows['careunit'].value_counts())
+        
+        ordered = rows.sort_values(self.TRANSFER_ORDER, kind='stable')
+        edges = self._transfer_edges(ordered)
+        
+        # Pair each admission's first new transfer with the last unit seen in earlier runs
+        # (keyed by hadm_id; rows without an admission form no edge)
+        last_units = state.setdefault('admission_last_unit', {})
+        admitted = ordered[ordered['hadm_id'].notna().to_numpy()]
+        admission_keys = admitted['hadm_id'].astype('int64').astype(str)
+        first = ~admission_keys.duplicated().to_numpy()
+        first_rows, first_keys = admitted[first], admission_keys[first]
+        carried = pd.DataFrame({
+            'from_unit': first_keys.map(last_units),
+            'to_unit': first_rows['careunit'].astype(object)
+        }).dropna()
+        edges = pd.concat([edges.astype(object), carried], ignore_index=True)
+        
+        flow = state.setdefault('flow', {})
+        for (from_unit, to_unit), count in edges.groupby(['from_unit', 'to_unit']).size().items():
+            add_counts(flow, from_unit, {to_unit: count})
+        
+        last = ~admission_keys.duplicated(keep='last').to_numpy()
+        for hadm_id, unit in zip(admission_keys[last], admitted['careunit'][last].astype(object)):
+            last_units[hadm_id] = None if pd.isna(unit) else unit
+        
+        # ...and the first unit ever seen, so a later partition's state can be chained after this one
+        first_units = state.setdefault('admission_first_unit', {})
+        for hadm_id, unit in zip(first_keys, first_rows['careunit'].astype(object)):
+            first_units.setdefault(hadm_id, None if pd.isna(unit) else unit)
+    
+    def _merge_transfers(self, state, other):
+        """Add the state of the rows that follow state's (a later partition) to state
+        
+        Besides the sums, each admission's last unit in state and first unit
+        in other form one more edge of the flow.
+        """
+        other = dict(other)
+        last_units, first_units = state.pop('admission_last_unit', {}), state.pop('admission_first_unit', {})
+        later_last, later_first = other.pop('admission_last_unit', {}), other.pop('admission_first_unit', {})
+        merge_states(state, other)
+        
+        flow = state.setdefault('flow', {})
+        for hadm_id, unit in later_first.items():
+            if unit is not None and last_units.get(hadm_id) is not None:
+                add_counts(flow, last_units[hadm_id], {unit: 1})
+        
+        state['admission_last_unit'] = {**last_units, **later_last}
+        state['admission_first_unit'] = {**later_first, **first_units}
+        return state
+    
+    def _finalize_transfers(self, state):
+        return {
+            'total_transfers': state['total'],
+            'care_unit_volumes': sorted_counts(state.get('care_unit_volumes', {})),
+            'transfer_flow': {from_unit: dict(sorted(to_units.items()))
+                              for from_unit, to_units in sorted(state.get('flow', {}).items())}
+        }
+    
+    def _fold_lab_events(self, state, rows):
+        charttime = pd.to_datetime(rows['charttime'])
+        
+        add_total(state, 'total', len(rows))
+        add_counts(state, 'hourly', charttime.dt.hour.value_counts())
+        add_counts(state, 'daily', charttime.dt.dayofweek.value_counts().rename(index=lambda day: DAY_NAMES[day]))
+        if 'itemid' in rows.columns:
+            add_counts(state, 'items', rows['itemid'].value_counts())
+    
+    def _finalize_lab_events(self, state):
+        hourly = sorted((int(hour), count) for hour, count in state.get('hourly', {}).items())
+        # By itemid first, so ties in count keep the same order as process_lab_events
+        items = dict(sorted(state.get('items', {}).items(), key=lambda item: int(item[0])))
+        
+        return {
+            'total_lab_events': state['total'],
+            'hourly_frequency': dict(hourly),
+            'daily_frequency': sorted_counts(state.get('daily', {})),
+            'common_tests': dict(list(sorted_counts(items, int).items())[:10])
+        }
+    
+    # Incremental histogram per ICD level; keys are "<icd_version>:<key>"
+    DIAGNOSIS_LEVELS = {'category': 'categories', 'chapter': 'chapters', 'block': 'blocks', 'code': 'codes'}
+    
+    def _fold_diagnoses(self, state, rows):
+        add_total(state, 'total', len(rows))
+        for level, counts in self.categorizer.count_levels(rows, list(self.DIAGNOSIS_LEVELS)).items():
+            add_counts(state, self.DIAGNOSIS_LEVELS[level],
+                       {f"{version}:{key}": count for (version, key), count in counts.items()})
+        # Diagnoses arrive per admission, so new rows never extend an old admission
+        add_total(state, 'admissions', int(rows['hadm_id'].nunique()))
+    
+    def _finalize_diagnoses(self, state):
+        rollup = {}
+        for level, name in self.DIAGNOSIS_LEVELS.items():
+            # Categories of older state files have no version prefix
+            histogram = {key.rpartition(':'): count for key, count in state.get(name, {}).items()}
+            ranked = sorted(histogram.items(), key=lambda item: (-item[1], int(item[0][0] or 0), item[0][2]))
+            keys = [key for key, _ in ranked]
+            index = pd.MultiIndex.from_arrays([[int(version or 0) for version, _, _ in keys],
+                                               [key for _, _, key in keys]])
+            counts = pd.Series([count for _, count in ranked], index=index, dtype='int64')
+            # Labelled in full: same-named entries merge before the top-20 cut
+            rollup[level] = self.categorizer.label(counts, level, top=20)
+        
+        return {
+            'total_diagnoses': state['total'],
+            'top_categories': rollup['category'],
+            'chapters': rollup['chapter'],
+            'blocks': rollup['block'],
+            'top_codes': rollup['code'],
+            'diagnoses_per_admission': state['total'] / state['admissions'] if state['admissions'] else np.nan
+        }
+    
+    # Partitioned mode: each partition's partial state is reduced by merge_partial
+    # and finalize_partial (see partitioned.py)
+    
+    # Source tables of the census sections, shipped as stay intervals rather than aggregates
+    STAY_TABLES = ['transfers', 'icustays', 'services']
+    
+    def partial_state(self, chunksize=1_000_000):
+        """Mergeable state of every section over the loaded (and streamed) tables
+        
+        Counts, sums, histograms and sketch states use the incremental
+        folds; the lab, fluid, medication and event sections keep their
+        accumulators. Census needs the stays themselves, so the (projected)
+        stay tables are included as they are.
+        """
+        partial = {}
+        if 'patients' in self.data:
+            partial['demographics'] = {}
+            self._fold_demographics(partial['demographics'], self.data['patients'])
+        for section, (table, _) in self.INCREMENTAL_SECTIONS.items():
+            if table in self.data:
+                partial[section] = {}
+                getattr(self, f'_fold_{section}')(partial[section], self.data[table])
+        
+        if 'chartevents' in self.data or 'chartevents' in self.table_paths:
+            moments = RunningMoments()
+            self._accumulate_vitals(moments, chunksize)
+            partial['vital_signs'] = moments
+        
+        accumulators = {
+            'lab_analytics': self._lab_analytics(chunksize),
+            'fluid_balance': self._fluid_balance(chunksize),
+            'medications': self._medication_analytics(chunksize)
+        }
+        partial.update({section: state for section, state in accumulators.items() if state is not None})
+        
+        for section in EVENT_SECTIONS:
+            aggregators = self._event_aggregators(section, chunksize)
+            if aggregators:
+                partial[section] = aggregators
+        
+        partial['stays'] = {table: self.data[table] for table in self.STAY_TABLES if table in self.data}
+        return partial
+    
+    def merge_partial(self, partial, other):
+        """Combine two partial states; for time slices, other holds the later rows"""
+        for section, state in other.items():
+            if section not in partial:
+                partial[section] = state
+            elif section == 'stays':
+                for table, rows in state.items():
+                    partial['stays'][table] = pd.concat([partial['stays'][table], rows], ignore_index=True) \
+                        if table in partial['stays'] else rows
+            elif section in EVENT_SECTIONS:
+                for table, aggregator in state.items():
+                    if table in partial[section]:
+                        partial[section][table].merge(aggregator)
+                    else:
+                        partial[section][table] = aggregator
+            elif hasattr(state, 'merge'):
+                partial[section].merge(state)
+            elif hasattr(self, f'_merge_{section}'):
+                getattr(self, f'_merge_{section}')(partial[section], state)
+            else:
+                merge_states(partial[section], state)
+        return partial
+    
+    def finalize_partial(self, partial, top=20):
+        """Fill processed_data from a merged partial state"""
+        for section in ['demographics'] + list(self.INCREMENTAL_SECTIONS):
+            if section in partial:
+                self.processed_data[section] = getattr(self, f'_finalize_{section}')(partial[section])
+        
+        if 'vital_signs' in partial:
+            self.processed_data['vital_signs'] = self._summarize_vitals(partial['vital_signs'])
+        if 'lab_analytics' in partial:
+            self.processed_data['lab_analytics'] = self._lab_analytics_summary(partial['lab_analytics'])
+        if 'medications' in partial:
+            self.processed_data['medications'] = partial['medications'].summary()
+        for section in EVENT_SECTIONS:
+            if section in partial:
+                self.processed_data[section] = self._event_section_summary(partial[section], top)
+        
+        # Census sections run on the stays of all partitions
+        self.data.update(partial.get('stays', {}))
+        if 'fluid_balance' in partial:
+            stay_starts = self.data['icustays'].set_index('stay_id')['intime'] if 'icustays' in self.data else None
+            self.processed_data['fluid_balance'] = self._fluid_balance_summary(partial['fluid_balance'], stay_starts)
+        if 'transfers' in self.data or 'icustays' in self.data:
+            self.process_occupancy()
+        self.generate_room_based_analytics()
     
     def generate_room_based_analytics(self):
         """Generate analytics based on room/care unit data"""
         room_analytics = {}
-        
-        # Map care units to room types from room-content.js
-        room_mapping = {
-            'Emergency Department': 'emergency',
-            'Medical Intensive Care Unit (MICU)': 'monitoring',
-            'Surgical Intensive Care Unit (SICU)': 'surgery',
-            'Coronary Care Unit (CCU)': 'cardiac',
-            'Neuro Stepdown': 'neurology',
-            'Medicine': 'treatment',
-            'Surgery': 'surgery'
-        }
+        room_mapping = self.ROOM_MAPPING
         
         if 'transfers' in self.processed_data:
             care_unit_data = self.processed_data['transfers']['care_unit_volumes']
@@ -263,55 +1000,224 @@ class HospitalDataProcessor:
                 if room_type not in room_analytics:
                     room_analytics[room_type] = {
                         'patient_volume': 0,
-                        'avg_utilization': 0,
+                        'avg_utilization': None,
                         'care_units': []
                     }
                 
                 room_analytics[room_type]['patient_volume'] += volume
                 room_analytics[room_type]['care_units'].append(unit)
         
-        # Add utilization estimates
-        for room_type in room_analytics:
-            room_analytics[room_type]['avg_utilization'] = np.random.uniform(60, 95)
+        # Precomputed dashboard aggregates (including utilization from the census
+        # engine), so room panels need not parse raw CSVs
+        if 'transfers' in self.data:
+            for room_type, aggregates in self._room_dashboard_aggregates().items():
+                if room_type in room_analytics:
+                    room_analytics[room_type].update(aggregates)
         
         self.processed_data['room_analytics'] = room_analytics
     
-    def export_for_visualization(self, output_file='visualization_data.json'):
-        """Export processed data for web visualization"""
+    def _room_dashboard_aggregates(self):
+        """Per-room arrivals/departures/census by hour, utilization, LOS bins, flows and service mix
+        
+        Hourly series are plain 24-element lists (index = hour of day).
+        """
+        transfers = self.data['transfers']
+        rooms = transfers['careunit'].map(lambda unit: self.ROOM_MAPPING.get(unit, 'other'))
+        stays = pd.DataFrame({
+            'room': rooms.astype(object),
+            'intime': transfers['intime'],
+            'outtime': transfers['outtime']
+        }).dropna(subset=['room', 'intime'])
+        
+        aggregates = defaultdict(dict)
+        hours = range(24)
+        
+        # Arrivals and departures by hour of day
+        arrivals = stays.groupby(['room', stays['intime'].dt.hour]).size()
+        departures = stays.groupby(['room', stays['outtime'].dt.hour]).size()
+        for room_type in stays['room'].unique():
+            aggregates[room_type]['arrivals_by_hour'] = [int(arrivals.get((room_type, h), 0)) for h in hours]
+            aggregates[room_type]['departures_by_hour'] = [int(departures.get((room_type, h), 0)) for h in hours]
+        
+        # Average census at each hour of day, and time-weighted utilization
+        occupancy = Occupancy(stays['room'], stays['intime'], stays['outtime'])
+        for room_type in occupancy.units:
+            aggregates[room_type]['census_by_hour'] = self._average_census_by_hour(occupancy, room_type)
+            summary = occupancy.summary(room_type, self.OCCUPANCY_RESOLUTION, self._room_capacity(room_type))
+            aggregates[room_type]['avg_utilization'] = summary['utilization']
+            aggregates[room_type]['occupancy'] = summary
+        
+        # Length of stay distribution (same bins as the room panels)
+        los_hours = (stays['outtime'] - stays['intime']).dt.total_seconds() / 3600
+        los_bins = pd.cut(los_hours, bins=[0, 24, 72, 168, np.inf], right=False,
+                          labels=['< 24h', '1-3 days', '3-7 days', '> 7 days'])
+        los_counts = stays.groupby(['room', los_bins], observed=False).size()
+        for (room_type, los_bin), count in los_counts.items():
+            aggregates[room_type].setdefault('los_distribution', {})[los_bin] = int(count)
+        
+        # Inbound and outbound flows between rooms
+        ordered = transfers.sort_values(self.TRANSFER_ORDER, kind='stable')
+        edges = self._transfer_edges(ordered)
+        edges = pd.DataFrame({
+            'from_room': edges['from_unit'].astype(object).map(lambda unit: self.ROOM_MAPPING.get(unit, 'other')),
+            'to_room': edges['to_unit'].astype(object).map(lambda unit: self.ROOM_MAPPING.get(unit, 'other'))
+        })
+        edges = edges[edges['from_room'] != edges['to_room']]
+        for (from_room, to_room), count in edges.groupby(['from_room', 'to_room']).size().items():
+            aggregates[to_room].setdefault('inbound', {})[from_room] = int(count)
+            aggregates[from_room].setdefault('outbound', {})[to_room] = int(count)
+        
+        # Service mix: the service each stay was under when it entered the room
+        if 'services' in self.data and 'hadm_id' in transfers.columns:
+            services = self.data['services'].dropna(subset=['hadm_id', 'transfertime'])
+            room_stays = pd.DataFrame({
+                'room': rooms.astype(object),
+                'hadm_id': transfers['hadm_id'],
+                'intime': transfers['intime']
+            }).dropna()
+            room_stays['hadm_id'] = room_stays['hadm_id'].astype('int64')
+            services = pd.DataFrame({
+                'hadm_id': services['hadm_id'].astype('int64'),
+                'transfertime': services['transfertime'],
+                'service': services['curr_service'].astype(object)
+            })
+            with_service = pd.merge_asof(
+                room_stays.sort_values('intime'), services.sort_values('transfertime'),
+                left_on='intime', right_on='transfertime', by='hadm_id', direction='backward')
+            service_mix = with_service.groupby(['room', 'service']).size()
+            for (room_type, service), count in service_mix.items():
+                aggregates[room_type].setdefault('service_mix', {})[service] = int(count)
+        
+        return aggregates
+    
+    def _average_census_by_hour(self, occupancy, unit):
+        """Mean number of occupants at each hour of day while the unit is in use
+        
+        Each stay's overlap with every hour of day is summed by the census
+        engine, so stays are never expanded into per-hour rows.
+        """
+        return [round(float(census), 4) for census in occupancy.hourly_census(unit)]
+    
+    def _room_capacity(self, room_type):
+        """Beds of a room type, when UNIT_CAPACITY covers all of its care units"""
+        units = [unit for unit, room in self.ROOM_MAPPING.items() if room == room_type]
+        if units and all(unit in self.UNIT_CAPACITY for unit in units):
+            return sum(self.UNIT_CAPACITY[unit] for unit in units)
+        return None
+    
+    def process_occupancy(self, resolution=None):
+        """Census, patient-days and utilization per care unit (transfers) and ICU (icustays)"""
+        resolution = resolution or self.OCCUPANCY_RESOLUTION
+        occupancy_stats = {'resolution': resolution}
+        
+        if 'transfers' in self.data:
+            transfers = self.data['transfers']
+            occupancy = Occupancy(transfers['careunit'], transfers['intime'], transfers['outtime'])
+            occupancy_stats['care_units'] = occupancy.summaries(resolution, self.UNIT_CAPACITY)
+        
+        if 'icustays' in self.data:
+            icu_stays = self.data['icustays']
+            occupancy = Occupancy(icu_stays['first_careunit'], icu_stays['intime'], icu_stays['outtime'])
+            occupancy_stats['icu_units'] = occupancy.summaries(resolution, self.UNIT_CAPACITY)
+            
+            all_icu = Occupancy(np.full(len(icu_stays), 'ICU', dtype=object),
+                                icu_stays['intime'], icu_stays['outtime'])
+            if len(all_icu.units):
+                # Summed beds only when every ICU unit has a capacity; otherwise no utilization
+                icu_capacity = None
+                if all(unit in self.UNIT_CAPACITY for unit in occupancy.units):
+                    icu_capacity = sum(self.UNIT_CAPACITY[unit] for unit in occupancy.units)
+                occupancy_stats['icu'] = all_icu.summary('ICU', resolution, icu_capacity)
+        
+        if len(occupancy_stats) > 1:
+            self.processed_data['occupancy'] = occupancy_stats
+    
+    def build_stay_index(self):
+        """Interval index over transfers and icustays for "who was where" queries"""
+        missing = [table for table in ('transfers', 'icustays') if table not in self.data]
+        if missing:
+            self.load_data(tables=missing)
+        
+        self.stay_index = StayIndex.from_tables(self.data.get('transfers'), self.data.get('icustays'))
+        return self.stay_index
+    
+    def export_stay_index(self, output_file='stay_index.json', compact=True, compression=None):
+        """Write the stay index as JSON for the 3D room explorer"""
+        if self.stay_index is None:
+            self.build_stay_index()
+        
+        output_file = write_json(self.stay_index.to_dict(), output_file, compact, compression)
+        self.exported_files.append(output_file)
+        print(f"Stay index exported to {output_file}")
+        return output_file
+    
+    def export_for_visualization(self, output_file='visualization_data.json', incremental_state=None,
+                                 compact=False, compression=None, sharded=False,
+                                 sections=None, stage_cache=None, workers=1, partial=None):
+        """Export processed data for web visualization
+        
+        Pass incremental_state (a state file path) to update the saved
+        aggregates with new rows only instead of recomputing from scratch
+        (the INCREMENTAL_FULL_STAGES sections are still recomputed in full),
+        or partial (merged partial states of a partitioned run) to export
+        the reduced result.
+        compact drops indentation and compression ('gzip' or 'brotli')
+        writes a compressed file with the matching suffix. With sharded,
+        each section goes to its own file in a directory named after
+        output_file (e.g. visualization_data/) alongside a manifest.json.
+        
+        sections limits processing to the named STAGES (plus their upstream
+        stages); stage_cache memoizes stage results in that directory and
+        workers runs independent stages concurrently. With sections, only
+        those sections are replaced in an existing output_file (or only
+        those shards are rewritten in an existing manifest when sharded).
+        """
         
         # Process all data
-        self.process_demographics()
-        self.process_admissions()
-        self.process_icu_data()
-        self.process_transfers()
-        self.process_lab_events()
-        self.process_diagnoses()
-        self.process_vital_signs()
-        self.generate_room_based_analytics()
+        if partial is not None:
+            self.finalize_partial(partial)
+        elif incremental_state:
+            self.process_demographics()
+            self.process_incremental(incremental_state)
+            StagePipeline(self, stage_cache).run(self.INCREMENTAL_FULL_STAGES, workers=workers)
+            self.process_occupancy()
+            self.generate_room_based_analytics()
+        else:
+            StagePipeline(self, stage_cache).run(sections, workers=workers)
         
-        # Convert numpy types to Python types for JSON serialization
-        def convert_types(obj):
-            if isinstance(obj, np.integer):
-                return int(obj)
-            elif isinstance(obj, np.floating):
-                return float(obj)
-            elif isinstance(obj, np.ndarray):
-                return obj.tolist()
-            elif isinstance(obj, dict):
-                return {key: convert_types(value) for key, value in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_types(item) for item in obj]
-            else:
-                return obj
+        # Sections in STAGES order, whatever order concurrent stages finished in
+        order = list(self.STAGES) + [name for name in self.processed_data if name not in self.STAGES]
+        export_data = {name: self.processed_data[name] for name in order
+                       if name in self.processed_data and (sections is None or name in sections)}
         
-        processed_data_clean = convert_types(self.processed_data)
+        # numpy/pandas types and NaN are encoded by the serializer in one pass
+        if sharded:
+            shard_dir = os.path.splitext(output_file)[0]
+            self.exported_files = write_shards(export_data, shard_dir, compact, compression,
+                                               update=sections is not None)
+            print(f"Processed data exported to {len(self.exported_files) - 1} shards in {shard_dir}/")
+        else:
+            output_file = write_json(export_data, output_file, compact, compression,
+                                     update=sections is not None)
+            self.exported_files = [output_file]
+            print(f"Processed data exported to {output_file}")
+        return self.processed_data
+    
+    def verify_backend(self, rtol=1e-6):
+        """Compare the sections computed by the backend with the pandas reference
         
-        # Export to JSON
-        with open(output_file, 'w') as f:
-            json.dump(processed_data_clean, f, indent=2, default=str)
+        Re-runs those stages on pandas and returns the paths whose values
+        differ (empty when the backends agree).
+        """
+        sections = [name for name in self.STAGES if self.backend.handles(name) and name in self.processed_data]
+        if not sections:
+            return []
         
-        print(f"Processed data exported to {output_file}")
-        return processed_data_clean
+        cache_dir = self.cache.cache_dir if self.cache is not None else None
+        reference = HospitalDataProcessor(self.hosp_dir, self.icu_dir, cache_dir=cache_dir)
+        StagePipeline(reference).run(sections)
+        return diff_results({name: reference.processed_data.get(name) for name in sections},
+                            {name: self.processed_data[name] for name in sections}, rtol)
     
     def generate_static_charts(self):
         """Generate static charts using matplotlib/seaborn"""
@@ -385,6 +1291,22 @@ class HospitalDataProcessor:
         
         print("Static charts saved as 'hospital_analytics_static.png'")
 
+def _load_table_job(processor_args, key, filepath, ipc_dir):
+    """Process-pool worker: parse one table and write it out as an Arrow IPC file"""
+    import pyarrow as pa
+    
+    start = time.perf_counter()
+    processor = HospitalDataProcessor(*processor_args)
+    df = processor._read_table(key, filepath, **processor._table_options(key, filepath))
+    
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ipc_path = os.path.join(ipc_dir, f"{key}.arrow")
+    with pa.OSFile(ipc_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    
+    cache_status = processor.cache.stats.get(key) if processor.cache is not None else None
+    return ipc_path, time.perf_counter() - start, cache_status
+
 def main():
     """Main function to process hospital data"""
     processor = HospitalDataProcessor()
@@ -392,8 +1314,8 @@ def main():
     # Load data
     processor.load_data()
     
-    # Export processed data for visualization
-    visualization_data = processor.export_for_visualization()
+    # Export processed data for visualization (as plain Python types for the summary below)
+    visualization_data = json.loads(dumps(processor.export_for_visualization()))
     
     # Generate static charts
     processor.generate_static_charts()
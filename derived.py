@@ -0,0 +1,99 @@
+"""
+Derived Columns
+===============
+
+Lazily computed features of the loaded tables (age group, length of stay,
+admission month, hour/day of week, ...), kept apart from the raw frames.
+
+Stages ask ``DerivedColumns.get(table, name)`` instead of adding columns to
+the shared frames in HospitalDataProcessor.data. Each feature is computed
+once per loaded frame, stored with a compact dtype (int8 hours and months,
+nullable Int32 days, categorical age groups) and reused by every later
+stage or re-run; datetime columns already parsed at load time are returned
+as they are, without a copy. Replacing a table in ``data`` invalidates its
+cached features.
+"""
+
+import weakref
+
+import pandas as pd
+
+AGE_BINS = [0, 18, 30, 40, 50, 60, 70, 80, 100]
+AGE_LABELS = ['0-17', '18-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
+
+
+def _datetime(values):
+    """values as datetime64; a no-op for columns parsed at load time"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values)
+
+
+def _age_group(derived, frame):
+    return pd.cut(frame['anchor_age'], bins=AGE_BINS, labels=AGE_LABELS, right=False)
+
+
+def _los(derived, frame):
+    """Length of stay in whole days"""
+    stay = derived.get('admissions', 'dischtime') - derived.get('admissions', 'admittime')
+    return stay.dt.days.astype('Int32')
+
+
+def _stay_days(derived, frame):
+    """Length of stay in fractional days"""
+    stay = derived.get('admissions', 'dischtime') - derived.get('admissions', 'admittime')
+    return (stay.dt.total_seconds() / 86400).astype('float32')
+
+
+def _datetime_part(table, column, part):
+    def derive(derived, frame):
+        values = getattr(derived.get(table, column).dt, part)
+        return values.astype('int8') if not values.isna().any() else values.astype('Int8')
+    return derive
+
+
+def _parsed(table, column):
+    return lambda derived, frame: _datetime(frame[column])
+
+
+# (table, feature) -> function(derived, frame) returning a Series aligned with frame
+DERIVED_COLUMNS = {
+    ('patients', 'age_group'): _age_group,
+    ('admissions', 'admittime'): _parsed('admissions', 'admittime'),
+    ('admissions', 'dischtime'): _parsed('admissions', 'dischtime'),
+    ('admissions', 'los'): _los,
+    ('admissions', 'stay_days'): _stay_days,
+    ('admissions', 'month'): _datetime_part('admissions', 'admittime', 'month'),
+    ('labevents', 'charttime'): _parsed('labevents', 'charttime'),
+    ('labevents', 'hour'): _datetime_part('labevents', 'charttime', 'hour'),
+    ('labevents', 'day_of_week'): _datetime_part('labevents', 'charttime', 'dayofweek')
+}
+
+
+class DerivedColumns:
+    """Derived features of the tables in owner.data (a HospitalDataProcessor)"""
+
+    def __init__(self, owner):
+        self.owner = owner
+        self._cache = {}
+
+    def get(self, table, name):
+        """Derived feature of a loaded table, computed on first use"""
+        frame = self.owner.data[table]
+        cached = self._cache.get((table, name))
+        if cached is not None and cached[0]() is frame:
+            return cached[1]
+
+        derive = DERIVED_COLUMNS.get((table, name))
+        if derive is None:
+            raise KeyError(f"No derived column {name!r} for table {table!r}")
+
+        values = derive(self, frame)
+        # Weak reference: a replaced table is neither kept alive nor served stale features
+        self._cache[(table, name)] = (weakref.ref(frame), values)
+        return values
+
+    def clear(self, table=None):
+        """Drop cached features (of one table, or all)"""
+        self._cache = {key: value for key, value in self._cache.items()
+                       if table is not None and key[0] != table}
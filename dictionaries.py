@@ -0,0 +1,140 @@
+"""
+MIMIC-IV Dictionary Lookups
+===========================
+
+Code -> label lookups for the MIMIC-IV dictionary tables (d_labitems,
+d_icd_diagnoses, d_icd_procedures, d_items, d_hcpcs).
+
+Each dictionary is loaded once, reduced to its key and label columns with
+compact dtypes (int32 item ids, categorical labels) and, when a TableCache
+is given, kept on disk as Parquet so later runs skip the CSV parse.
+Lookups are vectorized index lookups, meant to be applied after filtering
+to the rows actually emitted instead of merging whole dictionaries into
+whole event tables.
+
+ICD dictionaries are keyed on (icd_version, icd_code): the same code string
+can mean different things in ICD-9 and ICD-10.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# name -> directory key, key columns, label columns and compact dtypes
+DICTIONARIES = {
+    'd_labitems': {
+        'dir': 'hosp',
+        'key': ['itemid'],
+        'columns': ['label', 'fluid', 'category'],
+        'dtypes': {'itemid': 'int32', 'fluid': 'category', 'category': 'category'}
+    },
+    'd_icd_diagnoses': {
+        'dir': 'hosp',
+        'key': ['icd_version', 'icd_code'],
+        'columns': ['long_title'],
+        'dtypes': {'icd_version': 'int8', 'icd_code': 'str'}
+    },
+    'd_icd_procedures': {
+        'dir': 'hosp',
+        'key': ['icd_version', 'icd_code'],
+        'columns': ['long_title'],
+        'dtypes': {'icd_version': 'int8', 'icd_code': 'str'}
+    },
+    'd_items': {
+        'dir': 'icu',
+        'key': ['itemid'],
+        'columns': ['label', 'category', 'unitname'],
+        'dtypes': {'itemid': 'int32', 'category': 'category', 'unitname': 'category'}
+    },
+    'd_hcpcs': {
+        'dir': 'hosp',
+        'key': ['code'],
+        'columns': ['short_description', 'long_description'],
+        'dtypes': {'code': 'str'}
+    }
+}
+
+
+class DictionaryLookup:
+    def __init__(self, hosp_dir='hosp', icu_dir='icu', cache=None):
+        self.dirs = {'hosp': hosp_dir, 'icu': icu_dir}
+        self.cache = cache
+        self._tables = {}
+
+    def _source(self, name):
+        directory = self.dirs[DICTIONARIES[name]['dir']]
+        for ext in ('.parquet', '.csv.gz', '.csv'):
+            path = os.path.join(directory, name + ext)
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(f"Dictionary not found: {name} in {directory}")
+
+    def table(self, name):
+        """Compact dictionary frame indexed by its key column(s), loaded once"""
+        if name in self._tables:
+            return self._tables[name]
+
+        spec = DICTIONARIES[name]
+        path = self._source(name)
+        read_options = {'usecols': spec['key'] + spec['columns'], 'dtype': spec['dtypes']}
+
+        df = self.cache.load(name, path, read_options) if self.cache is not None else None
+        if df is None:
+            if path.endswith('.parquet'):
+                df = pd.read_parquet(path, columns=read_options['usecols'])
+            else:
+                df = pd.read_csv(path, **read_options)
+            for key in spec['key']:
+                if df[key].dtype == object or str(df[key].dtype) == 'str':
+                    df[key] = df[key].str.strip()
+            # Free-text labels repeat heavily, so categoricals keep them compact
+            for column in spec['columns']:
+                df[column] = df[column].astype('category')
+            if self.cache is not None:
+                self.cache.store(name, path, df, read_options)
+
+        df = df.drop_duplicates(spec['key']).set_index(spec['key'])
+        self._tables[name] = df
+        return df
+
+    def _positions(self, name, keys):
+        """Row of every key in the dictionary (-1 when unknown)"""
+        table = self.table(name)
+        if isinstance(table.index, pd.MultiIndex):
+            lookup = pd.MultiIndex.from_arrays([np.asarray(values) for values in keys])
+        else:
+            lookup = pd.Index(np.asarray(keys[0]))
+        return table.index.get_indexer(lookup)
+
+    def labels(self, name, *keys, column=None):
+        """Label for each key (NaN when unknown); keys follow the dictionary's key columns"""
+        table = self.table(name)
+        column = column or DICTIONARIES[name]['columns'][0]
+        positions = self._positions(name, keys)
+
+        values = table[column].astype(object).to_numpy()
+        labels = np.where(positions >= 0, values[positions], None)
+        return pd.Series(labels, dtype=object).where(positions >= 0)
+
+    def enrich(self, df, name):
+        """Add the dictionary's label columns to (already filtered) rows of df"""
+        spec = DICTIONARIES[name]
+        if df.empty or not all(key in df.columns for key in spec['key']):
+            return df
+
+        keys = []
+        for key in spec['key']:
+            values = df[key]
+            if key in ('icd_code', 'code'):
+                values = values.astype(str).str.strip()
+            keys.append(values.to_numpy())
+
+        table = self.table(name)
+        positions = self._positions(name, keys)
+        df = df.copy()
+        for column in spec['columns']:
+            values = table[column].astype(object).to_numpy()
+            df[column] = pd.Series(np.where(positions >= 0, values[positions], None),
+                                   index=df.index, dtype=object).where(positions >= 0)
+        return df
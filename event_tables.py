@@ -0,0 +1,245 @@
+"""
+Generic Event Tables
+====================
+
+One streaming reader and aggregator for the "long" event tables that only
+need counting and summarizing: microbiologyevents, procedures_icd,
+procedureevents, datetimeevents and hcpcsevents.
+
+Each table is described by an entry in EVENT_TABLES:
+
+    time       event time column (bucketed by hour of day and day of week)
+    date_only  the time column is a date, so there is no hour of day
+    groups     name -> key columns; events are counted per key
+    labels     group -> dictionary (see dictionaries.py) naming its keys;
+               the group's columns follow the dictionary's key columns
+    value      numeric column to summarize per key, or a (start, end) pair
+               of time columns for a duration in minutes
+    flag       column whose non-null rate is reported per key
+               (e.g. cultures that grew an organism)
+    flag_groups groups whose flag rate is reported (default: all); a group
+               keyed on the flag column itself would always be 1
+    distinct   id column whose distinct values are counted
+    dtypes     compact dtypes of the columns read
+
+The reader is derived from the entry: only the listed columns are read, with
+their dtypes and parsed dates, chunk by chunk. EventAggregator keeps
+bincounts, per-key counts, quantile sketches and HyperLogLogs, so memory
+depends on the number of keys rather than rows, and accumulators from
+different chunks or workers combine with merge(). Adding a table is one
+EVENT_TABLES entry plus its section in EVENT_SECTIONS.
+"""
+
+import numpy as np
+import pandas as pd
+
+from lab_analytics import DAY_NAMES
+from sketches import GroupedQuantileSketch, HyperLogLog
+
+EVENT_TABLES = {
+    'microbiologyevents': {
+        'time': 'charttime',
+        'groups': {'specimen': ['spec_type_desc'], 'test': ['test_name'], 'organism': ['org_name']},
+        'flag': 'org_name',
+        'flag_groups': ['specimen', 'test'],
+        'distinct': 'micro_specimen_id',
+        'dtypes': {'micro_specimen_id': 'int32', 'spec_type_desc': 'category',
+                   'test_name': 'category', 'org_name': 'category'}
+    },
+    'procedures_icd': {
+        'time': 'chartdate',
+        'date_only': True,
+        'groups': {'code': ['icd_version', 'icd_code']},
+        'labels': {'code': 'd_icd_procedures'},
+        'dtypes': {'icd_version': 'int8', 'icd_code': 'str'}
+    },
+    'procedureevents': {
+        'time': 'starttime',
+        'groups': {'item': ['itemid'], 'category': ['ordercategoryname']},
+        'labels': {'item': 'd_items'},
+        'value': ('starttime', 'endtime'),
+        'distinct': 'stay_id',
+        'dtypes': {'stay_id': 'int32', 'itemid': 'int32', 'ordercategoryname': 'category'}
+    },
+    'datetimeevents': {
+        'time': 'charttime',
+        'groups': {'item': ['itemid']},
+        'labels': {'item': 'd_items'},
+        'distinct': 'stay_id',
+        'dtypes': {'stay_id': 'int32', 'itemid': 'int32'}
+    },
+    'hcpcsevents': {
+        'time': 'chartdate',
+        'date_only': True,
+        'groups': {'code': ['hcpcs_cd'], 'section': ['short_description']},
+        'labels': {'code': 'd_hcpcs'},
+        'dtypes': {'hcpcs_cd': 'str', 'short_description': 'category'}
+    }
+}
+
+# Output section -> event tables summarized in it
+EVENT_SECTIONS = {
+    'microbiology': ['microbiologyevents'],
+    'procedures': ['procedures_icd', 'procedureevents', 'hcpcsevents'],
+    'datetime_events': ['datetimeevents']
+}
+
+VALUE_QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+
+def section_inputs(section):
+    """Event tables of a section plus the dictionaries naming their keys"""
+    tables = EVENT_SECTIONS[section]
+    dictionaries = [name for table in tables for name in EVENT_TABLES[table].get('labels', {}).values()]
+    return tables + list(dict.fromkeys(dictionaries))
+
+
+def _value_columns(spec):
+    value = spec.get('value')
+    if value is None:
+        return []
+    return list(value) if isinstance(value, tuple) else [value]
+
+
+def read_options(spec, available_columns):
+    """pandas read options (usecols/dtype/parse_dates) of an event table spec"""
+    available = set(available_columns)
+    group_columns = [column for columns in spec['groups'].values() for column in columns]
+    wanted = ['hadm_id', spec['time']] + group_columns + _value_columns(spec) + \
+        [spec[option] for option in ('flag', 'distinct') if spec.get(option)]
+    usecols = [column for column in dict.fromkeys(wanted) if column in available]
+
+    dtypes = dict(spec.get('dtypes', {}), hadm_id='Int32')
+    parse_dates = [spec['time']] + (list(spec['value']) if isinstance(spec.get('value'), tuple) else [])
+    return {
+        'usecols': usecols,
+        'dtype': {column: dtype for column, dtype in dtypes.items()
+                  if column in usecols and column not in parse_dates},
+        'parse_dates': [column for column in dict.fromkeys(parse_dates) if column in usecols]
+    }
+
+
+def _row_keys(chunk, columns):
+    """Key of every row of a group (NaN when any key column is missing)"""
+    if len(columns) == 1:
+        return chunk[columns[0]].astype(object)
+    missing = chunk[columns].isna().any(axis=1)
+    keys = chunk[columns[0]].astype(str)
+    for column in columns[1:]:
+        keys = keys + ':' + chunk[column].astype(str)
+    return keys.where(~missing)
+
+
+class EventAggregator:
+    def __init__(self, spec, relative_accuracy=0.01):
+        self.spec = spec
+        self.total = 0
+        self.hourly = np.zeros(24, dtype='int64')
+        self.daily = np.zeros(7, dtype='int64')
+        self.counts = {group: pd.Series(dtype='int64') for group in spec['groups']}
+        self.flagged = {group: pd.Series(dtype='int64') for group in spec['groups']}
+        self.values = {group: GroupedQuantileSketch(relative_accuracy) for group in spec['groups']}
+        self.admissions = HyperLogLog()
+        self.distinct = HyperLogLog()
+
+    def update(self, chunk):
+        """Fold one chunk read with read_options()"""
+        if chunk.empty:
+            return
+        spec = self.spec
+        self.total += len(chunk)
+
+        times = pd.to_datetime(chunk[spec['time']]).dropna()
+        if not spec.get('date_only'):
+            self.hourly += np.bincount(times.dt.hour.to_numpy(), minlength=24)
+        self.daily += np.bincount(times.dt.dayofweek.to_numpy(), minlength=7)
+
+        values = None
+        if isinstance(spec.get('value'), tuple):
+            start, end = spec['value']
+            values = ((pd.to_datetime(chunk[end]) - pd.to_datetime(chunk[start])).dt.total_seconds() / 60).to_numpy()
+        elif spec.get('value') in chunk.columns:
+            values = pd.to_numeric(chunk[spec['value']], errors='coerce').to_numpy(dtype='float64')
+
+        flag = chunk[spec['flag']].notna() if spec.get('flag') in chunk.columns else None
+        flag_groups = spec.get('flag_groups', spec['groups'])
+        for group, columns in spec['groups'].items():
+            if not all(column in chunk.columns for column in columns):
+                continue
+            keys = _row_keys(chunk, columns)
+            keyed = keys.notna().to_numpy()
+            self.counts[group] = self.counts[group].add(keys[keyed].value_counts(), fill_value=0).astype('int64')
+            if flag is not None and group in flag_groups:
+                flagged = keys[keyed & flag.to_numpy()].value_counts()
+                self.flagged[group] = self.flagged[group].add(flagged, fill_value=0).astype('int64')
+            if values is not None:
+                self.values[group].update(keys[keyed].to_numpy(), values[keyed])
+
+        if 'hadm_id' in chunk.columns:
+            self.admissions.update(chunk['hadm_id'])
+        if spec.get('distinct') in chunk.columns:
+            self.distinct.update(chunk[spec['distinct']])
+
+    def merge(self, other):
+        """Combine with the accumulator of another chunk range or worker"""
+        self.total += other.total
+        self.hourly += other.hourly
+        self.daily += other.daily
+        for group in self.counts:
+            self.counts[group] = self.counts[group].add(other.counts[group], fill_value=0).astype('int64')
+            self.flagged[group] = self.flagged[group].add(other.flagged[group], fill_value=0).astype('int64')
+            self.values[group].merge(other.values[group])
+        self.admissions.merge(other.admissions)
+        self.distinct.merge(other.distinct)
+        return self
+
+    def summary(self, top=20, labeler=None):
+        """Section of one event table
+
+        labeler(dictionary, key_columns) returns a label per key; it names the
+        keys of groups that have a dictionary in the spec.
+        """
+        spec = self.spec
+        summary = {
+            'total_events': self.total,
+            'unique_admissions': self.admissions.count()
+        }
+        if spec.get('distinct'):
+            summary[f"unique_{spec['distinct']}"] = self.distinct.count()
+        if not spec.get('date_only'):
+            summary['by_hour'] = {hour: int(count) for hour, count in enumerate(self.hourly)}
+        summary['by_day_of_week'] = {DAY_NAMES[day]: int(count) for day, count in enumerate(self.daily)}
+
+        groups, flag_rates, value_summaries, labels = {}, {}, {}, {}
+        flag_groups = spec.get('flag_groups', spec['groups'])
+        for group, columns in spec['groups'].items():
+            counts = self.counts[group].sort_values(ascending=False, kind='stable').head(top)
+            groups[group] = {str(key): int(count) for key, count in counts.items()}
+
+            if spec.get('flag') and group in flag_groups:
+                flagged = self.flagged[group].reindex(counts.index, fill_value=0)
+                flag_rates[group] = {str(key): flagged[key] / count for key, count in counts.items()}
+            if spec.get('value'):
+                value_summaries[group] = {str(key): stats for key, stats in
+                                          self.values[group].summary(VALUE_QUANTILES, keys=counts.index).items()}
+
+            dictionary = spec.get('labels', {}).get(group)
+            if dictionary and labeler is not None and len(counts):
+                keys = counts.index.to_series()
+                if len(columns) > 1:
+                    parts = keys.astype(str).str.split(':', n=len(columns) - 1, expand=True)
+                    key_columns = [parts[position] for position in range(len(columns))]
+                else:
+                    key_columns = [keys]
+                names = labeler(dictionary, key_columns)
+                if names is not None:
+                    labels[group] = {str(key): name for key, name in zip(counts.index, names) if pd.notna(name)}
+
+        summary['groups'] = groups
+        if flag_rates:
+            summary[f"{spec['flag']}_rate"] = flag_rates
+        if value_summaries:
+            summary['values'] = value_summaries
+        if labels:
+            summary['labels'] = labels
+        return summary
@@ -0,0 +1,286 @@
+"""
+ICU Fluid Balance
+=================
+
+Per-stay intake, output and net fluid balance in fixed time bins (hourly by
+default), streamed from ingredientevents, inputevents and outputevents.
+
+Intake is the water content of everything given: the ``Water`` ingredient
+of ingredientevents, which also covers drug diluents. Extracts without
+ingredientevents fall back to the volume-dosed rows of inputevents.
+Amounts are normalized to mL (and ingredient amounts to mL, grams or Kcal);
+a row with a rate but no amount gets rate x duration.
+
+An infusion's volume is spread uniformly over its ``starttime``-``endtime``
+window without expanding it into per-bin rows. Each infusion adds its rate
+at its start and removes it at its end, so the volume given up to time t is
+F(t) = t * sum(rate) - sum(rate * start) over the changes before t, and a
+bin's volume is F(right edge) - F(left edge). This costs one sort of the
+rate changes and one binary search per bin edge. Outputs are charted at a
+single time and go into that time's bin.
+
+FluidBalance keeps per-(stay, bin) totals, so chunks or workers combine
+with merge().
+"""
+
+import numpy as np
+import pandas as pd
+
+# Ingredient itemids counted as fluid intake (Water)
+WATER_ITEMS = (220490,)
+
+# Amount unit -> mL, and rate unit -> mL/hour
+VOLUME_UNITS = {'ml': 1.0, 'l': 1000.0, 'ul': 0.001}
+RATE_UNITS = {'ml/hour': 1.0, 'ml/min': 60.0}
+
+# Ingredient amount unit -> (reported unit, factor)
+INGREDIENT_UNITS = {
+    'ml': ('mL', 1.0), 'l': ('mL', 1000.0),
+    'kcal': ('Kcal', 1.0), 'kj': ('Kcal', 1 / 4.184),
+    'grams': ('grams', 1.0), 'mg': ('grams', 1e-3), 'mcg': ('grams', 1e-6)
+}
+
+BALANCE_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# ICU days reported in the net-balance-by-day profile
+ICU_DAYS = 7
+
+
+def _seconds(values):
+    return pd.to_datetime(values).to_numpy().astype('datetime64[s]').astype('int64')
+
+
+def _unit_factors(units, table):
+    """Conversion factor per row from a unit column (NaN for other units)"""
+    units = pd.Series(np.asarray(units, dtype=object)).str.lower()
+    return units.map(table).to_numpy(dtype='float64', na_value=np.nan)
+
+
+def normalized_volumes(chunk):
+    """mL given by each row of an inputevents/ingredientevents chunk"""
+    amount = chunk['amount'].to_numpy(dtype='float64', na_value=np.nan)
+    volume = amount * _unit_factors(chunk['amountuom'], VOLUME_UNITS)
+    if 'rate' in chunk.columns and 'rateuom' in chunk.columns:
+        hours = (_seconds(chunk['endtime']) - _seconds(chunk['starttime'])) / 3600
+        rate = chunk['rate'].to_numpy(dtype='float64', na_value=np.nan)
+        volume = np.where(np.isnan(volume), rate * _unit_factors(chunk['rateuom'], RATE_UNITS) * hours, volume)
+    return volume
+
+
+def allocate(keys, starts, ends, amounts, bin_seconds=3600):
+    """Spread amounts uniformly over [start, end) (epoch seconds) into fixed bins
+
+    Rows with end <= start go entirely into the bin of start. Returns a
+    Series of totals indexed by (key, bin), where bin * bin_seconds is the
+    bin's start in epoch seconds.
+    """
+    keys = np.asarray(keys, dtype='int64')
+    starts = np.asarray(starts, dtype='int64')
+    ends = np.asarray(ends, dtype='int64')
+    amounts = np.asarray(amounts, dtype='float64')
+
+    valid = np.isfinite(amounts) & (amounts != 0)
+    keys, starts, ends, amounts = keys[valid], starts[valid], ends[valid], amounts[valid]
+    point = ends <= starts
+
+    parts = [pd.DataFrame({'key': keys[point], 'bin': starts[point] // bin_seconds, 'amount': amounts[point]})]
+
+    keys, starts, ends, amounts = keys[~point], starts[~point], ends[~point], amounts[~point]
+    if len(keys):
+        unique_keys, ranks = np.unique(keys, return_inverse=True)
+        first_bin = np.full(len(unique_keys), np.iinfo('int64').max)
+        np.minimum.at(first_bin, ranks, starts // bin_seconds)
+        last_bin = np.zeros(len(unique_keys), dtype='int64')
+        np.maximum.at(last_bin, ranks, -(-ends // bin_seconds))
+
+        # Rate changes, timed relative to each key's first bin to keep the sums small
+        origin = first_bin * bin_seconds
+        rate = amounts / (ends - starts)
+        event_ranks = np.concatenate([ranks, ranks])
+        event_times = np.concatenate([starts - origin[ranks], ends - origin[ranks]])
+        event_rates = np.concatenate([rate, -rate])
+        order = np.lexsort((event_times, event_ranks))
+        event_ranks, event_times, event_rates = event_ranks[order], event_times[order], event_rates[order]
+
+        # Running sum(rate) and sum(rate * time), restarted at every key
+        key_first = np.searchsorted(event_ranks, np.arange(len(unique_keys)))
+        running_rate = np.cumsum(event_rates)
+        running_moment = np.cumsum(event_rates * event_times)
+        carried_rate = np.concatenate([[0.0], running_rate])[key_first]
+        carried_moment = np.concatenate([[0.0], running_moment])[key_first]
+        running_rate -= carried_rate[event_ranks]
+        running_moment -= carried_moment[event_ranks]
+
+        # Bin edges of every key, located among its rate changes by a composite sort key
+        edge_counts = last_bin - first_bin + 1
+        edge_ranks = np.repeat(np.arange(len(unique_keys)), edge_counts)
+        edge_steps = np.arange(edge_counts.sum()) - np.repeat(np.cumsum(edge_counts) - edge_counts, edge_counts)
+        edge_times = edge_steps * bin_seconds
+
+        span = int(max(event_times.max(), edge_times.max())) + 1
+        positions = np.searchsorted(event_ranks * span + event_times, edge_ranks * span + edge_times,
+                                    side='right') - 1
+        seen = positions >= key_first[edge_ranks]
+        clipped = np.maximum(positions, 0)
+        given = np.where(seen, edge_times * running_rate[clipped] - running_moment[clipped], 0.0)
+
+        # Volume per bin: difference of consecutive edges of the same key
+        inner = edge_steps[1:] > 0
+        parts.append(pd.DataFrame({
+            'key': unique_keys[edge_ranks[1:][inner]],
+            'bin': (first_bin[edge_ranks] + edge_steps)[:-1][inner],
+            'amount': np.diff(given)[inner]
+        }))
+
+    combined = pd.concat(parts, ignore_index=True)
+    totals = combined.groupby(['key', 'bin'])['amount'].sum()
+    # Bins outside every window can pick up float residue from the running sums
+    return totals[totals.abs() > 1e-6]
+
+
+class FluidBalance:
+    def __init__(self, bin_seconds=3600):
+        self.bin_seconds = bin_seconds
+        empty = pd.Series(dtype='float64', index=pd.MultiIndex.from_arrays([[], []], names=['key', 'bin']))
+        self.water = empty
+        self.inputs = empty
+        self.outputs = empty
+        self.input_categories = pd.Series(dtype='float64')
+        self.output_items = pd.Series(dtype='float64')
+        self.ingredients = pd.Series(dtype='float64')
+
+    @staticmethod
+    def _add(total, chunk_total):
+        return total.add(chunk_total, fill_value=0)
+
+    def update_ingredients(self, chunk):
+        """Fold an ingredientevents chunk: water intake and per-ingredient totals"""
+        chunk = chunk[chunk['stay_id'].notna() & chunk['starttime'].notna()]
+        if chunk.empty:
+            return
+
+        unit = pd.Series(chunk['amountuom'].astype(object)).str.lower().map(
+            {uom: name for uom, (name, _) in INGREDIENT_UNITS.items()})
+        factor = _unit_factors(chunk['amountuom'], {uom: f for uom, (_, f) in INGREDIENT_UNITS.items()})
+        amount = chunk['amount'].to_numpy(dtype='float64', na_value=np.nan) * factor
+        known = ~np.isnan(amount)
+        per_item = pd.Series(amount[known]).groupby([chunk['itemid'].to_numpy()[known],
+                                                     unit.to_numpy()[known]]).sum()
+        self.ingredients = self._add(self.ingredients, per_item)
+
+        water = chunk[chunk['itemid'].isin(WATER_ITEMS).to_numpy()]
+        self.water = self._add(self.water, allocate(
+            water['stay_id'], _seconds(water['starttime']), _seconds(water['endtime'].fillna(water['starttime'])),
+            normalized_volumes(water), self.bin_seconds))
+
+    def update_inputs(self, chunk):
+        """Fold an inputevents chunk: volume-dosed inputs (fallback intake) by order category"""
+        chunk = chunk[chunk['stay_id'].notna() & chunk['starttime'].notna()]
+        if chunk.empty:
+            return
+
+        volume = normalized_volumes(chunk)
+        self.inputs = self._add(self.inputs, allocate(
+            chunk['stay_id'], _seconds(chunk['starttime']), _seconds(chunk['endtime'].fillna(chunk['starttime'])),
+            volume, self.bin_seconds))
+
+        if 'ordercategorydescription' in chunk.columns:
+            known = ~np.isnan(volume)
+            categories = chunk['ordercategorydescription'].astype(object).fillna('Unknown').to_numpy()
+            self.input_categories = self._add(self.input_categories,
+                                              pd.Series(volume[known]).groupby(categories[known]).sum())
+
+    def update_outputs(self, chunk):
+        """Fold an outputevents chunk (value in mL at charttime)"""
+        chunk = chunk[chunk['stay_id'].notna() & chunk['charttime'].notna()]
+        if chunk.empty:
+            return
+
+        volume = chunk['value'].to_numpy(dtype='float64', na_value=np.nan)
+        if 'valueuom' in chunk.columns:
+            volume = volume * _unit_factors(chunk['valueuom'], VOLUME_UNITS)
+        charttime = _seconds(chunk['charttime'])
+        self.outputs = self._add(self.outputs, allocate(chunk['stay_id'], charttime, charttime,
+                                                        volume, self.bin_seconds))
+
+        known = ~np.isnan(volume)
+        self.output_items = self._add(self.output_items,
+                                      pd.Series(volume[known]).groupby(chunk['itemid'].to_numpy()[known]).sum())
+
+    def merge(self, other):
+        """Combine with the accumulator of another chunk range or worker"""
+        for name in ('water', 'inputs', 'outputs', 'input_categories', 'output_items', 'ingredients'):
+            setattr(self, name, self._add(getattr(self, name), getattr(other, name)))
+        return self
+
+    def balance(self):
+        """Per-(stay, bin) intake, output and net in mL"""
+        intake = self.water if not self.water.empty else self.inputs
+        frame = pd.DataFrame({'intake': intake, 'output': self.outputs}).fillna(0.0)
+        frame['net'] = frame['intake'] - frame['output']
+        frame.index.names = ['stay_id', 'bin']
+        return frame.sort_index()
+
+    def stay_series(self, stay_id):
+        """Binned intake, output, net and cumulative balance of one stay, indexed by bin start"""
+        frame = self.balance()
+        if stay_id not in frame.index.get_level_values('stay_id'):
+            return pd.DataFrame(columns=['intake', 'output', 'net', 'cumulative'])
+        stay = frame.xs(stay_id, level='stay_id')
+        stay.index = pd.to_datetime(stay.index * self.bin_seconds, unit='s')
+        stay['cumulative'] = stay['net'].cumsum()
+        return stay
+
+    def summary(self, stay_starts=None, item_labels=None):
+        """ICU panel section
+
+        stay_starts (stay_id -> ICU intime) anchors the by-ICU-day profile;
+        stays without one are anchored at their first binned event.
+        item_labels maps itemids to names for outputs and ingredients.
+        """
+        frame = self.balance()
+        if frame.empty:
+            return {'stays': 0}
+        item_labels = item_labels or {}
+
+        stays = frame.index.get_level_values('stay_id').to_numpy()
+        bins = frame.index.get_level_values('bin').to_numpy()
+        anchors = pd.Series(bins).groupby(stays).transform('min').to_numpy()
+        if stay_starts is not None:
+            starts = pd.Series(_seconds(stay_starts), index=stay_starts.index) // self.bin_seconds
+            anchors = np.where(pd.Series(stays).isin(starts.index),
+                               starts.reindex(stays).fillna(0).to_numpy(dtype='int64'), anchors)
+
+        bins_per_day = 86400 // self.bin_seconds
+        icu_day = (bins - anchors) // bins_per_day + 1
+        in_window = (icu_day >= 1) & (icu_day <= ICU_DAYS)
+        daily = frame['net'][in_window].groupby([stays[in_window], icu_day[in_window]]).sum()
+        by_day = daily.groupby(level=1).mean()
+
+        hour_of_day = pd.to_datetime(bins * self.bin_seconds, unit='s').hour
+        per_stay = frame.groupby(level='stay_id')[['intake', 'output', 'net']].sum()
+
+        def ranked(totals, label, top=None):
+            totals = totals.sort_values(ascending=False, kind='stable')
+            totals = totals if top is None else totals.head(top)
+            return {label(key): round(float(amount), 1) for key, amount in totals.items()}
+
+        return {
+            'stays': len(per_stay),
+            'bin_seconds': self.bin_seconds,
+            'intake_source': 'ingredientevents' if not self.water.empty else 'inputevents',
+            'total_intake_ml': round(float(per_stay['intake'].sum()), 1),
+            'total_output_ml': round(float(per_stay['output'].sum()), 1),
+            'total_net_ml': round(float(per_stay['net'].sum()), 1),
+            'net_per_stay_ml': {f"p{int(q * 100)}": round(float(per_stay['net'].quantile(q)), 1)
+                                for q in BALANCE_QUANTILES},
+            'positive_balance_rate': float((per_stay['net'] > 0).mean()),
+            'net_by_icu_day_ml': {int(day): round(float(net), 1) for day, net in by_day.items()},
+            'net_by_hour_of_day_ml': {int(hour): round(float(net), 2) for hour, net in
+                                      frame['net'].groupby(hour_of_day).mean().items()},
+            'input_volume_by_category_ml': ranked(self.input_categories, str),
+            'output_by_item_ml': ranked(self.output_items, lambda item: item_labels.get(int(item), str(item)),
+                                        top=10),
+            'ingredients': ranked(self.ingredients,
+                                  lambda key: f"{item_labels.get(int(key[0]), key[0])} ({key[1]})")
+        }
@@ -0,0 +1,450 @@
+"""
+ICD Blocks
+==========
+
+Blocks (ICD-10-CM) and sections (ICD-9-CM): the level of the diagnosis
+hierarchy between chapters and 3-character categories, e.g. I20-I25
+Ischemic heart diseases or 410-414 Ischemic heart disease.
+
+Each entry is (first category, last category, title), in code order.
+ICD-9 E codes have 4-character categories (E800-E807). ICD-10 categories
+with a letter in the third position (C4A, M1A, Z3A, ...) do not sort inside
+their block's range and are listed in ICD10_INSERTED_CATEGORIES.
+"""
+
+ICD9_BLOCKS = [
+    ('001', '009', 'Intestinal infectious diseases'),
+    ('010', '018', 'Tuberculosis'),
+    ('020', '027', 'Zoonotic bacterial diseases'),
+    ('030', '041', 'Other bacterial diseases'),
+    ('042', '042', 'Human immunodeficiency virus (HIV) infection'),
+    ('045', '049', 'Poliomyelitis and other non-arthropod-borne viral diseases and prion diseases of central nervous system'),
+    ('050', '059', 'Viral diseases generally accompanied by exanthem'),
+    ('060', '066', 'Arthropod-borne viral diseases'),
+    ('070', '079', 'Other diseases due to viruses and chlamydiae'),
+    ('080', '088', 'Rickettsioses and other arthropod-borne diseases'),
+    ('090', '099', 'Syphilis and other venereal diseases'),
+    ('100', '104', 'Other spirochetal diseases'),
+    ('110', '118', 'Mycoses'),
+    ('120', '129', 'Helminthiases'),
+    ('130', '136', 'Other infectious and parasitic diseases'),
+    ('137', '139', 'Late effects of infectious and parasitic diseases'),
+    ('140', '149', 'Malignant neoplasm of lip, oral cavity, and pharynx'),
+    ('150', '159', 'Malignant neoplasm of digestive organs and peritoneum'),
+    ('160', '165', 'Malignant neoplasm of respiratory and intrathoracic organs'),
+    ('170', '176', 'Malignant neoplasm of bone, connective tissue, skin, and breast'),
+    ('179', '189', 'Malignant neoplasm of genitourinary organs'),
+    ('190', '199', 'Malignant neoplasm of other and unspecified sites'),
+    ('200', '208', 'Malignant neoplasm of lymphatic and hematopoietic tissue'),
+    ('209', '209', 'Neuroendocrine tumors'),
+    ('210', '229', 'Benign neoplasms'),
+    ('230', '234', 'Carcinoma in situ'),
+    ('235', '238', 'Neoplasms of uncertain behavior'),
+    ('239', '239', 'Neoplasms of unspecified nature'),
+    ('240', '246', 'Disorders of thyroid gland'),
+    ('249', '259', 'Diseases of other endocrine glands'),
+    ('260', '269', 'Nutritional deficiencies'),
+    ('270', '279', 'Other metabolic and immunity disorders'),
+    ('280', '289', 'Diseases of the blood and blood-forming organs'),
+    ('290', '294', 'Organic psychotic conditions'),
+    ('295', '299', 'Other psychoses'),
+    ('300', '316', 'Neurotic disorders, personality disorders, and other nonpsychotic mental disorders'),
+    ('317', '319', 'Intellectual disabilities'),
+    ('320', '327', 'Inflammatory diseases of the central nervous system'),
+    ('330', '337', 'Hereditary and degenerative diseases of the central nervous system'),
+    ('338', '338', 'Pain'),
+    ('339', '339', 'Other headache syndromes'),
+    ('340', '349', 'Other disorders of the central nervous system'),
+    ('350', '359', 'Disorders of the peripheral nervous system'),
+    ('360', '379', 'Disorders of the eye and adnexa'),
+    ('380', '389', 'Diseases of the ear and mastoid process'),
+    ('390', '392', 'Acute rheumatic fever'),
+    ('393', '398', 'Chronic rheumatic heart disease'),
+    ('401', '405', 'Hypertensive disease'),
+    ('410', '414', 'Ischemic heart disease'),
+    ('415', '417', 'Diseases of pulmonary circulation'),
+    ('420', '429', 'Other forms of heart disease'),
+    ('430', '438', 'Cerebrovascular disease'),
+    ('440', '449', 'Diseases of arteries, arterioles, and capillaries'),
+    ('451', '459', 'Diseases of veins and lymphatics, and other diseases of circulatory system'),
+    ('460', '466', 'Acute respiratory infections'),
+    ('470', '478', 'Other diseases of upper respiratory tract'),
+    ('480', '488', 'Pneumonia and influenza'),
+    ('490', '496', 'Chronic obstructive pulmonary disease and allied conditions'),
+    ('500', '508', 'Pneumoconioses and other lung diseases due to external agents'),
+    ('510', '519', 'Other diseases of respiratory system'),
+    ('520', '529', 'Diseases of oral cavity, salivary glands, and jaws'),
+    ('530', '539', 'Diseases of esophagus, stomach, and duodenum'),
+    ('540', '543', 'Appendicitis'),
+    ('550', '553', 'Hernia of abdominal cavity'),
+    ('555', '558', 'Noninfectious enteritis and colitis'),
+    ('560', '569', 'Other diseases of intestines and peritoneum'),
+    ('570', '579', 'Other diseases of digestive system'),
+    ('580', '589', 'Nephritis, nephrotic syndrome, and nephrosis'),
+    ('590', '599', 'Other diseases of urinary system'),
+    ('600', '608', 'Diseases of male genital organs'),
+    ('610', '612', 'Disorders of breast'),
+    ('614', '616', 'Inflammatory disease of female pelvic organs'),
+    ('617', '629', 'Other disorders of female genital tract'),
+    ('630', '639', 'Ectopic and molar pregnancy and other pregnancy with abortive outcome'),
+    ('640', '649', 'Complications mainly related to pregnancy'),
+    ('650', '659', 'Normal delivery, and other indications for care in pregnancy, labor, and delivery'),
+    ('660', '669', 'Complications occurring mainly in the course of labor and delivery'),
+    ('670', '677', 'Complications of the puerperium'),
+    ('678', '679', 'Other maternal and fetal complications'),
+    ('680', '686', 'Infections of skin and subcutaneous tissue'),
+    ('690', '698', 'Other inflammatory conditions of skin and subcutaneous tissue'),
+    ('700', '709', 'Other diseases of skin and subcutaneous tissue'),
+    ('710', '719', 'Arthropathies and related disorders'),
+    ('720', '724', 'Dorsopathies'),
+    ('725', '729', 'Rheumatism, excluding the back'),
+    ('730', '739', 'Osteopathies, chondropathies, and acquired musculoskeletal deformities'),
+    ('740', '759', 'Congenital anomalies'),
+    ('760', '763', 'Maternal causes of perinatal morbidity and mortality'),
+    ('764', '779', 'Other conditions originating in the perinatal period'),
+    ('780', '789', 'Symptoms'),
+    ('790', '796', 'Nonspecific abnormal findings'),
+    ('797', '799', 'Ill-defined and unknown causes of morbidity and mortality'),
+    ('800', '804', 'Fracture of skull'),
+    ('805', '809', 'Fracture of spine and trunk'),
+    ('810', '819', 'Fracture of upper limb'),
+    ('820', '829', 'Fracture of lower limb'),
+    ('830', '839', 'Dislocation'),
+    ('840', '848', 'Sprains and strains of joints and adjacent muscles'),
+    ('850', '854', 'Intracranial injury, excluding those with skull fracture'),
+    ('860', '869', 'Internal injury of thorax, abdomen, and pelvis'),
+    ('870', '879', 'Open wound of head, neck, and trunk'),
+    ('880', '887', 'Open wound of upper limb'),
+    ('890', '897', 'Open wound of lower limb'),
+    ('900', '904', 'Injury to blood vessels'),
+    ('905', '909', 'Late effects of injuries, poisonings, toxic effects, and other external causes'),
+    ('910', '919', 'Superficial injury'),
+    ('920', '924', 'Contusion with intact skin surface'),
+    ('925', '929', 'Crushing injury'),
+    ('930', '939', 'Effects of foreign body entering through orifice'),
+    ('940', '949', 'Burns'),
+    ('950', '957', 'Injury to nerves and spinal cord'),
+    ('958', '959', 'Certain traumatic complications and unspecified injuries'),
+    ('960', '979', 'Poisoning by drugs, medicinal and biological substances'),
+    ('980', '989', 'Toxic effects of substances chiefly nonmedicinal as to source'),
+    ('990', '995', 'Other and unspecified effects of external causes'),
+    ('996', '999', 'Complications of surgical and medical care, not elsewhere classified'),
+    ('E000', 'E000', 'External cause status'),
+    ('E001', 'E030', 'Activity'),
+    ('E800', 'E807', 'Railway accidents'),
+    ('E810', 'E819', 'Motor vehicle traffic accidents'),
+    ('E820', 'E825', 'Motor vehicle nontraffic accidents'),
+    ('E826', 'E829', 'Other road vehicle accidents'),
+    ('E830', 'E838', 'Water transport accidents'),
+    ('E840', 'E845', 'Air and space transport accidents'),
+    ('E846', 'E848', 'Vehicle accidents not elsewhere classifiable'),
+    ('E849', 'E849', 'Place of occurrence'),
+    ('E850', 'E858', 'Accidental poisoning by drugs, medicinal substances, and biologicals'),
+    ('E860', 'E869', 'Accidental poisoning by other solid and liquid substances, gases, and vapors'),
+    ('E870', 'E876', 'Misadventures to patients during surgical and medical care'),
+    ('E878', 'E879', 'Surgical and medical procedures as the cause of abnormal reaction of patient or later '
+                     'complication, without mention of misadventure at the time of procedure'),
+    ('E880', 'E888', 'Accidental falls'),
+    ('E890', 'E899', 'Accidents caused by fire and flames'),
+    ('E900', 'E909', 'Accidents due to natural and environmental factors'),
+    ('E910', 'E915', 'Accidents caused by submersion, suffocation, and foreign bodies'),
+    ('E916', 'E928', 'Other accidents'),
+    ('E929', 'E929', 'Late effects of accidental injury'),
+    ('E930', 'E949', 'Drugs, medicinal and biological substances causing adverse effects in therapeutic use'),
+    ('E950', 'E959', 'Suicide and self-inflicted injury'),
+    ('E960', 'E969', 'Homicide and injury purposely inflicted by other persons'),
+    ('E970', 'E979', 'Legal intervention and terrorism'),
+    ('E980', 'E989', 'Injury undetermined whether accidentally or purposely inflicted'),
+    ('E990', 'E999', 'Injury resulting from operations of war'),
+    ('V01', 'V09', 'Persons with potential health hazards related to communicable diseases'),
+    ('V10', 'V19', 'Persons with potential health hazards related to personal and family history'),
+    ('V20', 'V29', 'Persons encountering health services in circumstances related to reproduction and development'),
+    ('V30', 'V39', 'Liveborn infants according to type of birth'),
+    ('V40', 'V49', 'Persons with a condition influencing their health status'),
+    ('V50', 'V59', 'Persons encountering health services for specific procedures and aftercare'),
+    ('V60', 'V69', 'Persons encountering health services in other circumstances'),
+    ('V70', 'V82', 'Persons without reported diagnosis encountered during examination and investigation of '
+                   'individuals and populations'),
+    ('V83', 'V84', 'Genetics'),
+    ('V85', 'V85', 'Body mass index'),
+    ('V86', 'V86', 'Estrogen receptor status'),
+    ('V87', 'V87', 'Other specified personal exposures and history presenting hazards to health'),
+    ('V88', 'V88', 'Acquired absence of other organs and tissue'),
+    ('V89', 'V89', 'Other suspected conditions not found'),
+    ('V90', 'V90', 'Retained foreign body'),
+    ('V91', 'V91', 'Multiple gestation placenta status')
+]
+
+ICD10_BLOCKS = [
+    ('A00', 'A09', 'Intestinal infectious diseases'),
+    ('A15', 'A19', 'Tuberculosis'),
+    ('A20', 'A28', 'Certain zoonotic bacterial diseases'),
+    ('A30', 'A49', 'Other bacterial diseases'),
+    ('A50', 'A64', 'Infections with a predominantly sexual mode of transmission'),
+    ('A65', 'A69', 'Other spirochetal diseases'),
+    ('A70', 'A74', 'Other diseases caused by chlamydiae'),
+    ('A75', 'A79', 'Rickettsioses'),
+    ('A80', 'A89', 'Viral and prion infections of the central nervous system'),
+    ('A90', 'A99', 'Arthropod-borne viral fevers and viral hemorrhagic fevers'),
+    ('B00', 'B09', 'Viral infections characterized by skin and mucous membrane lesions'),
+    ('B10', 'B10', 'Other human herpesviruses'),
+    ('B15', 'B19', 'Viral hepatitis'),
+    ('B20', 'B20', 'Human immunodeficiency virus [HIV] disease'),
+    ('B25', 'B34', 'Other viral diseases'),
+    ('B35', 'B49', 'Mycoses'),
+    ('B50', 'B64', 'Protozoal diseases'),
+    ('B65', 'B83', 'Helminthiases'),
+    ('B85', 'B89', 'Pediculosis, acariasis and other infestations'),
+    ('B90', 'B94', 'Sequelae of infectious and parasitic diseases'),
+    ('B95', 'B97', 'Bacterial and viral infectious agents'),
+    ('B99', 'B99', 'Other infectious diseases'),
+    ('C00', 'C14', 'Malignant neoplasms of lip, oral cavity and pharynx'),
+    ('C15', 'C26', 'Malignant neoplasms of digestive organs'),
+    ('C30', 'C39', 'Malignant neoplasms of respiratory and intrathoracic organs'),
+    ('C40', 'C41', 'Malignant neoplasms of bone and articular cartilage'),
+    ('C43', 'C44', 'Melanoma and other malignant neoplasms of skin'),
+    ('C45', 'C49', 'Malignant neoplasms of mesothelial and soft tissue'),
+    ('C50', 'C50', 'Malignant neoplasms of breast'),
+    ('C51', 'C58', 'Malignant neoplasms of female genital organs'),
+    ('C60', 'C63', 'Malignant neoplasms of male genital organs'),
+    ('C64', 'C68', 'Malignant neoplasms of urinary tract'),
+    ('C69', 'C72', 'Malignant neoplasms of eye, brain and other parts of central nervous system'),
+    ('C73', 'C75', 'Malignant neoplasms of thyroid and other endocrine glands'),
+    ('C7A', 'C7A', 'Malignant neuroendocrine tumors'),
+    ('C7B', 'C7B', 'Secondary neuroendocrine tumors'),
+    ('C76', 'C80', 'Malignant neoplasms of ill-defined, other secondary and unspecified sites'),
+    ('C81', 'C96', 'Malignant neoplasms of lymphoid, hematopoietic and related tissue'),
+    ('D00', 'D09', 'In situ neoplasms'),
+    ('D10', 'D36', 'Benign neoplasms, except benign neuroendocrine tumors'),
+    ('D3A', 'D3A', 'Benign neuroendocrine tumors'),
+    ('D37', 'D48', 'Neoplasms of uncertain behavior, polycythemia vera and myelodysplastic syndromes'),
+    ('D49', 'D49', 'Neoplasms of unspecified behavior'),
+    ('D50', 'D53', 'Nutritional anemias'),
+    ('D55', 'D59', 'Hemolytic anemias'),
+    ('D60', 'D64', 'Aplastic and other anemias and other bone marrow failure syndromes'),
+    ('D65', 'D69', 'Coagulation defects, purpura and other hemorrhagic conditions'),
+    ('D70', 'D77', 'Other disorders of blood and blood-forming organs'),
+    ('D78', 'D78', 'Intraoperative and postprocedural complications of the spleen'),
+    ('D80', 'D89', 'Certain disorders involving the immune mechanism'),
+    ('E00', 'E07', 'Disorders of thyroid gland'),
+    ('E08', 'E13', 'Diabetes mellitus'),
+    ('E15', 'E16', 'Other disorders of glucose regulation and pancreatic internal secretion'),
+    ('E20', 'E35', 'Disorders of other endocrine glands'),
+    ('E36', 'E36', 'Intraoperative complications of endocrine system'),
+    ('E40', 'E46', 'Malnutrition'),
+    ('E50', 'E64', 'Other nutritional deficiencies'),
+    ('E65', 'E68', 'Overweight, obesity and other hyperalimentation'),
+    ('E70', 'E88', 'Metabolic disorders'),
+    ('E89', 'E89', 'Postprocedural endocrine and metabolic complications and disorders, not elsewhere classified'),
+    ('F01', 'F09', 'Mental disorders due to known physiological conditions'),
+    ('F10', 'F19', 'Mental and behavioral disorders due to psychoactive substance use'),
+    ('F20', 'F29', 'Schizophrenia, schizotypal, delusional, and other non-mood psychotic disorders'),
+    ('F30', 'F39', 'Mood [affective] disorders'),
+    ('F40', 'F48', 'Anxiety, dissociative, stress-related, somatoform and other nonpsychotic mental disorders'),
+    ('F50', 'F59', 'Behavioral syndromes associated with physiological disturbances and physical factors'),
+    ('F60', 'F69', 'Disorders of adult personality and behavior'),
+    ('F70', 'F79', 'Intellectual disabilities'),
+    ('F80', 'F89', 'Pervasive and specific developmental disorders'),
+    ('F90', 'F98', 'Behavioral and emotional disorders with onset usually occurring in childhood and adolescence'),
+    ('F99', 'F99', 'Unspecified mental disorder'),
+    ('G00', 'G09', 'Inflammatory diseases of the central nervous system'),
+    ('G10', 'G14', 'Systemic atrophies primarily affecting the central nervous system'),
+    ('G20', 'G26', 'Extrapyramidal and movement disorders'),
+    ('G30', 'G32', 'Other degenerative diseases of the nervous system'),
+    ('G35', 'G37', 'Demyelinating diseases of the central nervous system'),
+    ('G40', 'G47', 'Episodic and paroxysmal disorders'),
+    ('G50', 'G59', 'Nerve, nerve root and plexus disorders'),
+    ('G60', 'G65', 'Polyneuropathies and other disorders of the peripheral nervous system'),
+    ('G70', 'G73', 'Diseases of myoneural junction and muscle'),
+    ('G80', 'G83', 'Cerebral palsy and other paralytic syndromes'),
+    ('G89', 'G99', 'Other disorders of the nervous system'),
+    ('H00', 'H05', 'Disorders of eyelid, lacrimal system and orbit'),
+    ('H10', 'H11', 'Disorders of conjunctiva'),
+    ('H15', 'H22', 'Disorders of sclera, cornea, iris and ciliary body'),
+    ('H25', 'H28', 'Disorders of lens'),
+    ('H30', 'H36', 'Disorders of choroid and retina'),
+    ('H40', 'H42', 'Glaucoma'),
+    ('H43', 'H44', 'Disorders of vitreous body and globe'),
+    ('H46', 'H47', 'Disorders of optic nerve and visual pathways'),
+    ('H49', 'H52', 'Disorders of ocular muscles, binocular movement, accommodation and refraction'),
+    ('H53', 'H54', 'Visual disturbances and blindness'),
+    ('H55', 'H57', 'Other disorders of eye and adnexa'),
+    ('H59', 'H59', 'Intraoperative and postprocedural complications and disorders of eye and adnexa, '
+                   'not elsewhere classified'),
+    ('H60', 'H62', 'Diseases of external ear'),
+    ('H65', 'H75', 'Diseases of middle ear and mastoid'),
+    ('H80', 'H83', 'Diseases of inner ear'),
+    ('H90', 'H94', 'Other disorders of ear'),
+    ('H95', 'H95', 'Intraoperative and postprocedural complications and disorders of ear and mastoid process, '
+                   'not elsewhere classified'),
+    ('I00', 'I02', 'Acute rheumatic fever'),
+    ('I05', 'I09', 'Chronic rheumatic heart diseases'),
+    ('I10', 'I1A', 'Hypertensive diseases'),
+    ('I20', 'I25', 'Ischemic heart diseases'),
+    ('I26', 'I28', 'Pulmonary heart disease and diseases of pulmonary circulation'),
+    ('I30', 'I5A', 'Other forms of heart disease'),
+    ('I60', 'I69', 'Cerebrovascular diseases'),
+    ('I70', 'I79', 'Diseases of arteries, arterioles and capillaries'),
+    ('I80', 'I89', 'Diseases of veins, lymphatic vessels and lymph nodes, not elsewhere classified'),
+    ('I95', 'I99', 'Other and unspecified disorders of the circulatory system'),
+    ('J00', 'J06', 'Acute upper respiratory infections'),
+    ('J09', 'J18', 'Influenza and pneumonia'),
+    ('J20', 'J22', 'Other acute lower respiratory infections'),
+    ('J30', 'J39', 'Other diseases of upper respiratory tract'),
+    ('J40', 'J47', 'Chronic lower respiratory diseases'),
+    ('J60', 'J70', 'Lung diseases due to external agents'),
+    ('J80', 'J84', 'Other respiratory diseases principally affecting the interstitium'),
+    ('J85', 'J86', 'Suppurative and necrotic conditions of the lower respiratory tract'),
+    ('J90', 'J94', 'Other diseases of the pleura'),
+    ('J95', 'J95', 'Intraoperative and postprocedural complications and disorders of respiratory system, '
+                   'not elsewhere classified'),
+    ('J96', 'J99', 'Other diseases of the respiratory system'),
+    ('K00', 'K14', 'Diseases of oral cavity and salivary glands'),
+    ('K20', 'K31', 'Diseases of esophagus, stomach and duodenum'),
+    ('K35', 'K38', 'Diseases of appendix'),
+    ('K40', 'K46', 'Hernia'),
+    ('K50', 'K52', 'Noninfective enteritis and colitis'),
+    ('K55', 'K64', 'Other diseases of intestines'),
+    ('K65', 'K68', 'Diseases of peritoneum and retroperitoneum'),
+    ('K70', 'K77', 'Diseases of liver'),
+    ('K80', 'K87', 'Disorders of gallbladder, biliary tract and pancreas'),
+    ('K90', 'K95', 'Other diseases of the digestive system'),
+    ('L00', 'L08', 'Infections of the skin and subcutaneous tissue'),
+    ('L10', 'L14', 'Bullous disorders'),
+    ('L20', 'L30', 'Dermatitis and eczema'),
+    ('L40', 'L45', 'Papulosquamous disorders'),
+    ('L49', 'L54', 'Urticaria and erythema'),
+    ('L55', 'L59', 'Radiation-related disorders of the skin and subcutaneous tissue'),
+    ('L60', 'L75', 'Disorders of skin appendages'),
+    ('L76', 'L76', 'Intraoperative and postprocedural complications of skin and subcutaneous tissue'),
+    ('L80', 'L99', 'Other disorders of the skin and subcutaneous tissue'),
+    ('M00', 'M02', 'Infectious arthropathies'),
+    ('M04', 'M04', 'Autoinflammatory syndromes'),
+    ('M05', 'M14', 'Inflammatory polyarthropathies'),
+    ('M15', 'M19', 'Osteoarthritis'),
+    ('M20', 'M25', 'Other joint disorders'),
+    ('M26', 'M27', 'Dentofacial anomalies [including malocclusion] and other disorders of jaw'),
+    ('M30', 'M36', 'Systemic connective tissue disorders'),
+    ('M40', 'M43', 'Deforming dorsopathies'),
+    ('M45', 'M49', 'Spondylopathies'),
+    ('M50', 'M54', 'Other dorsopathies'),
+    ('M60', 'M63', 'Disorders of muscles'),
+    ('M65', 'M67', 'Disorders of synovium and tendon'),
+    ('M70', 'M79', 'Other soft tissue disorders'),
+    ('M80', 'M85', 'Disorders of bone density and structure'),
+    ('M86', 'M90', 'Other osteopathies'),
+    ('M91', 'M94', 'Chondropathies'),
+    ('M95', 'M95', 'Other disorders of the musculoskeletal system and connective tissue'),
+    ('M96', 'M96', 'Intraoperative and postprocedural complications and disorders of musculoskeletal system, '
+                   'not elsewhere classified'),
+    ('M97', 'M97', 'Periprosthetic fracture around internal prosthetic joint'),
+    ('M99', 'M99', 'Biomechanical lesions, not elsewhere classified'),
+    ('N00', 'N08', 'Glomerular diseases'),
+    ('N10', 'N16', 'Renal tubulo-interstitial diseases'),
+    ('N17', 'N19', 'Acute kidney failure and chronic kidney disease'),
+    ('N20', 'N23', 'Urolithiasis'),
+    ('N25', 'N29', 'Other disorders of kidney and ureter'),
+    ('N30', 'N39', 'Other diseases of the urinary system'),
+    ('N40', 'N53', 'Diseases of male genital organs'),
+    ('N60', 'N65', 'Disorders of breast'),
+    ('N70', 'N77', 'Inflammatory diseases of female pelvic organs'),
+    ('N80', 'N98', 'Noninflammatory disorders of female genital tract'),
+    ('N99', 'N99', 'Intraoperative and postprocedural complications and disorders of genitourinary system, '
+                   'not elsewhere classified'),
+    ('O00', 'O08', 'Pregnancy with abortive outcome'),
+    ('O09', 'O09', 'Supervision of high risk pregnancy'),
+    ('O10', 'O16', 'Edema, proteinuria and hypertensive disorders in pregnancy, childbirth and the puerperium'),
+    ('O20', 'O29', 'Other maternal disorders predominantly related to pregnancy'),
+    ('O30', 'O48', 'Maternal care related to the fetus and amniotic cavity and possible delivery problems'),
+    ('O60', 'O77', 'Complications of labor and delivery'),
+    ('O80', 'O82', 'Encounter for delivery'),
+    ('O85', 'O92', 'Complications predominantly related to the puerperium'),
+    ('O94', 'O9A', 'Other obstetric conditions, not elsewhere classified'),
+    ('P00', 'P04', 'Newborn affected by maternal factors and by complications of pregnancy, labor, and delivery'),
+    ('P05', 'P08', 'Disorders of newborn related to length of gestation and fetal growth'),
+    ('P09', 'P09', 'Abnormal findings on neonatal screening'),
+    ('P10', 'P15', 'Birth trauma'),
+    ('P19', 'P29', 'Respiratory and cardiovascular disorders specific to the perinatal period'),
+    ('P35', 'P39', 'Infections specific to the perinatal period'),
+    ('P50', 'P61', 'Hemorrhagic and hematological disorders of newborn'),
+    ('P70', 'P74', 'Transitory endocrine and metabolic disorders specific to newborn'),
+    ('P76', 'P78', 'Digestive system disorders of newborn'),
+    ('P80', 'P83', 'Conditions involving the integument and temperature regulation of newborn'),
+    ('P84', 'P84', 'Other problems with newborn'),
+    ('P90', 'P96', 'Other disorders originating in the perinatal period'),
+    ('Q00', 'Q07', 'Congenital malformations of the nervous system'),
+    ('Q10', 'Q18', 'Congenital malformations of eye, ear, face and neck'),
+    ('Q20', 'Q28', 'Congenital malformations of the circulatory system'),
+    ('Q30', 'Q34', 'Congenital malformations of the respiratory system'),
+    ('Q35', 'Q37', 'Cleft lip and cleft palate'),
+    ('Q38', 'Q45', 'Other congenital malformations of the digestive system'),
+    ('Q50', 'Q56', 'Congenital malformations of genital organs'),
+    ('Q60', 'Q64', 'Congenital malformations of the urinary system'),
+    ('Q65', 'Q79', 'Congenital malformations and deformations of the musculoskeletal system'),
+    ('Q80', 'Q89', 'Other congenital malformations'),
+    ('Q90', 'Q99', 'Chromosomal abnormalities, not elsewhere classified'),
+    ('R00', 'R09', 'Symptoms and signs involving the circulatory and respiratory systems'),
+    ('R10', 'R19', 'Symptoms and signs involving the digestive system and abdomen'),
+    ('R20', 'R23', 'Symptoms and signs involving the skin and subcutaneous tissue'),
+    ('R25', 'R29', 'Symptoms and signs involving the nervous and musculoskeletal systems'),
+    ('R30', 'R39', 'Symptoms and signs involving the genitourinary system'),
+    ('R40', 'R46', 'Symptoms and signs involving cognition, perception, emotional state and behavior'),
+    ('R47', 'R49', 'Symptoms and signs involving speech and voice'),
+    ('R50', 'R69', 'General symptoms and signs'),
+    ('R70', 'R79', 'Abnormal findings on examination of blood, without diagnosis'),
+    ('R80', 'R82', 'Abnormal findings on examination of urine, without diagnosis'),
+    ('R83', 'R89', 'Abnormal findings on examination of other body fluids, substances and tissues, without diagnosis'),
+    ('R90', 'R94', 'Abnormal findings on diagnostic imaging and in function studies, without diagnosis'),
+    ('R97', 'R97', 'Abnormal tumor markers'),
+    ('R99', 'R99', 'Ill-defined and unknown cause of mortality'),
+    ('S00', 'S09', 'Injuries to the head'),
+    ('S10', 'S19', 'Injuries to the neck'),
+    ('S20', 'S29', 'Injuries to the thorax'),
+    ('S30', 'S39', 'Injuries to the abdomen, lower back, lumbar spine, pelvis and external genitals'),
+    ('S40', 'S49', 'Injuries to the shoulder and upper arm'),
+    ('S50', 'S59', 'Injuries to the elbow and forearm'),
+    ('S60', 'S69', 'Injuries to the wrist, hand and fingers'),
+    ('S70', 'S79', 'Injuries to the hip and thigh'),
+    ('S80', 'S89', 'Injuries to the knee and lower leg'),
+    ('S90', 'S99', 'Injuries to the ankle and foot'),
+    ('T07', 'T07', 'Injuries involving multiple body regions'),
+    ('T14', 'T14', 'Injury of unspecified body region'),
+    ('T15', 'T19', 'Effects of foreign body entering through natural orifice'),
+    ('T20', 'T25', 'Burns and corrosions of external body surface, specified by site'),
+    ('T26', 'T28', 'Burns and corrosions confined to eye and internal organs'),
+    ('T30', 'T32', 'Burns and corrosions of multiple and unspecified body regions'),
+    ('T33', 'T34', 'Frostbite'),
+    ('T36', 'T50', 'Poisoning by, adverse effects of and underdosing of drugs, medicaments and biological substances'),
+    ('T51', 'T65', 'Toxic effects of substances chiefly nonmedicinal as to source'),
+    ('T66', 'T78', 'Other and unspecified effects of external causes'),
+    ('T79', 'T79', 'Certain early complications of trauma'),
+    ('T80', 'T88', 'Complications of surgical and medical care, not elsewhere classified'),
+    ('U00', 'U49', 'Provisional assignment of new diseases of uncertain etiology or emergency use'),
+    ('V00', 'V99', 'Transport accidents'),
+    ('W00', 'X58', 'Other external causes of accidental injury'),
+    ('X71', 'X83', 'Intentional self-harm'),
+    ('X92', 'Y09', 'Assault'),
+    ('Y21', 'Y33', 'Event of undetermined intent'),
+    ('Y35', 'Y38', 'Legal intervention, operations of war, military operations, and terrorism'),
+    ('Y62', 'Y84', 'Complications of medical and surgical care'),
+    ('Y90', 'Y99', 'Supplementary factors related to causes of morbidity classified elsewhere'),
+    ('Z00', 'Z13', 'Persons encountering health services for examinations'),
+    ('Z14', 'Z15', 'Genetic carrier and genetic susceptibility to disease'),
+    ('Z16', 'Z16', 'Resistance to antimicrobial drugs'),
+    ('Z17', 'Z17', 'Estrogen receptor status'),
+    ('Z18', 'Z18', 'Retained foreign body fragments'),
+    ('Z19', 'Z19', 'Hormone sensitivity malignancy status'),
+    ('Z20', 'Z29', 'Persons with potential health hazards related to communicable diseases'),
+    ('Z30', 'Z39', 'Persons encountering health services in circumstances related to reproduction'),
+    ('Z40', 'Z53', 'Encounters for other specific health care'),
+    ('Z55', 'Z65', 'Persons with potential health hazards related to socioeconomic and psychosocial circumstances'),
+    ('Z66', 'Z66', 'Do not resuscitate'),
+    ('Z67', 'Z67', 'Blood type'),
+    ('Z68', 'Z68', 'Body mass index [BMI]'),
+    ('Z69', 'Z76', 'Persons encountering health services in other circumstances'),
+    ('Z77', 'Z99', 'Persons with potential health hazards related to family and personal history and certain '
+                   'conditions influencing health status')
+]
+
+# Category -> first category of its block, for categories outside their block's range
+ICD10_INSERTED_CATEGORIES = {'C4A': 'C43', 'M1A': 'M05', 'Z3A': 'Z30'}
@@ -0,0 +1,355 @@
+"""
+ICD Diagnosis Categorization
+============================
+
+Version-aware roll-up of diagnoses_icd rows to the ICD hierarchy:
+
+    chapter   ICD-9-CM / ICD-10-CM chapter (e.g. 390-459, I00-I99)
+    block     section / block within a chapter (e.g. 420-429, I30-I5A)
+    category  3-character category (e.g. 428, I50; 4 characters for
+              ICD-9 E codes, e.g. E849)
+    code      full billable code (e.g. 4280, I5023)
+
+Every level is keyed on (icd_version, key), so ICD-9 and ICD-10 codes that
+share characters are never merged. String work (prefixes, chapter lookup)
+is done once per distinct code rather than once per row: rows are reduced
+to integer ids of their distinct (icd_version, icd_code) pair, and counts
+at any level are a bincount over those ids.
+
+Names come from d_icd_diagnoses through DictionaryLookup. Most ICD-9
+categories are not listed there; they take a fallback mapping, the title of
+their unspecified child code (4019 "Unspecified essential hypertension" ->
+"Essential hypertension"), or the version-qualified code and block title.
+ICD-9 chapters are labelled with the title of their ICD-10 counterpart, so
+the same chapter of both versions is reported as one entry. Entries are
+merged by name before the top-N cut.
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from icd_blocks import ICD9_BLOCKS, ICD10_BLOCKS, ICD10_INSERTED_CATEGORIES
+
+# (first category, last category, title), in code order
+ICD9_CHAPTERS = [
+    ('001', '139', 'Infectious and parasitic diseases'),
+    ('140', '239', 'Neoplasms'),
+    ('240', '279', 'Endocrine, nutritional and metabolic diseases, and immunity disorders'),
+    ('280', '289', 'Diseases of the blood and blood-forming organs'),
+    ('290', '319', 'Mental disorders'),
+    ('320', '389', 'Diseases of the nervous system and sense organs'),
+    ('390', '459', 'Diseases of the circulatory system'),
+    ('460', '519', 'Diseases of the respiratory system'),
+    ('520', '579', 'Diseases of the digestive system'),
+    ('580', '629', 'Diseases of the genitourinary system'),
+    ('630', '679', 'Complications of pregnancy, childbirth, and the puerperium'),
+    ('680', '709', 'Diseases of the skin and subcutaneous tissue'),
+    ('710', '739', 'Diseases of the musculoskeletal system and connective tissue'),
+    ('740', '759', 'Congenital anomalies'),
+    ('760', '779', 'Certain conditions originating in the perinatal period'),
+    ('780', '799', 'Symptoms, signs, and ill-defined conditions'),
+    ('800', '999', 'Injury and poisoning'),
+    ('E000', 'E999', 'Supplementary classification of external causes of injury and poisoning'),
+    ('V01', 'V91', 'Supplementary classification of factors influencing health status')
+]
+
+ICD10_CHAPTERS = [
+    ('A00', 'B99', 'Certain infectious and parasitic diseases'),
+    ('C00', 'D49', 'Neoplasms'),
+    ('D50', 'D89', 'Diseases of the blood and blood-forming organs and certain disorders involving the immune mechanism'),
+    ('E00', 'E89', 'Endocrine, nutritional and metabolic diseases'),
+    ('F01', 'F99', 'Mental, behavioral and neurodevelopmental disorders'),
+    ('G00', 'G99', 'Diseases of the nervous system'),
+    ('H00', 'H59', 'Diseases of the eye and adnexa'),
+    ('H60', 'H95', 'Diseases of the ear and mastoid process'),
+    ('I00', 'I99', 'Diseases of the circulatory system'),
+    ('J00', 'J99', 'Diseases of the respiratory system'),
+    ('K00', 'K95', 'Diseases of the digestive system'),
+    ('L00', 'L99', 'Diseases of the skin and subcutaneous tissue'),
+    ('M00', 'M99', 'Diseases of the musculoskeletal system and connective tissue'),
+    ('N00', 'N99', 'Diseases of the genitourinary system'),
+    ('O00', 'O9A', 'Pregnancy, childbirth and the puerperium'),
+    ('P00', 'P96', 'Certain conditions originating in the perinatal period'),
+    ('Q00', 'Q99', 'Congenital malformations, deformations and chromosomal abnormalities'),
+    ('R00', 'R99', 'Symptoms, signs and abnormal clinical and laboratory findings, not elsewhere classified'),
+    ('S00', 'T88', 'Injury, poisoning and certain other consequences of external causes'),
+    ('U00', 'U85', 'Codes for special purposes'),
+    ('V00', 'Y99', 'External causes of morbidity'),
+    ('Z00', 'Z99', 'Factors influencing health status and contact with health services')
+]
+
+LEVELS = ('chapter', 'block', 'category', 'code')
+
+# Chapter keys ("390-459") and titles, per ICD version
+CHAPTER_TITLES = {
+    9: {f"{first}-{last}": title for first, last, title in ICD9_CHAPTERS},
+    10: {f"{first}-{last}": title for first, last, title in ICD10_CHAPTERS}
+}
+
+# ICD-10 chapter covering the same diseases as an ICD-9 chapter; 320-389 is
+# split over three ICD-10 chapters and keeps its own title
+ICD9_CHAPTER_EQUIVALENTS = {
+    '001-139': 'A00-B99', '140-239': 'C00-D49', '240-279': 'E00-E89', '280-289': 'D50-D89',
+    '290-319': 'F01-F99', '390-459': 'I00-I99', '460-519': 'J00-J99', '520-579': 'K00-K95',
+    '580-629': 'N00-N99', '630-679': 'O00-O9A', '680-709': 'L00-L99', '710-739': 'M00-M99',
+    '740-759': 'Q00-Q99', '760-779': 'P00-P96', '780-799': 'R00-R99', '800-999': 'S00-T88',
+    'E000-E999': 'V00-Y99', 'V01-V91': 'Z00-Z99'
+}
+
+_ICD9_NUMERIC_STARTS = np.array([int(first) for first, _, _ in ICD9_CHAPTERS[:17]])
+_ICD9_NUMERIC_KEYS = np.array([f"{first}-{last}" for first, last, _ in ICD9_CHAPTERS[:17]], dtype=object)
+_ICD10_STARTS = np.array([first for first, _, _ in ICD10_CHAPTERS])
+_ICD10_KEYS = np.array([f"{first}-{last}" for first, last, _ in ICD10_CHAPTERS], dtype=object)
+
+
+def chapter_keys(versions, codes):
+    """Chapter key of every (icd_version, icd_code); 'unknown' when it cannot be placed"""
+    versions = np.asarray(versions)
+    codes = pd.Series(codes, dtype=object).astype(str).str.strip().str.upper()
+    keys = np.full(len(codes), 'unknown', dtype=object)
+
+    # ICD-9: numeric categories by range, E and V supplementary chapters by prefix
+    icd9 = versions == 9
+    first = codes.str[:1].to_numpy()
+    keys[icd9 & (first == 'E')] = f"{ICD9_CHAPTERS[17][0]}-{ICD9_CHAPTERS[17][1]}"
+    keys[icd9 & (first == 'V')] = f"{ICD9_CHAPTERS[18][0]}-{ICD9_CHAPTERS[18][1]}"
+    numbers = pd.to_numeric(codes.str[:3], errors='coerce').to_numpy()
+    numeric = icd9 & ~np.isnan(numbers) & (numbers >= 1)
+    positions = np.searchsorted(_ICD9_NUMERIC_STARTS, numbers[numeric], side='right') - 1
+    keys[numeric] = _ICD9_NUMERIC_KEYS[positions]
+
+    # ICD-10: 3-character categories sort in chapter order
+    icd10 = (versions == 10) & (codes.str.len() >= 3).to_numpy()
+    categories = codes.str[:3].to_numpy()[icd10].astype(str)
+    positions = np.searchsorted(_ICD10_STARTS, categories, side='right') - 1
+    keys[np.flatnonzero(icd10)[positions >= 0]] = _ICD10_KEYS[positions[positions >= 0]]
+
+    return keys
+
+
+def _block_key(first, last):
+    return first if first == last else f"{first}-{last}"
+
+
+def _block_categories(first, last):
+    """Every category of a block, e.g. I30-I5A -> I30, I31, ..., I59, I5A"""
+    if first == last:
+        return [first]
+    if first[0].isdigit():
+        return [f"{number:03d}" for number in range(int(first), int(last) + 1)]
+    if len(first) == 4:
+        # ICD-9 E codes
+        return [f"E{number:03d}" for number in range(int(first[1:]), int(last[1:]) + 1)]
+
+    # ICD-10 ranges may end on an alphanumeric category (I5A follows I59)
+    inserted = [] if last[1:].isdigit() else [last]
+    end = last if last[1:].isdigit() else last[:2] + '9'
+    categories = []
+    for letter in range(ord(first[0]), ord(end[0]) + 1):
+        low = int(first[1:]) if chr(letter) == first[0] else 0
+        high = int(end[1:]) if chr(letter) == end[0] else 99
+        categories += [f"{chr(letter)}{number:02d}" for number in range(low, high + 1)]
+    return categories + inserted
+
+
+def _block_index(blocks, inserted=None):
+    index = {}
+    for first, last, _ in blocks:
+        for category in _block_categories(first, last):
+            index[category] = _block_key(first, last)
+    lasts = {first: last for first, last, _ in blocks}
+    for category, first in (inserted or {}).items():
+        index[category] = _block_key(first, lasts[first])
+    return index
+
+
+# Block key of every category, and block titles, per ICD version
+BLOCK_INDEX = {9: _block_index(ICD9_BLOCKS), 10: _block_index(ICD10_BLOCKS, ICD10_INSERTED_CATEGORIES)}
+BLOCK_TITLES = {
+    9: {_block_key(first, last): title for first, last, title in ICD9_BLOCKS},
+    10: {_block_key(first, last): title for first, last, title in ICD10_BLOCKS}
+}
+
+
+def category_keys(versions, codes):
+    """Category of every (icd_version, icd_code): 3 characters, 4 for ICD-9 E codes"""
+    codes = pd.Series(codes, dtype=object).astype(str).str.strip().str.upper()
+    external = (np.asarray(versions) == 9) & codes.str.startswith('E').to_numpy()
+    return np.where(external, codes.str[:4].to_numpy(), codes.str[:3].to_numpy())
+
+
+def block_keys(versions, categories):
+    """Block key of every (icd_version, category); 'unknown' when it cannot be placed"""
+    versions = np.asarray(versions)
+    categories = pd.Series(categories, dtype=object)
+    keys = np.full(len(categories), 'unknown', dtype=object)
+    for version, index in BLOCK_INDEX.items():
+        selected = versions == version
+        keys[selected] = categories[selected].map(index).fillna('unknown').to_numpy()
+    return keys
+
+
+# Qualifiers stripped from an unspecified child code's title to name its category
+_UNSPECIFIED = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'^unspecified\s+',
+    r',?\s+(site|part)\s+unspecified$',
+    r',?\s+(of\s+)?unspecified\s+(site|part)$',
+    r',?\s+unspecified$'
+)]
+
+
+def unspecified_child_titles(dictionary):
+    """Category title derived from its unspecified child code, for ICD-9 categories
+
+    dictionary is d_icd_diagnoses indexed by (icd_version, icd_code). The
+    category's own title is used when listed; otherwise the child "<category>9"
+    when its title says "unspecified" (4019 Unspecified essential hypertension).
+    """
+    titles = dictionary['long_title'].astype(str)
+    icd9 = titles[titles.index.get_level_values(0) == 9]
+    titles = dict(zip(icd9.index.get_level_values(1), icd9.to_numpy()))
+
+    derived = {}
+    for code, title in titles.items():
+        category = code[:4] if code.startswith('E') else code[:3]
+        if code == category:
+            derived[category] = title
+        elif code == category + '9' and category not in titles:
+            name = title
+            for pattern in _UNSPECIFIED:
+                name = pattern.sub('', name)
+            if name != title:
+                derived[category] = name[:1].upper() + name[1:]
+    return derived
+
+
+class DiagnosisCategorizer:
+    def __init__(self, dictionaries=None, fallback_names=None):
+        self.dictionaries = dictionaries
+        self.fallback_names = fallback_names or {}
+        self._category_titles = None
+
+    def _distinct_codes(self, diagnoses):
+        """Integer id of every row's (icd_version, icd_code) pair, and the distinct pairs"""
+        codes = diagnoses['icd_code']
+        if not isinstance(codes.dtype, pd.CategoricalDtype):
+            codes = codes.astype('category')
+        code_ids = codes.cat.codes.to_numpy().astype('int64')
+        versions = diagnoses['icd_version'].to_numpy().astype('int64')
+
+        # Rows without a code are left out (-1 ids)
+        valid = code_ids >= 0
+        pair_ids = np.full(len(code_ids), -1, dtype='int64')
+        pair_ids[valid], pairs = pd.factorize(code_ids[valid] * 16 + versions[valid])
+
+        distinct = pd.DataFrame({
+            'icd_version': (pairs % 16).astype('int8'),
+            'icd_code': np.asarray(codes.cat.categories.astype(str).str.strip())[pairs // 16]
+        })
+        return pair_ids, distinct
+
+    def _level_keys(self, distinct, level):
+        if level == 'code':
+            return distinct['icd_code'].to_numpy()
+        if level == 'category':
+            return category_keys(distinct['icd_version'].to_numpy(), distinct['icd_code'])
+        if level == 'block':
+            versions = distinct['icd_version'].to_numpy()
+            return block_keys(versions, category_keys(versions, distinct['icd_code']))
+        if level == 'chapter':
+            return chapter_keys(distinct['icd_version'].to_numpy(), distinct['icd_code'])
+        raise ValueError(f"Unknown ICD level: {level}")
+
+    def count_levels(self, diagnoses, levels=LEVELS):
+        """{level: row counts indexed by (icd_version, key)}, largest first"""
+        pair_ids, distinct = self._distinct_codes(diagnoses)
+        pair_ids = pair_ids[pair_ids >= 0]
+
+        counts = {}
+        for level in levels:
+            keys = pd.MultiIndex.from_arrays([distinct['icd_version'].to_numpy(),
+                                              self._level_keys(distinct, level)],
+                                             names=['icd_version', level])
+            key_ids, key_index = pd.factorize(keys)
+            level_counts = np.bincount(key_ids[pair_ids], minlength=len(key_index))
+            # Largest first, ties broken by (icd_version, key) so top-N cuts are deterministic
+            order = np.lexsort((key_index.get_level_values(1).astype(str), key_index.get_level_values(0), -level_counts))
+            counts[level] = pd.Series(level_counts[order], index=key_index[order])
+        return counts
+
+    def count(self, diagnoses, level='category'):
+        """Row counts at one level, indexed by (icd_version, key)"""
+        return self.count_levels(diagnoses, [level])[level]
+
+    def _dictionary_labels(self, versions, keys):
+        if self.dictionaries is None:
+            return [None] * len(keys)
+        try:
+            return self.dictionaries.labels('d_icd_diagnoses', versions, keys).tolist()
+        except FileNotFoundError:
+            return [None] * len(keys)
+
+    def category_titles(self):
+        """{category: title} of ICD-9 categories, derived once from d_icd_diagnoses"""
+        if self._category_titles is None:
+            self._category_titles = {}
+            if self.dictionaries is not None:
+                try:
+                    self._category_titles = unspecified_child_titles(self.dictionaries.table('d_icd_diagnoses'))
+                except FileNotFoundError:
+                    pass
+        return self._category_titles
+
+    def _name(self, version, key, level, label):
+        """Readable name of one (icd_version, key); version-qualified when no title is known"""
+        if isinstance(label, str):
+            return label
+        if level == 'chapter':
+            if version == 9:
+                key = ICD9_CHAPTER_EQUIVALENTS.get(key, key)
+                version = 10 if key in CHAPTER_TITLES[10] else 9
+            return CHAPTER_TITLES.get(version, {}).get(key, f"ICD-{version} {key}")
+        if level == 'block':
+            return BLOCK_TITLES.get(version, {}).get(key, f"ICD-{version} {key}")
+
+        if level == 'category' and version == 9:
+            name = self.fallback_names.get(key) or self.category_titles().get(key)
+            if name:
+                return name
+        if level == 'category':
+            block = BLOCK_TITLES.get(version, {}).get(BLOCK_INDEX.get(version, {}).get(key))
+            if block:
+                return f"ICD-{version} {key} ({block})"
+        # Keys of older state files carry no version
+        return f"ICD-{version} {key}" if version else key
+
+    def label(self, counts, level='category', top=None):
+        """{name: count} for counts indexed by (icd_version, key), largest first
+
+        Entries of both versions with the same name are merged before the
+        top-N cut, so the cut is taken over merged totals.
+        """
+        versions = counts.index.get_level_values(0).astype('int8')
+        keys = counts.index.get_level_values(1).astype(str)
+
+        if level in ('category', 'code'):
+            labels = self._dictionary_labels(versions, keys)
+        else:
+            labels = [None] * len(counts)
+
+        named, spellings = {}, {}
+        for version, key, label, count in zip(versions, keys, labels, counts.to_numpy()):
+            name = self._name(int(version), key, level, label)
+            # Curated and dictionary names differ in capitalization only
+            name = spellings.setdefault(name.casefold(), name)
+            named[name] = named.get(name, 0) + count
+        # Same-named entries of both versions are merged, so re-rank
+        ranked = sorted(named.items(), key=lambda item: item[1], reverse=True)
+        return dict(ranked[:top] if top else ranked)
+
+    def rollup(self, diagnoses, levels=LEVELS, top=20):
+        """{level: {name: count}} with the top entries of every level"""
+        counts = self.count_levels(diagnoses, levels)
+        return {level: self.label(level_counts, level, top) for level, level_counts in counts.items()}
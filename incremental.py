@@ -0,0 +1,152 @@
+"""
+Incremental Processing State
+============================
+
+On-disk state for HospitalDataProcessor's incremental mode.
+
+The state file keeps, for every section of visualization_data.json, the
+running aggregates needed to rebuild its statistics (value counts, sums and
+counts for means, hour/day histograms, sketch states for percentiles and
+distinct counts) plus a high-water mark per source
+table, e.g. max ``charttime`` of labevents. Each run folds in only the rows
+past the mark, assuming the feeds are append-only with strictly increasing
+marks. Tables keyed by an id that is not increasing (diagnoses_icd rows
+arrive per ``hadm_id``, and hadm_ids are random) keep the set of ids folded
+so far instead, see unseen_rows().
+
+Everything is stored as plain JSON; mapping keys are therefore strings and
+are converted back by the section finalizers. States folded from disjoint
+rows (e.g. by the partitions of a partitioned run) combine with
+merge_states().
+"""
+
+import os
+import copy
+import json
+
+import numpy as np
+import pandas as pd
+
+from sketches import GroupedQuantileSketch, HyperLogLog
+
+
+class IncrementalState:
+    def __init__(self, path='incremental_state.json'):
+        self.path = path
+        self.watermarks = {}
+        self.seen = {}
+        self.sections = {}
+
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.watermarks = saved.get('watermarks', {})
+            self.seen = saved.get('seen', {})
+            self.sections = saved.get('sections', {})
+
+    def watermark(self, table):
+        """High-water mark of a table, or None if nothing was folded yet"""
+        mark = self.watermarks.get(table)
+        if isinstance(mark, str):
+            return pd.Timestamp(mark)
+        return mark
+
+    def advance(self, table, mark):
+        """Move a table's high-water mark forward"""
+        if mark is None or pd.isna(mark):
+            return
+        current = self.watermark(table)
+        if current is not None and mark <= current:
+            return
+        if isinstance(mark, pd.Timestamp):
+            self.watermarks[table] = mark.isoformat()
+        else:
+            self.watermarks[table] = int(mark)
+
+    def new_rows(self, table, df, column):
+        """Rows of a table past its high-water mark; advances the mark"""
+        mark = self.watermark(table)
+        rows = df if mark is None else df[df[column] > mark]
+        if len(rows) > 0:
+            self.advance(table, rows[column].max())
+        return rows
+
+    def unseen_rows(self, table, df, column):
+        """Rows of a table whose (integer) key was not folded yet; records their keys
+
+        Every key's rows must arrive together, as diagnoses do per admission.
+        """
+        keys = df[column].to_numpy(dtype='int64')
+        seen = self.seen.get(table)
+        if seen is None:
+            # State files written before key tracking only have a high-water mark
+            mark = self.watermark(table)
+            seen = [] if mark is None else np.unique(keys[keys <= mark])
+        new = ~np.isin(keys, seen)
+        self.seen[table] = np.union1d(seen, keys[new]).astype('int64').tolist()
+        self.watermarks.pop(table, None)
+        return df[new]
+
+    def section(self, name):
+        """Mutable aggregate state of one output section"""
+        return self.sections.setdefault(name, {})
+
+    def save(self):
+        with open(self.path, 'w') as f:
+            json.dump({'watermarks': self.watermarks, 'seen': self.seen, 'sections': self.sections}, f)
+
+
+def add_total(state, key, value):
+    """Add a scalar to a running sum"""
+    state[key] = state.get(key, 0) + value
+
+
+def add_counts(state, key, counts):
+    """Add a value_counts-style mapping (or per-key sums) into a running histogram"""
+    histogram = state.setdefault(key, {})
+    for value, count in counts.items():
+        if count:
+            count = count.item() if hasattr(count, 'item') else count
+            histogram[str(value)] = histogram.get(str(value), 0) + count
+
+
+def sorted_counts(histogram, key_type=str):
+    """Histogram ordered by descending count, like value_counts().to_dict()"""
+    items = sorted(histogram.items(), key=lambda item: item[1], reverse=True)
+    return {key_type(value): count for value, count in items}
+
+
+def add_to_sketch(state, key, sketch_type, *values):
+    """Fold values into a sketch (sketches.py) kept in its to_dict() form"""
+    sketch = load_sketch(state, key, sketch_type)
+    sketch.update(*values)
+    state[key] = sketch.to_dict()
+    return sketch
+
+
+def load_sketch(state, key, sketch_type):
+    """Sketch saved under key, or an empty one"""
+    return sketch_type.from_dict(state[key]) if key in state else sketch_type()
+
+
+def merge_states(state, other):
+    """Fold another section state, built from disjoint rows, into state
+
+    Running sums add up, histograms add per key and sketch states merge.
+    Entries that are neither (e.g. the transfers unit maps) are left to the
+    section's own merge.
+    """
+    for key, value in other.items():
+        if key not in state:
+            state[key] = copy.deepcopy(value)
+        elif isinstance(value, dict) and 'registers' in value:
+            state[key] = HyperLogLog.from_dict(state[key]).merge(HyperLogLog.from_dict(value)).to_dict()
+        elif isinstance(value, dict) and 'buckets' in value:
+            # QuantileSketch states are GroupedQuantileSketch states with a single key
+            merged = GroupedQuantileSketch.from_dict(state[key]).merge(GroupedQuantileSketch.from_dict(value))
+            state[key] = merged.to_dict()
+        elif isinstance(value, dict):
+            merge_states(state[key], value)
+        else:
+            state[key] += value
+    return state
@@ -0,0 +1,237 @@
+"""
+Visualization JSON Export
+=========================
+
+Single-pass serializer for HospitalDataProcessor.processed_data.
+
+numpy scalars and arrays, pandas Timestamps/Timedeltas and NaN/NaT are
+encoded directly by the encoder, without first copying the whole tree into
+plain Python types. Non-finite floats become ``null`` so the output is
+valid for the browser's JSON.parse.
+
+orjson is used when installed and the standard library encoder otherwise.
+Output can be pretty-printed (default) or compact, and optionally written
+gzip or brotli compressed (brotli requires the ``brotli`` package).
+
+write_shards splits the export into one file per top-level section plus a
+``manifest.json`` listing each shard's file name, size and SHA-256 content
+hash, so the dashboard can fetch only the sections a panel needs and keep
+unchanged shards cached across refreshes.
+"""
+
+import io
+import os
+import gzip
+import hashlib
+import json
+import math
+import time
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'brotli': '.br'}
+
+
+def _encode_default(obj):
+    """Encode the types json/orjson do not handle natively"""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        value = float(obj)
+        return value if math.isfinite(value) else None
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (pd.Timestamp, datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, pd.Timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    return str(obj)
+
+
+def _floatstr(value):
+    """float -> JSON text, with NaN/Infinity written as null"""
+    return float.__repr__(value) if math.isfinite(value) else 'null'
+
+
+class VisualizationEncoder(json.JSONEncoder):
+    """Standard library encoder used when orjson is not installed"""
+
+    def default(self, obj):
+        return _encode_default(obj)
+
+    def iterencode(self, o, _one_shot=False):
+        # Same as JSONEncoder.iterencode, but with a float formatter that
+        # emits null for non-finite values instead of NaN/Infinity
+        markers = {} if self.check_circular else None
+        encoder = json.encoder.encode_basestring_ascii if self.ensure_ascii else json.encoder.encode_basestring
+        return json.encoder._make_iterencode(
+            markers, self.default, encoder, self.indent, _floatstr,
+            self.key_separator, self.item_separator, self.sort_keys,
+            self.skipkeys, _one_shot)(o, 0)
+
+
+def dumps(data, compact=False):
+    """Serialize processed data to UTF-8 JSON bytes"""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_encode_default, option=option)
+
+    if compact:
+        encoder = VisualizationEncoder(separators=(',', ':'))
+    else:
+        encoder = VisualizationEncoder(indent=2)
+    return encoder.encode(data).encode('utf-8')
+
+
+def compress(payload, compression):
+    """Compress serialized bytes with gzip or brotli"""
+    if compression == 'gzip':
+        buffer = io.BytesIO()
+        # mtime=0 keeps the output byte-identical across runs
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+            f.write(payload)
+        return buffer.getvalue()
+    if compression == 'brotli':
+        if not BROTLI_AVAILABLE:
+            raise ImportError("brotli compression requires the 'brotli' package")
+        return brotli.compress(payload)
+    if compression is None:
+        return payload
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def decompress(payload, compression):
+    """Inverse of compress()"""
+    if compression == 'gzip':
+        return gzip.decompress(payload)
+    if compression == 'brotli':
+        if not BROTLI_AVAILABLE:
+            raise ImportError("brotli compression requires the 'brotli' package")
+        return brotli.decompress(payload)
+    if compression is None:
+        return payload
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+def write_json(data, output_file, compact=False, compression=None, update=False):
+    """Write processed data to output_file and return the path written
+
+    Compressed output gets a .gz/.br suffix unless the name already has it.
+    With update, sections of an existing output_file that are not in data
+    are kept.
+    """
+    suffix = COMPRESSION_SUFFIXES.get(compression, '')
+    if suffix and not output_file.endswith(suffix):
+        output_file += suffix
+
+    if update and os.path.exists(output_file):
+        with open(output_file, 'rb') as f:
+            existing = json.loads(decompress(f.read(), compression))
+        data = {**existing, **data}
+    payload = compress(dumps(data, compact), compression)
+
+    with open(output_file, 'wb') as f:
+        f.write(payload)
+    return output_file
+
+
+def write_shards(data, output_dir, compact=False, compression=None, update=False):
+    """Write one file per top-level section plus manifest.json; returns the paths written
+
+    The hash is taken over the uncompressed JSON, so it identifies the
+    section's content regardless of the compression used. With update,
+    sections of an existing manifest that are not in data are kept.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = COMPRESSION_SUFFIXES.get(compression, '')
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+
+    manifest = {'compression': compression, 'sections': {}}
+    if update and os.path.exists(manifest_path):
+        with open(manifest_path, 'rb') as f:
+            existing = json.loads(f.read())
+        if existing.get('compression') == compression:
+            manifest['sections'] = existing.get('sections', {})
+    written = []
+    for section, section_data in data.items():
+        payload = dumps(section_data, compact)
+        filename = f"{section}.json{suffix}"
+        path = os.path.join(output_dir, filename)
+        compressed = compress(payload, compression)
+        with open(path, 'wb') as f:
+            f.write(compressed)
+
+        manifest['sections'][section] = {
+            'file': filename,
+            'bytes': len(compressed),
+            'sha256': hashlib.sha256(payload).hexdigest()
+        }
+        written.append(path)
+
+    # The manifest is written last so it never points at a missing shard
+    with open(manifest_path, 'wb') as f:
+        f.write(dumps(manifest))
+    written.append(manifest_path)
+    return written
+
+
+def _legacy_dumps(data):
+    """The original export path: recursive type conversion + json.dump(indent=2)"""
+    def convert_types(obj):
+        if isinstance(obj, np.integer):
+            return int(obj)
+        elif isinstance(obj, np.floating):
+            return float(obj)
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
+        elif isinstance(obj, dict):
+            return {key: convert_types(value) for key, value in obj.items()}
+        elif isinstance(obj, list):
+            return [convert_types(item) for item in obj]
+        else:
+            return obj
+
+    return json.dumps(convert_types(data), indent=2, default=str).encode('utf-8')
+
+
+def benchmark(data, repeat=5):
+    """Print encode time and output size of the original path and each export mode"""
+    modes = [
+        ('original (convert_types + indent=2)', lambda: _legacy_dumps(data)),
+        ('pretty', lambda: dumps(data)),
+        ('compact', lambda: dumps(data, compact=True)),
+        ('compact + gzip', lambda: compress(dumps(data, compact=True), 'gzip')),
+    ]
+    if BROTLI_AVAILABLE:
+        modes.append(('compact + brotli', lambda: compress(dumps(data, compact=True), 'brotli')))
+
+    print(f"Serializer: {'orjson' if ORJSON_AVAILABLE else 'json (standard library)'}")
+    for name, encode in modes:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            payload = encode()
+            timings.append(time.perf_counter() - start)
+        print(f"  {name:<38} {min(timings) * 1000:8.2f} ms  {len(payload) / 1024:9.1f} KB")
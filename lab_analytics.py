@@ -0,0 +1,145 @@
+"""
+Laboratory Analytics
+====================
+
+Streaming turnaround, abnormality and value-distribution statistics for
+labevents, for the Laboratory room panel.
+
+LabAnalytics is fed labevents chunk by chunk. Per chunk everything is
+vectorized: hour and day of week are integer codes from ``charttime``
+(no per-row strings), hourly/daily counts are bincounts, and turnaround
+(``storetime - charttime``, in minutes) and ``valuenum`` distributions go
+into GroupedQuantileSketch so quantiles need no raw values. Distinct
+patients and the most-tested admissions come from HyperLogLog and
+CountMinSketch. Accumulators from different chunks or workers combine with
+merge().
+"""
+
+import calendar
+
+import numpy as np
+import pandas as pd
+
+from sketches import GroupedQuantileSketch, HyperLogLog, CountMinSketch
+
+DAY_NAMES = list(calendar.day_name)
+
+# Turnaround bands shown on the Laboratory dashboard (upper bound in minutes, label)
+TURNAROUND_BANDS = [(60, '<1h'), (180, '1-3h'), (np.inf, '>3h')]
+
+TURNAROUND_QUANTILES = (0.5, 0.9, 0.95)
+VALUE_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class LabAnalytics:
+    def __init__(self, relative_accuracy=0.01):
+        self.total = 0
+        self.hourly = np.zeros(24, dtype='int64')
+        self.hourly_abnormal = np.zeros(24, dtype='int64')
+        self.daily = np.zeros(7, dtype='int64')
+        self.bands = np.zeros(len(TURNAROUND_BANDS), dtype='int64')
+        self.turnaround_sum = 0.0
+        self.item_counts = pd.Series(dtype='int64')
+        self.item_abnormal = pd.Series(dtype='int64')
+
+        # Turnaround by hour of draw, by priority (STAT/ROUTINE) and by item; values by item
+        self.turnaround = {dimension: GroupedQuantileSketch(relative_accuracy)
+                           for dimension in ('overall', 'hour', 'priority', 'itemid')}
+        self.values = GroupedQuantileSketch(relative_accuracy)
+        self.patients = HyperLogLog()
+        self.admissions = CountMinSketch()
+
+    def update(self, chunk):
+        """Fold one labevents chunk (itemid, charttime and optionally storetime, flag, priority, valuenum)"""
+        charttime = pd.to_datetime(chunk['charttime'])
+        timed = charttime.notna().to_numpy()
+        chunk, charttime = chunk[timed], charttime[timed]
+        if chunk.empty:
+            return
+
+        hour = charttime.dt.hour.to_numpy()
+        day = charttime.dt.dayofweek.to_numpy()
+        itemid = chunk['itemid'].to_numpy()
+        if 'flag' in chunk.columns:
+            abnormal = (chunk['flag'].astype(object) == 'abnormal').to_numpy()
+        else:
+            abnormal = np.zeros(len(chunk), dtype=bool)
+
+        self.total += len(chunk)
+        self.hourly += np.bincount(hour, minlength=24)
+        self.hourly_abnormal += np.bincount(hour[abnormal], minlength=24)
+        self.daily += np.bincount(day, minlength=7)
+        self.item_counts = self.item_counts.add(pd.Series(itemid).value_counts(), fill_value=0).astype('int64')
+        self.item_abnormal = self.item_abnormal.add(pd.Series(itemid[abnormal]).value_counts(),
+                                                    fill_value=0).astype('int64')
+
+        if 'storetime' in chunk.columns:
+            minutes = ((pd.to_datetime(chunk['storetime']) - charttime).dt.total_seconds() / 60).to_numpy()
+            # Results stored before the draw time are charting errors
+            valid = np.isfinite(minutes) & (minutes >= 0)
+            minutes = minutes[valid]
+
+            self.turnaround_sum += minutes.sum()
+            bounds = np.array([upper for upper, _ in TURNAROUND_BANDS])
+            self.bands += np.bincount(np.searchsorted(bounds, minutes, side='left'), minlength=len(bounds))
+
+            self.turnaround['overall'].update(np.zeros(len(minutes), dtype='int8'), minutes)
+            self.turnaround['hour'].update(hour[valid], minutes)
+            self.turnaround['itemid'].update(itemid[valid], minutes)
+            if 'priority' in chunk.columns:
+                priority = chunk['priority'].astype(object).fillna('UNKNOWN').to_numpy()
+                self.turnaround['priority'].update(priority[valid], minutes)
+
+        if 'valuenum' in chunk.columns:
+            self.values.update(itemid, chunk['valuenum'].to_numpy(dtype='float64', na_value=np.nan))
+        if 'subject_id' in chunk.columns:
+            self.patients.update(chunk['subject_id'])
+        if 'hadm_id' in chunk.columns:
+            self.admissions.update(chunk['hadm_id'])
+
+    def merge(self, other):
+        """Combine with the accumulator of another chunk range or worker"""
+        self.total += other.total
+        self.hourly += other.hourly
+        self.hourly_abnormal += other.hourly_abnormal
+        self.daily += other.daily
+        self.bands += other.bands
+        self.turnaround_sum += other.turnaround_sum
+        self.item_counts = self.item_counts.add(other.item_counts, fill_value=0).astype('int64')
+        self.item_abnormal = self.item_abnormal.add(other.item_abnormal, fill_value=0).astype('int64')
+        for dimension, sketch in self.turnaround.items():
+            sketch.merge(other.turnaround[dimension])
+        self.values.merge(other.values)
+        self.patients.merge(other.patients)
+        self.admissions.merge(other.admissions)
+        return self
+
+    def summary(self, top_items=25):
+        """Dashboard section: turnaround, abnormal rates and value distributions"""
+        top = [int(item) for item in self.item_counts.sort_values(ascending=False, kind='stable').index[:top_items]]
+        abnormal = self.item_abnormal.reindex(top, fill_value=0)
+        timed = int(self.bands.sum())
+
+        overall = self.turnaround['overall'].summary(TURNAROUND_QUANTILES).get(0, {'count': 0})
+        overall['mean'] = self.turnaround_sum / timed if timed else np.nan
+
+        return {
+            'total_lab_events': self.total,
+            'unique_patients': self.patients.count(),
+            'busiest_admissions': self.admissions.top(10),
+            'daily_frequency': {DAY_NAMES[day]: int(count) for day, count in enumerate(self.daily)},
+            'turnaround_minutes': {
+                'overall': overall,
+                'bands': {label: int(count) for (_, label), count in zip(TURNAROUND_BANDS, self.bands)},
+                'by_hour': self.turnaround['hour'].summary(TURNAROUND_QUANTILES),
+                'by_priority': self.turnaround['priority'].summary(TURNAROUND_QUANTILES),
+                'by_item': self.turnaround['itemid'].summary(TURNAROUND_QUANTILES, keys=top)
+            },
+            'abnormal_rate': {
+                'overall': self.hourly_abnormal.sum() / self.total if self.total else np.nan,
+                'by_hour': {hour: self.hourly_abnormal[hour] / self.hourly[hour]
+                            for hour in range(24) if self.hourly[hour]},
+                'by_item': {item: abnormal[item] / self.item_counts[item] for item in top}
+            },
+            'value_distribution': self.values.summary(VALUE_QUANTILES, keys=top)
+        }
@@ -0,0 +1,231 @@
+"""
+Medication Administration Analytics
+===================================
+
+Per-drug administration volumes, order-to-administration latency and
+hourly pharmacy workload, for the Pharmacy room panel.
+
+emar (one row per charted administration event) is joined to pharmacy
+(one row per order) on ``pharmacy_id``, falling back to ``poe_id`` for eMAR
+rows without one, and to prescriptions (the order's MAIN drug) on
+``pharmacy_id``. The join is a streaming hash join: the order side
+(pharmacy and prescriptions, projected to the handful of columns used) is
+built once, then emar is probed chunk by chunk and only per-drug, per-hour
+and per-order aggregates are kept, so emar is never materialized.
+
+Projection comes from the table schemas; admission and time filters are
+applied by pushdown() to each chunk as it is read, before any join work.
+With a time window, orders are those entered in it and doses those charted
+in it. Analytics of separate extracts combine with merge().
+"""
+
+import numpy as np
+import pandas as pd
+
+from lab_analytics import DAY_NAMES
+
+# eMAR event_txt values that mean a dose was given
+ADMINISTERED_EVENTS = {
+    'Administered', 'Delayed Administered', 'Partial Administered',
+    'Administered Bolus from IV Drip', 'Administered in Other Location',
+    'Applied', 'Applied in Other Location', 'Removed Existing / Applied New',
+    'Started', 'Delayed Started', 'Started in Other Location', 'Restarted'
+}
+
+# ...and values that mean a scheduled dose was withheld
+NOT_GIVEN_EVENTS = {'Not Given', 'Not Given per Sliding Scale', 'Hold Dose', 'Not Applied', 'Not Started'}
+
+LATENCY_QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+
+def pushdown(chunk, hadm_ids=None, time_column=None, start=None, end=None):
+    """Rows of a freshly read chunk in the requested admissions and [start, end) window"""
+    keep = np.ones(len(chunk), dtype=bool)
+    if hadm_ids is not None and 'hadm_id' in chunk.columns:
+        keep &= chunk['hadm_id'].isin(hadm_ids).to_numpy(dtype=bool, na_value=False)
+    if time_column is not None and (start is not None or end is not None):
+        times = pd.to_datetime(chunk[time_column])
+        if start is not None:
+            keep &= (times >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            keep &= (times < pd.Timestamp(end)).to_numpy()
+    return chunk if keep.all() else chunk[keep]
+
+
+def _union(first, second):
+    """Rows of two frames/series keyed by index; the first wins on duplicate keys"""
+    combined = pd.concat([first, second])
+    return combined[~combined.index.duplicated()]
+
+
+def _quantiles(minutes):
+    minutes = minutes[np.isfinite(minutes) & (minutes >= 0)]
+    if not len(minutes):
+        return {'count': 0}
+    summary = {'count': int(len(minutes)), 'mean': round(float(minutes.mean()), 1)}
+    for q, value in zip(LATENCY_QUANTILES, np.quantile(minutes, LATENCY_QUANTILES)):
+        summary[f"p{int(q * 100)}"] = round(float(value), 1)
+    return summary
+
+
+class MedicationAnalytics:
+    def __init__(self):
+        self._drug_parts = []
+        self._order_parts = []
+        self.drugs = None
+        self.orders = None
+        self._poe_orders = None
+
+        self.administrations = 0
+        self.hourly = np.zeros(24, dtype='int64')
+        self.daily = np.zeros(7, dtype='int64')
+        self.event_counts = pd.Series(dtype='int64')
+        self.drug_counts = pd.Series(dtype='int64')
+        self.route_counts = pd.Series(dtype='int64')
+        self.first_given = pd.Series(dtype='datetime64[ns]')
+
+    # Build side: prescriptions and pharmacy, projected and filtered by the reader
+
+    def add_prescriptions(self, chunk):
+        """Order -> drug name from a prescriptions chunk (MAIN component only)"""
+        if 'drug_type' in chunk.columns:
+            chunk = chunk[(chunk['drug_type'].astype(object) == 'MAIN').to_numpy()]
+        chunk = chunk.dropna(subset=['pharmacy_id', 'drug'])
+        self._drug_parts.append(pd.DataFrame({'pharmacy_id': chunk['pharmacy_id'].astype('int64').to_numpy(),
+                                              'drug': chunk['drug'].astype(object).to_numpy()}))
+
+    def add_pharmacy(self, chunk):
+        """Order entry/verification times and route from a pharmacy chunk"""
+        columns = [column for column in ('pharmacy_id', 'poe_id', 'entertime', 'verifiedtime', 'route')
+                   if column in chunk.columns]
+        self._order_parts.append(chunk.dropna(subset=['pharmacy_id'])[columns])
+
+    def _build(self):
+        if self.orders is not None:
+            return
+
+        drugs = pd.concat(self._drug_parts, ignore_index=True) if self._drug_parts else \
+            pd.DataFrame({'pharmacy_id': pd.Series(dtype='int64'), 'drug': pd.Series(dtype=object)})
+        drugs = drugs.drop_duplicates('pharmacy_id')
+        self.drugs = pd.Series(drugs['drug'].astype('category').to_numpy(), index=drugs['pharmacy_id'].to_numpy())
+
+        orders = pd.concat(self._order_parts, ignore_index=True) if self._order_parts else \
+            pd.DataFrame({'pharmacy_id': pd.Series(dtype='int64'), 'entertime': pd.Series(dtype='datetime64[ns]')})
+        orders = orders.astype({'pharmacy_id': 'int64'}).drop_duplicates('pharmacy_id').set_index('pharmacy_id')
+        for column in ('entertime', 'verifiedtime'):
+            if column in orders.columns:
+                orders[column] = pd.to_datetime(orders[column])
+        self.orders = orders
+
+        # poe_id -> earliest pharmacy order, for eMAR rows without a pharmacy_id
+        if 'poe_id' in orders.columns:
+            by_poe = orders.dropna(subset=['poe_id']).sort_values('entertime', kind='stable')
+            by_poe = by_poe[~by_poe['poe_id'].duplicated()]
+            self._poe_orders = pd.Series(by_poe.index.to_numpy(), index=by_poe['poe_id'].astype(object).to_numpy())
+        self._drug_parts, self._order_parts = [], []
+
+    # Probe side: emar chunks
+
+    def update(self, chunk):
+        """Fold one emar chunk (after pushdown) into the aggregates"""
+        self._build()
+        statuses = chunk['event_txt'].astype(object).fillna('Unknown').str.strip()
+        self.event_counts = self.event_counts.add(statuses.value_counts(), fill_value=0).astype('int64')
+
+        given = statuses.isin(ADMINISTERED_EVENTS).to_numpy()
+        chunk = chunk[given]
+        charttime = pd.to_datetime(chunk['charttime'])
+        timed = charttime.notna().to_numpy()
+        chunk, charttime = chunk[timed], charttime[timed]
+        if chunk.empty:
+            return
+
+        # Join: pharmacy_id, else the order of the row's poe_id
+        order_ids = pd.Series(chunk['pharmacy_id'].to_numpy(dtype='float64', na_value=np.nan))
+        if self._poe_orders is not None and 'poe_id' in chunk.columns:
+            via_poe = self._poe_orders.reindex(chunk['poe_id'].astype(object).to_numpy()).to_numpy(dtype='float64')
+            order_ids = order_ids.fillna(pd.Series(via_poe))
+        matched = order_ids.notna().to_numpy()
+        order_ids = order_ids.to_numpy()
+
+        drug = pd.Series(chunk['medication'].astype(object).to_numpy()) if 'medication' in chunk.columns else \
+            pd.Series(np.full(len(chunk), None, dtype=object))
+        matched_ids = order_ids[matched].astype('int64')
+        names = self.drugs.reindex(matched_ids).astype(object).to_numpy()
+        drug[matched] = np.where(pd.isna(names), drug[matched].to_numpy(), names)
+
+        route = pd.Series(np.full(len(chunk), 'Unknown', dtype=object))
+        if 'route' in self.orders.columns:
+            route[matched] = self.orders['route'].reindex(matched_ids).astype(object).fillna('Unknown').to_numpy()
+
+        self.administrations += len(chunk)
+        self.hourly += np.bincount(charttime.dt.hour.to_numpy(), minlength=24)
+        self.daily += np.bincount(charttime.dt.dayofweek.to_numpy(), minlength=7)
+        self.drug_counts = self.drug_counts.add(drug.fillna('Unknown').value_counts(), fill_value=0).astype('int64')
+        self.route_counts = self.route_counts.add(route.value_counts(), fill_value=0).astype('int64')
+
+        first = pd.Series(charttime.to_numpy()[matched]).groupby(matched_ids).min()
+        self.first_given = pd.concat([self.first_given, first]).groupby(level=0).min()
+
+    def merge(self, other):
+        """Combine with the analytics of another extract (order ids must not overlap)"""
+        self._build()
+        other._build()
+        self.drugs = _union(self.drugs.astype(object), other.drugs.astype(object)).astype('category')
+        self.orders = _union(self.orders, other.orders)
+        if other._poe_orders is not None:
+            self._poe_orders = other._poe_orders if self._poe_orders is None else \
+                _union(self._poe_orders, other._poe_orders)
+
+        self.administrations += other.administrations
+        self.hourly += other.hourly
+        self.daily += other.daily
+        for name in ('event_counts', 'drug_counts', 'route_counts'):
+            setattr(self, name, getattr(self, name).add(getattr(other, name), fill_value=0).astype('int64'))
+        self.first_given = pd.concat([self.first_given, other.first_given]).groupby(level=0).min()
+        return self
+
+    def summary(self, top_drugs=25):
+        """Pharmacy panel section: volumes, latency and workload"""
+        self._build()
+        orders = self.orders
+        top = self.drug_counts.sort_values(ascending=False, kind='stable').head(top_drugs)
+
+        # Order entry to first charted dose, per administered order
+        entered = orders['entertime'].reindex(self.first_given.index)
+        first_dose = ((self.first_given - entered).dt.total_seconds() / 60).to_numpy()
+        order_drugs = self.drugs.reindex(self.first_given.index).astype(object).to_numpy()
+        latency_by_drug = {}
+        for drug in top.index:
+            minutes = first_dose[order_drugs == drug]
+            minutes = minutes[np.isfinite(minutes) & (minutes >= 0)]
+            if len(minutes):
+                latency_by_drug[drug] = round(float(np.median(minutes)), 1)
+
+        workload = {'administrations': self.hourly.tolist(),
+                    'orders_entered': np.bincount(orders['entertime'].dropna().dt.hour, minlength=24).tolist()}
+        verification = {'count': 0}
+        if 'verifiedtime' in orders.columns:
+            workload['orders_verified'] = np.bincount(orders['verifiedtime'].dropna().dt.hour, minlength=24).tolist()
+            verification = _quantiles(((orders['verifiedtime'] - orders['entertime']).dt.total_seconds() / 60)
+                                      .to_numpy())
+
+        given = int(self.event_counts.reindex(list(ADMINISTERED_EVENTS), fill_value=0).sum())
+        withheld = int(self.event_counts.reindex(list(NOT_GIVEN_EVENTS), fill_value=0).sum())
+
+        return {
+            'total_administrations': self.administrations,
+            'total_orders': len(orders),
+            'administered_orders': len(self.first_given),
+            'top_drugs': {drug: int(count) for drug, count in top.items()},
+            'routes': {route: int(count) for route, count in
+                       self.route_counts.sort_values(ascending=False, kind='stable').items()},
+            'event_status': {status: int(count) for status, count in
+                             self.event_counts.sort_values(ascending=False, kind='stable').head(15).items()},
+            'not_given_rate': withheld / (given + withheld) if given + withheld else np.nan,
+            'order_to_first_dose_minutes': _quantiles(first_dose),
+            'median_first_dose_minutes_by_drug': latency_by_drug,
+            'verification_minutes': verification,
+            'hourly_workload': workload,
+            'daily_administrations': {DAY_NAMES[day]: int(count) for day, count in enumerate(self.daily)}
+        }
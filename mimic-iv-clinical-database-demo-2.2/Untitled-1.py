@@ -1,5 +1,9 @@
-import pandas as pd
 import os
+import sys
+
+# patient_timeline.py lives at the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from patient_timeline import EventStore
 
 # ---------------------------
 # CONFIG
@@ -8,67 +12,14 @@ HADM_ID = 20093566
 HOSP = "hosp/"  # update if needed
 
 # ---------------------------
-# Load CSV or CSV.GZ
+# Build (or reuse) the hadm_id-indexed event store
 # ---------------------------
-def load_csv(name, parse_dates=None):
-    path_csv = os.path.join(HOSP, f"{name}.csv")
-    path_gz = os.path.join(HOSP, f"{name}.csv.gz")
-    if os.path.exists(path_gz):
-        return pd.read_csv(path_gz, parse_dates=parse_dates)
-    elif os.path.exists(path_csv):
-        return pd.read_csv(path_csv, parse_dates=parse_dates)
-    else:
-        raise FileNotFoundError(f"❌ File not found: {name}.csv or {name}.csv.gz")
+store = EventStore(HOSP).build()
 
 # ---------------------------
-# Load Tables
-# ---------------------------
-admissions = load_csv("admissions", ["admittime", "dischtime"])
-transfers = load_csv("transfers", ["intime", "outtime"])
-services = load_csv("services", ["transfertime"])
-labevents = load_csv("labevents", ["charttime"])
-d_labitems = load_csv("d_labitems")
-diagnoses = load_csv("diagnoses_icd")
-d_icd = load_csv("d_icd_diagnoses")
-prescriptions = load_csv("prescriptions", ["starttime", "stoptime"])
-emar = load_csv("emar", ["charttime"])
-
+# Extract one admission's timeline
 # ---------------------------
-# Enrich and Filter by hadm_id
-# ---------------------------
-labevents = labevents.merge(d_labitems, on="itemid", how="left")
-diagnoses = diagnoses.merge(d_icd, on="icd_code", how="left")
-
-def enrich_and_tag(df, table_name, time_cols):
-    if "hadm_id" not in df.columns:
-        return pd.DataFrame()
-    df = df[df["hadm_id"] == HADM_ID].copy()
-    if df.empty:
-        return pd.DataFrame()
-    df["source_table"] = table_name
-    for col in time_cols:
-        if col in df.columns:
-            df["event_time"] = df[col]
-            break
-    else:
-        df["event_time"] = pd.NaT
-    return df
-
-# ---------------------------
-# Apply to All Tables
-# ---------------------------
-tables = [
-    (admissions, "admissions", ["admittime"]),
-    (transfers, "transfers", ["intime"]),
-    (services, "services", ["transfertime"]),
-    (labevents, "labevents", ["charttime"]),
-    (diagnoses, "diagnoses_icd", []),
-    (prescriptions, "prescriptions", ["starttime"]),
-    (emar, "emar", ["charttime"]),
-]
-
-events = [enrich_and_tag(df, name, times) for df, name, times in tables]
-full_df = pd.concat(events, ignore_index=True).sort_values("event_time")
+full_df = store.timeline(HADM_ID)
 
 # ---------------------------
 # Export
@@ -0,0 +1,176 @@
+"""
+Census and Occupancy
+====================
+
+Per-unit census time series from stay intervals (transfers, icustays).
+
+Every stay becomes two events, +1 at intime and -1 at outtime. Events are
+sorted by (unit, time) and a single cumulative sum gives the census after
+each event; since each unit's events sum to zero, the running sum restarts
+at 0 at every unit boundary. A second cumulative sum over census x elapsed
+time gives the occupied time up to each event, so the time-weighted mean
+census of any bin is a difference of two interpolated areas. Stays are
+never expanded into per-hour (or per-minute) rows: building costs one sort
+of the events and a series at any resolution costs one binary search per
+bin edge. The busiest bin of a summary is searched among the bins holding
+events only, so its cost does not grow with the unit's span.
+
+Means are taken over the time a unit is in use (at least one occupant), not
+over its first-to-last span: a unit seen for a few stays across a decade
+of shifted dates would otherwise report a census near zero. Utilization is
+that mean census over capacity. MIMIC-IV does not record bed counts, so
+without a configured capacity utilization is None.
+"""
+
+import numpy as np
+import pandas as pd
+
+HOUR_NS = 3_600 * 10**9
+DAY_NS = 24 * HOUR_NS
+
+
+def _time_in_hour(times, hour):
+    """Time (ns) from the epoch up to each instant that falls in the given hour of day"""
+    return times // DAY_NS * HOUR_NS + np.clip(times % DAY_NS - hour * HOUR_NS, 0, HOUR_NS)
+
+
+class Occupancy:
+    def __init__(self, units, intime, outtime):
+        units = pd.Series(np.asarray(units, dtype=object))
+        intime = pd.to_datetime(pd.Series(np.asarray(intime)))
+        outtime = pd.to_datetime(pd.Series(np.asarray(outtime)))
+
+        # Stays without a unit or an end, or ending before they start, carry no census
+        valid = (units.notna() & intime.notna() & outtime.notna() & (outtime > intime)).to_numpy()
+        unit_ids, self.units = pd.factorize(units[valid])
+        starts = intime[valid].to_numpy().astype('datetime64[ns]').astype('int64')
+        ends = outtime[valid].to_numpy().astype('datetime64[ns]').astype('int64')
+
+        unit_ids = np.concatenate([unit_ids, unit_ids])
+        times = np.concatenate([starts, ends])
+        deltas = np.concatenate([np.ones(len(starts), dtype='int64'), -np.ones(len(ends), dtype='int64')])
+
+        # Departures sort before arrivals at the same instant
+        order = np.lexsort((deltas, times, unit_ids))
+        self._unit_ids, self._times = unit_ids[order], times[order]
+        self._census = np.cumsum(deltas[order])
+
+        # Occupied time (census x ns) accumulated up to each event
+        elapsed = np.diff(self._times, append=self._times[-1] if len(self._times) else 0)
+        self._area = np.concatenate([[0.0], np.cumsum(self._census[:-1] * elapsed[:-1].astype('float64'))])
+
+        self._bounds = np.searchsorted(self._unit_ids, np.arange(len(self.units) + 1))
+
+    def _unit_slice(self, unit):
+        position = self.units.get_loc(unit)
+        return slice(self._bounds[position], self._bounds[position + 1])
+
+    def span(self, unit):
+        """First arrival and last departure in a unit"""
+        times = self._times[self._unit_slice(unit)]
+        return pd.Timestamp(times[0]), pd.Timestamp(times[-1])
+
+    def census_at(self, unit, times):
+        """Number of occupants of a unit at each of the given instants"""
+        unit_slice = self._unit_slice(unit)
+        unit_times, census = self._times[unit_slice], self._census[unit_slice]
+        times = pd.to_datetime(pd.Series(np.asarray(times))).to_numpy().astype('datetime64[ns]').astype('int64')
+
+        positions = np.searchsorted(unit_times, times, side='right') - 1
+        return np.where(positions >= 0, census[np.maximum(positions, 0)], 0)
+
+    def _area_at(self, unit_slice, times):
+        """Occupied time of a unit from its first event up to each instant"""
+        unit_times, census = self._times[unit_slice], self._census[unit_slice]
+        area = self._area[unit_slice] - self._area[unit_slice.start]
+
+        positions = np.searchsorted(unit_times, times, side='right') - 1
+        clipped = np.maximum(positions, 0)
+        extra = census[clipped] * (times - unit_times[clipped]).astype('float64')
+        return np.where(positions >= 0, area[clipped] + extra, 0.0)
+
+    def series(self, unit, freq='1h', start=None, end=None):
+        """Time-weighted mean census of a unit in each bin of width freq"""
+        first, last = self.span(unit)
+        start = pd.Timestamp(start) if start is not None else first.floor(freq)
+        end = pd.Timestamp(end) if end is not None else last.ceil(freq)
+
+        edges = pd.date_range(start, end, freq=freq)
+        if len(edges) < 2:
+            return pd.Series(dtype='float64')
+        edge_ns = edges.to_numpy().astype('datetime64[ns]').astype('int64')
+
+        area = self._area_at(self._unit_slice(unit), edge_ns)
+        return pd.Series(np.diff(area) / np.diff(edge_ns), index=edges[:-1])
+
+    def _busiest_bin(self, unit_slice, freq):
+        """Start (ns) and time-weighted mean census of the first busiest bin of width freq
+
+        The binned census can only change in a bin containing an event; bins
+        without events repeat the census of the bin after the last event, so
+        only those two bins per event are evaluated rather than every bin of
+        the unit's span.
+        """
+        width = pd.Timedelta(freq).value
+        times = self._times[unit_slice]
+        floors = times // width * width
+        starts = np.unique(np.concatenate([floors, floors + width]))
+        starts = starts[starts < times[-1]]
+
+        area = self._area_at(unit_slice, np.concatenate([starts, starts + width]))
+        means = (area[len(starts):] - area[:len(starts)]) / width
+        busiest = int(np.argmax(means))
+        return starts[busiest], means[busiest]
+
+    def _segments(self, unit_slice):
+        """Start, end and census of the intervals between consecutive events of a unit"""
+        times, census = self._times[unit_slice], self._census[unit_slice]
+        return times[:-1], times[1:], census[:-1]
+
+    def hourly_census(self, unit):
+        """Time-weighted mean census at each hour of day (0-23) while the unit is in use
+
+        Every interval between events is split over the hours of day it
+        overlaps, so the profile costs 24 passes over the unit's events
+        whatever its span. Hours of day in which the unit is never in use
+        report 0.
+        """
+        starts, ends, census = self._segments(self._unit_slice(unit))
+        busy = census > 0
+        occupied, in_use = np.zeros(24), np.zeros(24)
+        for hour in range(24):
+            overlap = (_time_in_hour(ends, hour) - _time_in_hour(starts, hour)).astype('float64')
+            occupied[hour] = census @ overlap
+            in_use[hour] = overlap[busy].sum()
+        return np.divide(occupied, in_use, out=np.zeros(24), where=in_use > 0)
+
+    def summary(self, unit, freq='1h', capacity=None):
+        """Mean and peak census, patient-days, utilization and the busiest bin of a unit
+
+        mean_census is averaged over the time the unit has occupants
+        (in_use_days); utilization is None without a capacity.
+        """
+        unit_slice = self._unit_slice(unit)
+        starts, ends, census = self._segments(unit_slice)
+        in_use = float((ends - starts)[census > 0].sum())
+        occupied = self._area[unit_slice.stop - 1] - self._area[unit_slice.start]
+
+        mean_census = occupied / in_use if in_use else 0.0
+        peak_census = int(self._census[unit_slice].max())
+
+        busiest, busiest_census = self._busiest_bin(unit_slice, freq)
+        return {
+            'mean_census': round(float(mean_census), 4),
+            'peak_census': peak_census,
+            'patient_days': round(float(occupied / DAY_NS), 2),
+            'in_use_days': round(in_use / DAY_NS, 2),
+            'utilization': round(float(mean_census / capacity * 100), 2) if capacity else None,
+            'capacity': capacity,
+            'busiest_period': pd.Timestamp(busiest).isoformat(),
+            'busiest_period_census': round(float(busiest_census), 4)
+        }
+
+    def summaries(self, freq='1h', capacities=None):
+        """summary() of every unit"""
+        capacities = capacities or {}
+        return {unit: self.summary(unit, freq, capacities.get(unit)) for unit in self.units}
@@ -0,0 +1,127 @@
+"""
+Partitioned Processing
+======================
+
+Runs HospitalDataProcessor over several extracts with the same schema (one
+per site, or one per time slice) in parallel processes and reduces their
+results into a single visualization_data.json.
+
+A partition is an extract directory with hosp/ and icu/ subdirectories, or
+an explicit (hosp_dir, icu_dir) pair. Each partition produces partial state
+instead of final numbers (HospitalDataProcessor.partial_state): counts,
+sums and histograms, sketch states for percentiles and distinct counts,
+per-key moments and the accumulators of the streamed sections, plus the
+stay tables the census sections are computed from. Means, rates and
+percentiles are only derived after the states of all partitions are merged,
+so the result equals processing the union of the extracts (up to sketch
+accuracy and floating point summation order).
+
+Partial states can be pickled to a directory on a shared filesystem, so
+partitions can run on different machines and be reduced later with
+reduce_partials(). Every source row must belong to exactly one partition
+and ids (subject_id, hadm_id, stay_id, ...) must be unique across
+partitions, as in extracts of one database. Partials are merged in the
+order given; list time slices oldest first so that transfers continuing
+across slices are chained.
+"""
+
+import os
+import time
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from data_processor import HospitalDataProcessor
+
+PARTIAL_FORMAT = 1
+
+
+def partition_dirs(partition):
+    """(hosp_dir, icu_dir) of a partition given as an extract directory or a pair"""
+    if isinstance(partition, (tuple, list)):
+        return tuple(partition)
+    return os.path.join(partition, 'hosp'), os.path.join(partition, 'icu')
+
+
+def partition_key(partition):
+    """Name of a partition (extract directory name plus a path hash), unique across machines"""
+    hosp_dir, _ = partition_dirs(partition)
+    location = os.path.dirname(os.path.abspath(hosp_dir))
+    digest = hashlib.sha256(os.path.abspath(hosp_dir).encode('utf-8')).hexdigest()[:8]
+    return f"{os.path.basename(location) or 'partition'}-{digest}"
+
+
+def save_partial(partial, path):
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump({'format': PARTIAL_FORMAT, 'partial': partial}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_partial(path):
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    if saved.get('format') != PARTIAL_FORMAT:
+        raise ValueError(f"Unsupported partial state file: {path}")
+    return saved['partial']
+
+
+def compute_partial(partition, cache_dir=None, output_file=None):
+    """Partial state of one partition, or the file it was saved to when output_file is given"""
+    start = time.perf_counter()
+    hosp_dir, icu_dir = partition_dirs(partition)
+    processor = HospitalDataProcessor(hosp_dir, icu_dir, cache_dir=cache_dir)
+    processor.load_data()
+    partial = processor.partial_state()
+    print(f"Partition {os.path.dirname(os.path.abspath(hosp_dir))}: "
+          f"partial state in {time.perf_counter() - start:.2f}s")
+
+    if output_file is not None:
+        return save_partial(partial, output_file)
+    return partial
+
+
+def map_partitions(partitions, workers=1, partial_dir=None, cache_dir='.table_cache'):
+    """Partial state of every partition (file paths with partial_dir), in partition order"""
+    partitions = list(partitions)
+    outputs = [None] * len(partitions)
+    if partial_dir is not None:
+        os.makedirs(partial_dir, exist_ok=True)
+        outputs = [os.path.join(partial_dir, f"{partition_key(partition)}.partial.pkl") for partition in partitions]
+
+    # One table cache per partition: the cache is keyed by table name
+    caches = [os.path.join(cache_dir, partition_key(partition)) if cache_dir else None for partition in partitions]
+
+    if workers > 1 and len(partitions) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(compute_partial, partitions, caches, outputs))
+    return [compute_partial(*job) for job in zip(partitions, caches, outputs)]
+
+
+def reduce_partials(partials, processor):
+    """Merge partial states (or partial state files) in order, with processor's merge rules"""
+    merged = None
+    for partial in partials:
+        if isinstance(partial, str):
+            partial = load_partial(partial)
+        merged = partial if merged is None else processor.merge_partial(merged, partial)
+    if merged is None:
+        raise ValueError("No partial states to reduce")
+    return merged
+
+
+def process_partitions(partitions, output_file='visualization_data.json', workers=1, partial_dir=None,
+                       cache_dir='.table_cache', **export_options):
+    """Process every partition in parallel and export the reduced visualization data
+
+    Code labels (ICD, lab items, ...) are read from the first partition's
+    dictionaries. Returns the reducing processor.
+    """
+    partitions = list(partitions)
+    if not partitions:
+        raise ValueError("No partitions to process")
+    partials = map_partitions(partitions, workers, partial_dir, cache_dir)
+
+    processor = HospitalDataProcessor(*partition_dirs(partitions[0]), cache_dir=None)
+    processor.export_for_visualization(output_file, partial=reduce_partials(partials, processor), **export_options)
+    return processor
@@ -0,0 +1,295 @@
+"""
+Patient Timeline Extraction
+===========================
+
+Reusable version of the per-admission timeline built by
+``mimic-iv-clinical-database-demo-2.2/Untitled-1.py``.
+
+Instead of loading every table in full and scanning it for one hadm_id,
+the EventStore is built once: each timeline table is sorted by hadm_id and
+written as an uncompressed Arrow IPC file, next to a row-offset index
+(sorted hadm_ids with the first row and row count of each). A query is a
+binary search in the index plus a zero-copy slice of the memory-mapped
+file, so fetching one admission only touches that admission's rows.
+
+The store is rebuilt per table only when its source file changes.
+
+Dictionary labels (d_labitems, d_icd_diagnoses) are not merged into the
+store: they are looked up through the cached DictionaryLookup tables and
+attached only to the rows a query returns. ICD titles are matched on
+(icd_version, icd_code).
+
+Cohorts of admissions are extracted in one pass per table: the cohort's
+row ranges are gathered from each table with a single vectorized take
+(tables are processed concurrently) and written either as one CSV per
+admission or as a single file sorted by hadm_id.
+
+Usage:
+    python patient_timeline.py --hadm-id 20093566 --hosp-dir hosp
+    python patient_timeline.py --hadm-ids-file cohort.txt --output-dir timelines
+    python patient_timeline.py --cohort icu --icu-dir icu --layout combined
+"""
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from table_cache import TableCache
+from dictionaries import DictionaryLookup
+
+# Timeline tables: datetime columns to parse, and the column used as event time
+TIMELINE_TABLES = {
+    'admissions': (['admittime', 'dischtime'], 'admittime'),
+    'transfers': (['intime', 'outtime'], 'intime'),
+    'services': (['transfertime'], 'transfertime'),
+    'labevents': (['charttime'], 'charttime'),
+    'diagnoses_icd': ([], None),
+    'prescriptions': (['starttime', 'stoptime'], 'starttime'),
+    'emar': (['charttime'], 'charttime')
+}
+
+# Dictionary whose labels are attached to each table's emitted rows
+ENRICHMENTS = {
+    'labevents': 'd_labitems',
+    'diagnoses_icd': 'd_icd_diagnoses'
+}
+
+# Bumped whenever the stored layout changes, so older stores are rebuilt
+STORE_FORMAT = 2
+
+
+def resolve_source(hosp_dir, name):
+    """Find name.csv.gz or name.csv in hosp_dir"""
+    for ext in ('.csv.gz', '.csv'):
+        path = os.path.join(hosp_dir, name + ext)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"File not found: {name}.csv or {name}.csv.gz")
+
+
+class EventStore:
+    def __init__(self, hosp_dir='hosp', store_dir='.event_store'):
+        self.hosp_dir = hosp_dir
+        self.store_dir = store_dir
+        self._tables = {}
+        self.dictionaries = DictionaryLookup(
+            hosp_dir, cache=TableCache(os.path.join(store_dir, 'dictionaries')))
+
+    def _paths(self, table):
+        base = os.path.join(self.store_dir, table)
+        return base + '.arrow', base + '.index.npz', base + '.meta.json'
+
+    def _signature(self, table):
+        path = resolve_source(self.hosp_dir, table)
+        stat = os.stat(path)
+        return {'format': STORE_FORMAT, table: [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]}
+
+    def _read_source(self, table):
+        parse_dates, _ = TIMELINE_TABLES[table]
+        return pd.read_csv(resolve_source(self.hosp_dir, table), parse_dates=parse_dates, low_memory=False)
+
+    def build(self, rebuild=False, workers=1):
+        """Sort each timeline table by hadm_id and write it with its row-offset index
+
+        With workers > 1 the tables are built concurrently in a process pool.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        stale = []
+        for table in TIMELINE_TABLES:
+            _, index_path, meta_path = self._paths(table)
+            if not rebuild and os.path.exists(meta_path) and os.path.exists(index_path):
+                with open(meta_path) as f:
+                    if json.load(f) == self._signature(table):
+                        continue
+            stale.append(table)
+
+        if workers > 1 and len(stale) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_build_table_job, [self.hosp_dir] * len(stale),
+                                        [self.store_dir] * len(stale), stale))
+        else:
+            results = [self._build_table(table) for table in stale]
+
+        for table, rows, admissions in results:
+            self._tables.pop(table, None)
+            print(f"Indexed {table}: {rows} rows, {admissions} admissions")
+
+        return self
+
+    def _build_table(self, table):
+        data_path, index_path, meta_path = self._paths(table)
+        signature = self._signature(table)
+
+        df = self._read_source(table)
+        df = df[df['hadm_id'].notna()]
+        df = df.assign(hadm_id=df['hadm_id'].astype('int64'))
+        df = df.sort_values('hadm_id', kind='stable').reset_index(drop=True)
+
+        # Row-offset index: first row and row count of every admission
+        hadm_ids, starts, counts = np.unique(df['hadm_id'].to_numpy(),
+                                             return_index=True, return_counts=True)
+
+        arrow_table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(data_path, 'wb') as sink, pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        np.savez(index_path, hadm_ids=hadm_ids, starts=starts, counts=counts)
+
+        # Metadata is written last so a partial build never looks valid
+        with open(meta_path, 'w') as f:
+            json.dump(signature, f)
+        return table, len(df), len(hadm_ids)
+
+    def _open(self, table):
+        """Memory-mapped table and its index, opened once per store"""
+        if table not in self._tables:
+            data_path, index_path, _ = self._paths(table)
+            arrow_table = pa.ipc.open_file(pa.memory_map(data_path)).read_all()
+            index = np.load(index_path)
+            self._tables[table] = (arrow_table, index['hadm_ids'], index['starts'], index['counts'])
+        return self._tables[table]
+
+    def events(self, table, hadm_id):
+        """All rows of one table for one admission"""
+        arrow_table, hadm_ids, starts, counts = self._open(table)
+        position = np.searchsorted(hadm_ids, hadm_id)
+        if position == len(hadm_ids) or hadm_ids[position] != hadm_id:
+            return arrow_table.slice(0, 0).to_pandas()
+        return arrow_table.slice(int(starts[position]), int(counts[position])).to_pandas()
+
+    def _tag(self, df, table):
+        if table in ENRICHMENTS:
+            df = self.dictionaries.enrich(df, ENRICHMENTS[table])
+        time_column = TIMELINE_TABLES[table][1]
+        df['source_table'] = table
+        df['event_time'] = df[time_column] if time_column else pd.NaT
+        return df
+
+    def timeline(self, hadm_id):
+        """Every event of one admission across the timeline tables, in time order"""
+        events = []
+        for table in TIMELINE_TABLES:
+            df = self.events(table, hadm_id)
+            if not df.empty:
+                events.append(self._tag(df, table))
+
+        if not events:
+            return pd.DataFrame(columns=['event_time', 'source_table'])
+        return pd.concat(events, ignore_index=True).sort_values('event_time')
+
+    def cohort_events(self, table, hadm_ids):
+        """Rows of one table for a whole cohort, gathered with a single take"""
+        arrow_table, index_ids, starts, counts = self._open(table)
+        positions = np.searchsorted(index_ids, hadm_ids)
+        positions = positions[positions < len(index_ids)]
+        positions = np.unique(positions[np.isin(index_ids[positions], hadm_ids)])
+
+        # Expand every admission's (start, count) range into row numbers
+        starts, counts = starts[positions], counts[positions]
+        offsets = np.repeat(np.cumsum(counts) - counts, counts)
+        rows = np.repeat(starts, counts) + np.arange(counts.sum()) - offsets
+
+        return self._tag(arrow_table.take(pa.array(rows, type=pa.int64())).to_pandas(), table)
+
+    def batch_timelines(self, hadm_ids, output_dir='timelines', layout='per_admission', workers=4):
+        """Write timelines for many admissions, reading each table once
+
+        layout='per_admission' writes timeline_<hadm_id>.csv files,
+        layout='combined' writes a single timelines.csv sorted by
+        (hadm_id, event_time). Tables are gathered concurrently.
+        """
+        hadm_ids = np.unique(np.asarray(hadm_ids, dtype='int64'))
+        os.makedirs(output_dir, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            events = list(pool.map(lambda table: self.cohort_events(table, hadm_ids), TIMELINE_TABLES))
+
+        events = [df for df in events if not df.empty]
+        if not events:
+            print("No events found for the requested admissions")
+            return []
+
+        full_df = pd.concat(events, ignore_index=True)
+        full_df = full_df.sort_values(['hadm_id', 'event_time'], kind='stable')
+
+        if layout == 'combined':
+            paths = [os.path.join(output_dir, 'timelines.csv')]
+            full_df.to_csv(paths[0], index=False)
+        elif layout == 'per_admission':
+            paths = []
+            for hadm_id, timeline in full_df.groupby('hadm_id', sort=False):
+                path = os.path.join(output_dir, f"timeline_{hadm_id}.csv")
+                timeline.to_csv(path, index=False)
+                paths.append(path)
+        else:
+            raise ValueError(f"Unknown layout: {layout}")
+
+        print(f"✅ Saved {full_df['hadm_id'].nunique()} admission timelines to {output_dir}/")
+        return paths
+
+
+def _build_table_job(hosp_dir, store_dir, table):
+    """Process-pool worker for EventStore.build"""
+    return EventStore(hosp_dir, store_dir)._build_table(table)
+
+
+def read_hadm_ids(path):
+    """hadm_ids from a text file (one per line) or a CSV with a hadm_id column"""
+    if path.endswith(('.csv', '.csv.gz')):
+        return pd.read_csv(path, usecols=['hadm_id'])['hadm_id'].dropna().astype('int64').unique()
+    with open(path) as f:
+        return np.array([int(line) for line in f if line.strip()], dtype='int64')
+
+
+def icu_cohort(icu_dir='icu'):
+    """hadm_ids of all admissions with an ICU stay"""
+    for ext in ('.csv.gz', '.csv'):
+        path = os.path.join(icu_dir, 'icustays' + ext)
+        if os.path.exists(path):
+            return pd.read_csv(path, usecols=['hadm_id'])['hadm_id'].unique()
+    raise FileNotFoundError(f"icustays not found in {icu_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract admission event timelines")
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument('--hadm-id', type=int, nargs='+', help='Admission(s) to extract')
+    selection.add_argument('--hadm-ids-file', help='File of hadm_ids (one per line, or CSV with hadm_id)')
+    selection.add_argument('--cohort', choices=['icu'], help='Predefined cohort: icu = all ICU admissions')
+    parser.add_argument('--hosp-dir', default='hosp', help='Directory with the MIMIC-IV hosp tables')
+    parser.add_argument('--icu-dir', default='icu', help='Directory with the MIMIC-IV icu tables')
+    parser.add_argument('--store-dir', default='.event_store', help='Where the indexed event store is kept')
+    parser.add_argument('--output', default='diagnostic_raw_events.csv', help='Output CSV for a single admission')
+    parser.add_argument('--output-dir', default='timelines', help='Output directory for batch extraction')
+    parser.add_argument('--layout', choices=['per_admission', 'combined'], default='per_admission',
+                        help='One CSV per admission, or one CSV sorted by hadm_id')
+    parser.add_argument('--workers', type=int, default=4, help='Parallel workers across tables')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the event store from scratch')
+    args = parser.parse_args()
+
+    store = EventStore(args.hosp_dir, args.store_dir).build(rebuild=args.rebuild, workers=args.workers)
+
+    if args.hadm_id and len(args.hadm_id) == 1:
+        full_df = store.timeline(args.hadm_id[0])
+        full_df.to_csv(args.output, index=False)
+        print(f"✅ Saved to {args.output}")
+        print(full_df[["event_time", "source_table"]].head(10))
+        return
+
+    if args.hadm_id:
+        hadm_ids = args.hadm_id
+    elif args.hadm_ids_file:
+        hadm_ids = read_hadm_ids(args.hadm_ids_file)
+    else:
+        hadm_ids = icu_cohort(args.icu_dir)
+
+    store.batch_timelines(hadm_ids, args.output_dir, layout=args.layout, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Stage Pipeline
+==============
+
+Runs HospitalDataProcessor's process_* stages as a declared DAG.
+
+Every stage in ``HospitalDataProcessor.STAGES`` names its method, the
+source tables (and dictionaries) it reads and the stages it depends on, and
+writes ``processed_data[<stage name>]``. Asking for a set of sections runs
+only those stages and their upstream stages; stages whose dependencies are
+done run concurrently in a thread pool.
+
+With a cache directory, each stage's output is memoized on disk under a key
+hashing its input files (path, size, mtime), the processing code and the
+keys of its upstream stages, so unchanged sections are reused across runs
+and only the tables of stages that actually run are loaded.
+
+Stages run on the processor's backend (query_backend.py): stages the
+backend handles read their source files directly, so their tables are not
+loaded into pandas at all.
+"""
+
+import os
+import sys
+import time
+import pickle
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StagePipeline:
+    def __init__(self, processor, cache_dir=None):
+        self.processor = processor
+        self.stages = processor.STAGES
+        self.cache_dir = cache_dir
+        self._code_hash = None
+
+    def stages_for(self, sections=None):
+        """Requested stages plus everything upstream of them, in dependency order"""
+        requested = list(self.stages) if sections is None else list(sections)
+        unknown = [name for name in requested if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Unknown section(s): {', '.join(unknown)}")
+
+        ordered = []
+
+        def visit(name, path=()):
+            if name in path:
+                raise ValueError(f"Stage cycle: {' -> '.join(path + (name,))}")
+            if name in ordered:
+                return
+            for upstream in self.stages[name][2]:
+                visit(upstream, path + (name,))
+            ordered.append(name)
+
+        for name in requested:
+            visit(name)
+        return ordered
+
+    def levels(self, stages):
+        """Group stages into waves whose members only depend on earlier waves"""
+        done, waves = set(), []
+        remaining = list(stages)
+        while remaining:
+            wave = [name for name in remaining if set(self.stages[name][2]) <= done]
+            waves.append(wave)
+            done.update(wave)
+            remaining = [name for name in remaining if name not in done]
+        return waves
+
+    def _code_signature(self):
+        """Hash of the processor's source modules, so code changes invalidate results"""
+        if self._code_hash is None:
+            package_dir = os.path.dirname(os.path.abspath(sys.modules[type(self.processor).__module__].__file__))
+            digest = hashlib.sha256()
+            for module in sorted(sys.modules.values(), key=lambda module: getattr(module, '__name__', '')):
+                path = getattr(module, '__file__', None)
+                if path and path.endswith('.py') and os.path.dirname(os.path.abspath(path)) == package_dir:
+                    with open(path, 'rb') as f:
+                        digest.update(f.read())
+            self._code_hash = digest.hexdigest()
+        return self._code_hash
+
+    def stage_key(self, name, upstream_keys):
+        """Memo key of a stage: its inputs' signatures, the code and upstream keys"""
+        _, tables, upstream = self.stages[name]
+        inputs = {}
+        for table in tables:
+            path = self.processor._table_source(table)
+            if path is not None:
+                stat = os.stat(path)
+                inputs[table] = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+        signature = {
+            'stage': name,
+            'backend': self.processor.backend.name,
+            'code': self._code_signature(),
+            'inputs': inputs,
+            'upstream': {stage: upstream_keys[stage] for stage in upstream}
+        }
+        return hashlib.sha256(json.dumps(signature, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _memo_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.pkl")
+
+    def _load_memo(self, name, key):
+        if self.cache_dir is None or not os.path.exists(self._memo_path(name)):
+            return None
+        try:
+            with open(self._memo_path(name), 'rb') as f:
+                memo = pickle.load(f)
+            return memo['output'] if memo['key'] == key else None
+        except Exception as e:
+            print(f"Ignoring unreadable stage result for {name}: {e}")
+            return None
+
+    def _store_memo(self, name, key, output):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._memo_path(name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'key': key, 'output': output}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def _run_stage(self, name):
+        start = time.perf_counter()
+        self.processor.backend.run(name)
+        return time.perf_counter() - start
+
+    def run(self, sections=None, workers=1, force=False):
+        """Bring processed_data up to date for the requested sections (default: all)"""
+        stages = self.stages_for(sections)
+        waves = self.levels(stages)
+
+        keys, pending = {}, []
+        for wave in waves:
+            for name in wave:
+                keys[name] = self.stage_key(name, keys)
+                output = None if force else self._load_memo(name, keys[name])
+                if output is not None:
+                    self.processor.processed_data[name] = output
+                    print(f"Stage {name}: cached")
+                else:
+                    pending.append(name)
+
+        if not pending:
+            return self.processor.processed_data
+
+        # Load only the tables the stages that will run on pandas actually read
+        needed = sorted({table for name in pending if not self.processor.backend.handles(name)
+                         for table in self.stages[name][1]})
+        missing = [table for table in needed if table not in self.processor.data]
+        if missing:
+            self.processor.load_data(workers=workers, tables=missing)
+
+        for wave in waves:
+            names = [name for name in wave if name in pending]
+            if workers > 1 and len(names) > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    timings = list(pool.map(self._run_stage, names))
+            else:
+                timings = [self._run_stage(name) for name in names]
+
+            for name, elapsed in zip(names, timings):
+                print(f"Stage {name}: ran ({elapsed:.2f}s)")
+                if self.cache_dir is not None and name in self.processor.processed_data:
+                    self._store_memo(name, keys[name], self.processor.processed_data[name])
+
+        return self.processor.processed_data
@@ -0,0 +1,391 @@
+"""
+Query Backends
+==============
+
+Execution engines for HospitalDataProcessor's stages.
+
+PandasBackend is the reference: every stage runs its process_* method over
+the frames loaded into memory (or streamed in chunks). DuckDBBackend
+expresses the aggregation stages as SQL over views of the source files and
+runs them in DuckDB, a vectorized, multithreaded engine that scans CSV and
+Parquet files in parallel and spills aggregates, sorts and window
+partitions to disk past ``memory_limit``. Tables are never loaded into
+pandas, so e.g. the full MIMIC-IV labevents and chartevents can be
+processed on a 32 GB machine.
+
+Each view projects its table to the TABLE_SCHEMAS columns with the SQL type
+of the schema dtype and the same missing-value strings as pandas.read_csv,
+so both engines see the same values. Queries return only small aggregates
+(per-group counts and moments, distinct (key, value) counts for the quantile
+sketches, distinct ids for HyperLogLog) that are finished by the same code
+as the pandas path, so sections match across backends up to floating point
+summation order; diff_results() compares two runs. Stages without a query
+(lab_analytics, diagnoses, fluid_balance, room analytics, ...) keep running
+on pandas.
+
+duckdb is optional; only DuckDBBackend needs it.
+"""
+
+import json
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from derived import AGE_BINS, AGE_LABELS
+from json_export import dumps
+from lab_analytics import DAY_NAMES
+from sketches import QuantileSketch, GroupedQuantileSketch, HyperLogLog
+from streaming_stats import RunningMoments
+from table_schemas import schema_read_options
+
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+# Schema dtype -> SQL type of the view column
+SQL_TYPES = {
+    'int8': 'TINYINT', 'Int8': 'TINYINT',
+    'int16': 'SMALLINT', 'Int16': 'SMALLINT',
+    'int32': 'INTEGER', 'Int32': 'INTEGER',
+    'int64': 'BIGINT', 'Int64': 'BIGINT',
+    'float32': 'FLOAT', 'float64': 'DOUBLE',
+    'category': 'VARCHAR', 'str': 'VARCHAR'
+}
+
+# Strings pandas.read_csv reads as missing
+CSV_NULLS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _counts(frame, column):
+    """{value: count} of a grouped frame, largest first"""
+    counts = frame.set_index(column)['n'].sort_values(ascending=False, kind='stable')
+    return {key: int(count) for key, count in counts.items()}
+
+
+class PandasBackend:
+    """Reference engine: every stage runs its process_* method"""
+
+    name = 'pandas'
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def handles(self, stage):
+        """Whether the stage runs in the engine rather than over loaded frames"""
+        return False
+
+    def run(self, stage):
+        getattr(self.processor, self.processor.STAGES[stage][0])()
+
+
+class DuckDBBackend(PandasBackend):
+    """Aggregation stages as SQL over the source files, run by DuckDB"""
+
+    name = 'duckdb'
+
+    # Stage -> method writing its section
+    STAGE_QUERIES = {
+        'demographics': '_demographics',
+        'admissions': '_admissions',
+        'icu': '_icu',
+        'transfers': '_transfers',
+        'lab_events': '_lab_events',
+        'vital_signs': '_vital_signs'
+    }
+
+    def __init__(self, processor, threads=None, memory_limit=None, temp_directory=None):
+        if not DUCKDB_AVAILABLE:
+            raise ImportError("The duckdb backend requires the 'duckdb' package")
+        super().__init__(processor)
+
+        # memory_limit (e.g. '24GB') is where DuckDB starts spilling to temp_directory
+        settings = {'threads': threads, 'memory_limit': memory_limit, 'temp_directory': temp_directory}
+        self.connection = duckdb.connect(config={key: value for key, value in settings.items() if value is not None})
+        self.columns = {}
+        self._lock = threading.Lock()
+
+    def handles(self, stage):
+        return stage in self.STAGE_QUERIES
+
+    def run(self, stage):
+        if not self.handles(stage):
+            return super().run(stage)
+        section = getattr(self, self.STAGE_QUERIES[stage])()
+        if section is not None:
+            self.processor.processed_data[stage] = section
+
+    # Views and queries
+
+    def _view(self, table):
+        """View over a table's source file, or None when the table has no source"""
+        with self._lock:
+            if table in self.columns:
+                return _quote(table) if self.columns[table] is not None else None
+
+            filepath = self.processor._table_source(table)
+            if filepath is None:
+                self.columns[table] = None
+                return None
+
+            available = list(self.processor._table_columns(filepath))
+            options = schema_read_options(table, available)
+            types = {column: SQL_TYPES.get(str(dtype)) for column, dtype in options.get('dtype', {}).items()}
+            types.update({column: 'TIMESTAMP' for column in options.get('parse_dates', [])})
+            columns = options.get('usecols') or available
+
+            select = ', '.join(f"CAST({_quote(column)} AS {types[column]}) AS {_quote(column)}"
+                               if types.get(column) else _quote(column) for column in columns)
+            if filepath.endswith('.parquet'):
+                source = f"read_parquet({_literal(filepath)})"
+            else:
+                nulls = ', '.join(_literal(value) for value in CSV_NULLS)
+                source = f"read_csv({_literal(filepath)}, header = true, all_varchar = true, nullstr = [{nulls}])"
+
+            self.connection.execute(f"CREATE OR REPLACE VIEW {_quote(table)} AS SELECT {select} FROM {source}")
+            self.columns[table] = columns
+            return _quote(table)
+
+    def _query(self, sql):
+        """Run a query on its own cursor (stages may run concurrently) and fetch the result"""
+        cursor = self.connection.cursor()
+        try:
+            return cursor.execute(sql).df()
+        finally:
+            cursor.close()
+
+    def _grouped(self, view, keys, measures=None):
+        """Aggregates per value of each key and overall, in one scan of the view
+
+        keys maps a name to a column or SQL expression, measures a name to an
+        aggregate expression; the row count is always included as n. Returns
+        the overall row and {key name: frame of (key value, n, measures...)}.
+        NULL key values are left out, as in Series.value_counts().
+        """
+        measures = dict({'n': 'count(*)'}, **(measures or {}))
+        expressions = list(keys.values())
+        select = [f"{expression} AS key_{position}, GROUPING({expression}) AS grouped_{position}"
+                  for position, expression in enumerate(expressions)]
+        select += [f"{expression} AS {_quote(name)}" for name, expression in measures.items()]
+        sets = ', '.join(f"({expression})" for expression in expressions)
+        frame = self._query(f"SELECT {', '.join(select)} FROM {view} GROUP BY GROUPING SETS ({sets}, ())")
+
+        flags = [f"grouped_{position}" for position in range(len(expressions))]
+        overall = frame[(frame[flags] == 1).all(axis=1)].iloc[0]
+        groups = {}
+        for position, name in enumerate(keys):
+            rows = frame[(frame[f"grouped_{position}"] == 0) & frame[f"key_{position}"].notna()]
+            groups[name] = rows[[f"key_{position}"] + list(measures)].rename(columns={f"key_{position}": name})
+        return overall, groups
+
+    def _distinct_count(self, view, column):
+        patients = HyperLogLog()
+        patients.update(self._query(f"SELECT DISTINCT {_quote(column)} AS value FROM {view}")['value'])
+        return patients
+
+    def _value_counts(self, view, value, key=None):
+        """Count of every distinct (key, value) pair with a value, to feed the quantile sketches"""
+        columns = f"{_quote(key)} AS key, {value} AS value" if key else f"{value} AS value"
+        return self._query(f"SELECT *, count(*) AS n FROM (SELECT {columns} FROM {view}) "
+                           f"WHERE isfinite(value) GROUP BY ALL")
+
+    # Stages
+
+    def _demographics(self):
+        patients = self._view('patients')
+        if patients is None:
+            return None
+        overall, groups = self._grouped(patients, {'gender': 'gender', 'anchor_age': 'anchor_age'},
+                                        {'deaths': 'count(dod)'})
+
+        ages = groups['anchor_age']
+        age_groups = pd.cut(ages['anchor_age'].astype('float64'), bins=AGE_BINS, labels=AGE_LABELS, right=False)
+        age_distribution = ages['n'].groupby(age_groups, observed=False).sum().sort_values(ascending=False)
+
+        return {
+            'gender_distribution': _counts(groups['gender'], 'gender'),
+            'age_distribution': {label: int(count) for label, count in age_distribution.items()},
+            'total_patients': int(overall['n']),
+            'mortality_count': int(overall['deaths'])
+        }
+
+    def _admissions(self):
+        admissions = self._view('admissions')
+        if admissions is None:
+            return None
+        stay_seconds = 'epoch(dischtime) - epoch(admittime)'
+        overall, groups = self._grouped(
+            admissions,
+            {'admission_type': 'admission_type', 'admission_location': 'admission_location',
+             'discharge_location': 'discharge_location', 'month': 'month(admittime)'},
+            {'deaths': 'CAST(sum(hospital_expire_flag) AS BIGINT)', 'los': f"avg(floor(({stay_seconds}) / 86400))"})
+
+        stay_days = self._value_counts(admissions, f"CAST(({stay_seconds}) / 86400 AS FLOAT)")
+        los_days = QuantileSketch()
+        los_days.update(stay_days['value'].to_numpy(dtype='float64'), stay_days['n'].to_numpy())
+
+        months = groups['month'].sort_values('month')
+        total = int(overall['n'])
+        return {
+            'total_admissions': total,
+            'admission_types': _counts(groups['admission_type'], 'admission_type'),
+            'admission_locations': _counts(groups['admission_location'], 'admission_location'),
+            'discharge_locations': _counts(groups['discharge_location'], 'discharge_location'),
+            'avg_length_of_stay': overall['los'],
+            'los_percentiles': los_days.summary(self.processor.LOS_PERCENTILES),
+            'unique_patients': self._distinct_count(admissions, 'subject_id').count(),
+            'mortality_rate': (overall['deaths'] / total) * 100 if total else np.nan,
+            'seasonal_patterns': {MONTHS[int(month) - 1]: int(count)
+                                  for month, count in zip(months['month'], months['n'])}
+        }
+
+    def _icu(self):
+        icustays = self._view('icustays')
+        if icustays is None:
+            return None
+        overall, groups = self._grouped(icustays, {'first_careunit': 'first_careunit'}, {'los': 'avg(los)'})
+        units = groups['first_careunit']
+
+        stays = self._value_counts(icustays, 'los', key='first_careunit')
+        values, counts = stays['value'].to_numpy(dtype='float64'), stays['n'].to_numpy()
+        los = QuantileSketch()
+        los.update(values, counts)
+        with_unit = stays['key'].notna().to_numpy()
+        los_by_unit = GroupedQuantileSketch()
+        los_by_unit.update(stays['key'].astype(object).to_numpy()[with_unit], values[with_unit], counts[with_unit])
+
+        return {
+            'total_icu_stays': int(overall['n']),
+            'care_units': _counts(units, 'first_careunit'),
+            'avg_icu_los': overall['los'],
+            'los_by_unit': dict(zip(units['first_careunit'], units['los'])),
+            'los_percentiles': los.summary(self.processor.LOS_PERCENTILES),
+            'los_percentiles_by_unit': los_by_unit.summary(self.processor.LOS_PERCENTILES),
+            'unique_patients': self._distinct_count(icustays, 'subject_id').count()
+        }
+
+    def _transfers(self):
+        transfers = self._view('transfers')
+        if transfers is None:
+            return None
+        overall, groups = self._grouped(transfers, {'careunit': 'careunit'})
+
+        # Consecutive transfers of an admission, in HospitalDataProcessor.TRANSFER_ORDER
+        edges = self._query(f"""
+            SELECT from_unit, to_unit, count(*) AS n FROM (
+                SELECT careunit AS from_unit,
+                       lead(careunit) OVER (PARTITION BY hadm_id
+                                            ORDER BY intime ASC NULLS LAST, transfer_id ASC NULLS LAST) AS to_unit
+                FROM {transfers}
+                WHERE hadm_id IS NOT NULL)
+            WHERE from_unit IS NOT NULL AND to_unit IS NOT NULL
+            GROUP BY ALL""")
+        transfer_flow = defaultdict(dict)
+        for from_unit, to_unit, count in edges.itertuples(index=False):
+            transfer_flow[from_unit][to_unit] = int(count)
+
+        return {
+            'total_transfers': int(overall['n']),
+            'care_unit_volumes': _counts(groups['careunit'], 'careunit'),
+            'transfer_flow': dict(transfer_flow)
+        }
+
+    def _lab_events(self):
+        labevents = self._view('labevents')
+        if labevents is None:
+            return None
+        keys = {'hour': 'hour(charttime)', 'day_of_week': 'isodow(charttime) - 1'}
+        if 'itemid' in self.columns['labevents']:
+            keys['itemid'] = 'itemid'
+        overall, groups = self._grouped(labevents, keys)
+
+        hours = groups['hour'].sort_values('hour')
+        days = groups['day_of_week']
+        common_tests = {}
+        if 'itemid' in groups:
+            tests = groups['itemid'].sort_values('itemid').sort_values('n', ascending=False, kind='stable').head(10)
+            common_tests = {int(item): int(count) for item, count in zip(tests['itemid'], tests['n'])}
+
+        return {
+            'total_lab_events': int(overall['n']),
+            'hourly_frequency': {int(hour): int(count) for hour, count in zip(hours['hour'], hours['n'])},
+            'daily_frequency': {DAY_NAMES[int(day)]: int(count)
+                                for day, count in zip(days['day_of_week'], days['n'])},
+            'common_tests': common_tests
+        }
+
+    def _vital_signs(self):
+        chartevents = self._view('chartevents')
+        if chartevents is None:
+            return None
+        moments = RunningMoments()
+        if 'valuenum' in self.columns['chartevents']:
+            item_ids = ', '.join(str(int(item_id)) for item_ids in self.processor.VITAL_SIGN_ITEMS.values()
+                                 for item_id in item_ids)
+            items = self._query(f"""
+                SELECT itemid, count(valuenum) AS count, avg(valuenum) AS mean,
+                       var_pop(valuenum) * count(valuenum) AS m2
+                FROM {chartevents}
+                WHERE itemid IN ({item_ids}) AND valuenum IS NOT NULL
+                GROUP BY itemid""")
+            moments = RunningMoments.from_dict({int(row.itemid): [float(row.count), row.mean, row.m2]
+                                                for row in items.itertuples(index=False)})
+        return self.processor._summarize_vitals(moments)
+
+
+BACKENDS = {
+    'pandas': PandasBackend,
+    'duckdb': DuckDBBackend
+}
+
+
+def create_backend(name, processor, **options):
+    """Backend instance by name ('pandas' or 'duckdb')"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name} (choose from {', '.join(BACKENDS)})")
+    return BACKENDS[name](processor, **options)
+
+
+def _differences(expected, actual, rtol, path):
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        differences = []
+        for key in list(expected) + [key for key in actual if key not in expected]:
+            child = f"{path}.{key}" if path else str(key)
+            if key not in actual or key not in expected:
+                differences.append(f"{child}: only in {'expected' if key in expected else 'actual'}")
+            else:
+                differences += _differences(expected[key], actual[key], rtol, child)
+        return differences
+    if isinstance(expected, list) and isinstance(actual, list) and len(expected) == len(actual):
+        return [difference for position, (left, right) in enumerate(zip(expected, actual))
+                for difference in _differences(left, right, rtol, f"{path}[{position}]")]
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        if math.isclose(expected, actual, rel_tol=rtol, abs_tol=1e-9):
+            return []
+    elif expected == actual:
+        return []
+    return [f"{path}: {expected!r} != {actual!r}"]
+
+
+def diff_results(expected, actual, rtol=1e-6):
+    """Paths where two processed_data trees differ, as exported to JSON
+
+    Numbers are compared with relative tolerance rtol; key order is ignored.
+    """
+    return _differences(json.loads(dumps(expected, compact=True)), json.loads(dumps(actual, compact=True)),
+                        rtol, '')
@@ -11,6 +11,23 @@ Usage:
 
 Options:
     --process-data    Process CSV data and generate visualization_data.json
+    --rebuild-cache   Ignore the columnar table cache and re-parse every CSV
+    --workers N       Load tables and run independent stages with N workers
+    --sections NAME.. Process only these sections (and the stages they depend on)
+    --stage-cache     Reuse stage results whose inputs are unchanged (.stage_cache/)
+    --incremental     Fold only new rows into saved aggregates (incremental_state.json)
+    --compact         Write visualization_data.json without indentation
+    --compress FORMAT Compress visualization_data.json with gzip or brotli
+    --benchmark-export Compare export serializer speed and output size
+    --sharded         Write one file per section plus a manifest (visualization_data/)
+    --stay-index      Also write the "who was where" stay index (stay_index.json)
+    --backend NAME    Run stages on pandas (default) or duckdb (out-of-core SQL)
+    --memory-limit M  DuckDB memory limit before spilling to disk, e.g. 24GB
+    --verify-backend  Re-run the backend's stages on pandas and report differences
+    --partitions DIR.. Process several extracts (each with hosp/ and icu/) in parallel and merge them
+    --partial-dir DIR Keep each partition's partial state in DIR (e.g. on a shared filesystem)
+    --map-only        With --partitions, only write the partial states to --partial-dir
+    --reduce FILE..   Merge partial state files into visualization_data.json
     --open-basic      Open basic hospital visualizations
     --open-advanced   Open advanced dashboard
     --generate-sample Generate sample data for testing
@@ -19,6 +36,9 @@ Options:
 Requirements:
     - Python 3.6+
     - pandas, numpy, matplotlib, seaborn (for data processing)
+    - pyarrow (optional, enables the columnar table cache)
+    - orjson, brotli (optional, faster export and brotli compression)
+    - duckdb (optional, enables --backend duckdb)
     - Modern web browser (for visualizations)
 """
 
@@ -48,21 +68,44 @@ def check_dependencies():
     print("✅ All required packages are installed")
     return True
 
-def process_hospital_data():
+def process_hospital_data(rebuild_cache=False, workers=1, export_options=None, benchmark_export=False,
+                          stay_index=None, backend='pandas', backend_options=None, verify_backend=False):
     """Process hospital data using the data processor."""
     print("🏥 Processing hospital data...")
     
     try:
         from data_processor import HospitalDataProcessor
         
-        processor = HospitalDataProcessor()
-        processor.load_data()
-        visualization_data = processor.export_for_visualization()
+        export_options = dict(export_options or {})
+        processor = HospitalDataProcessor(rebuild_cache=rebuild_cache, backend=backend,
+                                          backend_options=backend_options)
+        if export_options.get('incremental_state'):
+            processor.load_data(workers=workers)
+        # Otherwise the stage pipeline loads only the tables of stages that run
+        visualization_data = processor.export_for_visualization(workers=workers, **export_options)
         processor.generate_static_charts()
+        if stay_index:
+            processor.export_stay_index(stay_index, compression=export_options.get('compression'))
+        
+        if verify_backend and backend != 'pandas':
+            print(f"🔍 Checking {backend} results against the pandas reference...")
+            differences = processor.verify_backend()
+            for difference in differences:
+                print(f"   ≠ {difference}")
+            if differences:
+                print(f"❌ {len(differences)} value(s) differ between backends")
+                return False
+            print("✅ Backends agree")
+        
+        if benchmark_export:
+            from json_export import benchmark
+            print("⏱️  Export serializer benchmark:")
+            benchmark(visualization_data)
         
         print("✅ Data processing completed successfully!")
         print("📊 Generated files:")
-        print("   - visualization_data.json")
+        for exported_file in processor.exported_files:
+            print(f"   - {exported_file}")
         print("   - hospital_analytics_static.png")
         
         return True
@@ -70,6 +113,44 @@ def process_hospital_data():
         print(f"❌ Error processing data: {e}")
         return False
 
+def process_partitioned_data(partitions=None, partial_files=None, partial_dir=None, map_only=False,
+                             workers=1, export_options=None):
+    """Process extracts as partitions and/or reduce their partial states."""
+    print("🏥 Processing hospital data in partitions...")
+    
+    try:
+        from partitioned import process_partitions, map_partitions, reduce_partials
+        from data_processor import HospitalDataProcessor
+        
+        export_options = dict(export_options or {})
+        if map_only:
+            if not partial_dir:
+                print("❌ --map-only needs --partial-dir")
+                return False
+            written = map_partitions(partitions, workers=workers, partial_dir=partial_dir)
+            print(f"✅ Wrote {len(written)} partial state file(s):")
+            for path in written:
+                print(f"   - {path}")
+            return True
+        
+        if partitions:
+            processor = process_partitions(partitions, workers=workers, partial_dir=partial_dir,
+                                           **export_options)
+        else:
+            # Reducing saved states only needs the code dictionaries of the default extract
+            processor = HospitalDataProcessor(cache_dir=None)
+            processor.export_for_visualization(partial=reduce_partials(partial_files, processor),
+                                               **export_options)
+        
+        print("✅ Partitioned processing completed successfully!")
+        print("📊 Generated files:")
+        for exported_file in processor.exported_files:
+            print(f"   - {exported_file}")
+        return True
+    except Exception as e:
+        print(f"❌ Error processing partitions: {e}")
+        return False
+
 def generate_sample_data():
     """Generate sample data for testing."""
     print("🔧 Generating sample data...")
@@ -140,6 +221,17 @@ def main():
         epilog="""
 Examples:
     python run_visualizations.py --process-data
+    python run_visualizations.py --process-data --rebuild-cache
+    python run_visualizations.py --process-data --workers 8
+    python run_visualizations.py --process-data --incremental
+    python run_visualizations.py --process-data --compact --compress gzip
+    python run_visualizations.py --process-data --sharded
+    python run_visualizations.py --process-data --stay-index
+    python run_visualizations.py --process-data --backend duckdb --memory-limit 24GB
+    python run_visualizations.py --partitions site_a site_b site_c --workers 3
+    python run_visualizations.py --partitions /shared/site_a --partial-dir /shared/partials --map-only
+    python run_visualizations.py --reduce /shared/partials/*.partial.pkl --compact
+    python run_visualizations.py --process-data --stage-cache --sections lab_analytics --sharded
     python run_visualizations.py --open-basic
     python run_visualizations.py --open-advanced
     python run_visualizations.py --generate-sample
@@ -148,6 +240,48 @@ Examples:
     
     parser.add_argument('--process-data', action='store_true',
                        help='Process CSV data and generate visualization_data.json')
+    parser.add_argument('--rebuild-cache', action='store_true',
+                       help='Ignore the columnar table cache and re-parse every CSV')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Number of workers used to load tables and run stages (default: 1)')
+    parser.add_argument('--incremental', nargs='?', const='incremental_state.json',
+                       metavar='STATE_FILE',
+                       help='Fold only rows newer than the saved high-water marks into '
+                            'the saved aggregates (default state file: incremental_state.json)')
+    parser.add_argument('--compact', action='store_true',
+                       help='Write visualization_data.json without indentation')
+    parser.add_argument('--compress', choices=['gzip', 'brotli'],
+                       help='Compress visualization_data.json (brotli needs the brotli package)')
+    parser.add_argument('--sharded', action='store_true',
+                       help='Write one file per section plus manifest.json into visualization_data/')
+    parser.add_argument('--sections', nargs='+', metavar='NAME',
+                       help='Process only these sections and replace them in the existing output, '
+                            'e.g. lab_analytics room_analytics')
+    parser.add_argument('--stage-cache', nargs='?', const='.stage_cache', metavar='DIR',
+                       help='Memoize stage results on disk and reuse those whose inputs '
+                            'are unchanged (default directory: .stage_cache)')
+    parser.add_argument('--stay-index', nargs='?', const='stay_index.json', metavar='FILE',
+                       help='Also write the transfers/icustays interval index used for '
+                            '"who was where" queries (default file: stay_index.json)')
+    parser.add_argument('--backend', choices=['pandas', 'duckdb'], default='pandas',
+                       help='Engine for the aggregation stages: pandas (reference) or duckdb, '
+                            'which queries the source files out of core (needs the duckdb package)')
+    parser.add_argument('--memory-limit', metavar='SIZE',
+                       help='Memory DuckDB may use before spilling to disk, e.g. 24GB (duckdb backend)')
+    parser.add_argument('--verify-backend', action='store_true',
+                       help='Re-run the stages the backend handled on pandas and report any differences')
+    parser.add_argument('--partitions', nargs='+', metavar='DIR',
+                       help='Process these extract directories (each with hosp/ and icu/) in parallel '
+                            'processes and merge their partial results into visualization_data.json; '
+                            'list time slices oldest first')
+    parser.add_argument('--partial-dir', metavar='DIR',
+                       help='Keep the partial state of each partition in DIR')
+    parser.add_argument('--map-only', action='store_true',
+                       help='With --partitions, only write partial states to --partial-dir (reduce later)')
+    parser.add_argument('--reduce', nargs='+', metavar='FILE',
+                       help='Merge partial state files, in the given order, into visualization_data.json')
+    parser.add_argument('--benchmark-export', action='store_true',
+                       help='Compare export serializer speed and output size')
     parser.add_argument('--open-basic', action='store_true',
                        help='Open basic hospital visualizations')
     parser.add_argument('--open-advanced', action='store_true',
@@ -177,7 +311,39 @@ Examples:
     
     if args.process_data:
         if check_dependencies():
-            success &= process_hospital_data()
+            export_options = {
+                'incremental_state': args.incremental,
+                'compact': args.compact,
+                'compression': args.compress,
+                'sharded': args.sharded,
+                'sections': args.sections,
+                'stage_cache': args.stage_cache
+            }
+            success &= process_hospital_data(rebuild_cache=args.rebuild_cache,
+                                             workers=args.workers,
+                                             export_options=export_options,
+                                             benchmark_export=args.benchmark_export,
+                                             stay_index=args.stay_index,
+                                             backend=args.backend,
+                                             backend_options={'memory_limit': args.memory_limit}
+                                             if args.backend == 'duckdb' else None,
+                                             verify_backend=args.verify_backend)
+        else:
+            success = False
+    
+    if args.partitions or args.reduce:
+        if check_dependencies():
+            export_options = {
+                'compact': args.compact,
+                'compression': args.compress,
+                'sharded': args.sharded
+            }
+            success &= process_partitioned_data(partitions=args.partitions,
+                                                partial_files=args.reduce,
+                                                partial_dir=args.partial_dir,
+                                                map_only=args.map_only,
+                                                workers=args.workers,
+                                                export_options=export_options)
         else:
             success = False
     
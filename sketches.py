@@ -0,0 +1,314 @@
+"""
+Approximate Statistics Sketches
+===============================
+
+Small, mergeable summaries for statistics that would otherwise need every
+value in memory. All sketches are fed whole chunks with vectorized updates,
+combine with merge() (e.g. across chunks, workers or incremental runs) and
+round-trip through JSON with to_dict()/from_dict().
+
+GroupedQuantileSketch / QuantileSketch
+    Quantiles over logarithmically spaced buckets (the DDSketch
+    construction): every reported quantile is within ``relative_accuracy``
+    of the true value and memory grows with the number of occupied buckets.
+HyperLogLog
+    Distinct counts (e.g. unique patients) in 2**precision one-byte
+    registers; about 0.8% standard error at the default precision.
+CountMinSketch
+    Approximate frequencies of high-cardinality keys, with a bounded set of
+    heavy-hitter candidates for top-k reporting. Estimates never undercount.
+"""
+
+import base64
+
+import numpy as np
+import pandas as pd
+
+# Magnitudes below this are counted in the zero bucket
+MIN_MAGNITUDE = 1e-9
+
+
+class GroupedQuantileSketch:
+    """Per-key quantiles with a relative error guarantee"""
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        # Keeps bucket ids of magnitudes >= MIN_MAGNITUDE positive
+        self._bias = int(np.ceil(-np.log(MIN_MAGNITUDE) / self._log_gamma)) + 1
+        self.buckets = pd.Series(dtype='int64', index=pd.MultiIndex.from_arrays([[], []], names=['key', 'bucket']))
+
+    def _bucket(self, values):
+        """Signed bucket id; ids sort in the same order as the values they hold"""
+        magnitude = np.abs(values)
+        ids = np.zeros(len(values), dtype='int64')
+        nonzero = magnitude >= MIN_MAGNITUDE
+        ids[nonzero] = np.ceil(np.log(magnitude[nonzero]) / self._log_gamma).astype('int64') + self._bias
+        return np.where(values < 0, -ids, ids)
+
+    def _value(self, bucket_ids):
+        """Representative value of each bucket (relative error <= relative_accuracy)"""
+        magnitude = np.abs(bucket_ids) - self._bias
+        values = 2 * np.power(self.gamma, magnitude.astype('float64')) / (self.gamma + 1)
+        return np.where(bucket_ids == 0, 0.0, np.sign(bucket_ids) * values)
+
+    def update(self, keys, values, counts=None):
+        """Fold one chunk of (key, value) pairs into the sketch
+
+        counts optionally gives the multiplicity of each pair, for input that
+        was already aggregated (e.g. by a query engine).
+        """
+        values = np.asarray(values, dtype='float64')
+        keys = np.asarray(keys)
+        finite = np.isfinite(values)
+        if not finite.any():
+            return
+
+        chunk = pd.DataFrame({'key': keys[finite], 'bucket': self._bucket(values[finite])})
+        if counts is None:
+            self._add(chunk.value_counts(sort=False))
+        else:
+            chunk['count'] = np.asarray(counts, dtype='int64')[finite]
+            self._add(chunk.groupby(['key', 'bucket'], sort=False)['count'].sum())
+
+    def _add(self, counts):
+        if self.buckets.empty:
+            self.buckets = counts.astype('int64')
+        else:
+            self.buckets = self.buckets.add(counts, fill_value=0).astype('int64')
+        self.buckets.index.names = ['key', 'bucket']
+
+    def merge(self, other):
+        """Add the bucket counts of another sketch with the same accuracy"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        if not other.buckets.empty:
+            self._add(other.buckets)
+        return self
+
+    def keys(self):
+        return self.buckets.index.unique(level='key').tolist()
+
+    def _quantiles(self, key_buckets, qs):
+        key_buckets = key_buckets.droplevel('key').sort_index()
+        bucket_ids = key_buckets.index.to_numpy()
+        cumulative = np.cumsum(key_buckets.to_numpy())
+
+        ranks = np.asarray(qs, dtype='float64') * (cumulative[-1] - 1)
+        positions = np.searchsorted(cumulative, ranks, side='right')
+        return dict(zip(qs, self._value(bucket_ids[positions]).tolist()))
+
+    def quantiles(self, key, qs=(0.5, 0.9)):
+        """Approximate quantiles of one key's values ({q: value}), or None if it has no values"""
+        key_buckets = self.buckets[self.buckets.index.get_level_values('key') == key]
+        if key_buckets.empty:
+            return None
+        return self._quantiles(key_buckets, qs)
+
+    def summary(self, qs=(0.5, 0.9), keys=None):
+        """{key: {'count': n, 'p50': ..., 'p90': ...}} for the given (or all) keys"""
+        buckets = self.buckets
+        if keys is not None:
+            buckets = buckets[buckets.index.get_level_values('key').isin(list(keys))]
+
+        summaries = {}
+        for key, key_buckets in buckets.groupby(level='key'):
+            summary = {'count': int(key_buckets.sum())}
+            summary.update({f"p{round(q * 100):02d}": value
+                            for q, value in self._quantiles(key_buckets, qs).items()})
+            summaries[key.item() if hasattr(key, 'item') else key] = summary
+
+        if keys is not None:
+            return {key: summaries[key] for key in keys if key in summaries}
+        return summaries
+
+    def to_dict(self):
+        """JSON-friendly state: relative accuracy and [key, bucket, count] triples"""
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'buckets': [[key.item() if hasattr(key, 'item') else key, int(bucket), int(count)]
+                        for (key, bucket), count in self.buckets.items()]
+        }
+
+    @classmethod
+    def from_dict(cls, saved):
+        """Rebuild a sketch from to_dict() output"""
+        sketch = cls(saved['relative_accuracy'])
+        if saved['buckets']:
+            keys, buckets, counts = zip(*saved['buckets'])
+            sketch._add(pd.Series(counts, index=pd.MultiIndex.from_arrays([keys, buckets]), dtype='int64'))
+        return sketch
+
+
+class QuantileSketch:
+    """Quantiles of a single stream of values"""
+
+    def __init__(self, relative_accuracy=0.01):
+        self._sketch = GroupedQuantileSketch(relative_accuracy)
+
+    def update(self, values, counts=None):
+        values = np.asarray(values, dtype='float64')
+        self._sketch.update(np.zeros(len(values), dtype='int64'), values, counts)
+
+    def merge(self, other):
+        self._sketch.merge(other._sketch)
+        return self
+
+    def quantiles(self, qs=(0.5, 0.9)):
+        return self._sketch.quantiles(0, qs)
+
+    def summary(self, qs=(0.5, 0.9)):
+        """{'count': n, 'p50': ..., 'p90': ...}, or {'count': 0} without values"""
+        return self._sketch.summary(qs).get(0, {'count': 0})
+
+    def to_dict(self):
+        return self._sketch.to_dict()
+
+    @classmethod
+    def from_dict(cls, saved):
+        sketch = cls(saved['relative_accuracy'])
+        sketch._sketch = GroupedQuantileSketch.from_dict(saved)
+        return sketch
+
+
+def _hash_keys(values):
+    """Stable 64-bit hashes; integer ids hash the same whatever their width"""
+    values = pd.Series(values).dropna()
+    if pd.api.types.is_integer_dtype(values.dtype):
+        values = values.to_numpy(dtype='int64')
+    else:
+        values = values.astype(str).to_numpy(dtype=object)
+    return pd.util.hash_array(values), values
+
+
+def _bit_length(x):
+    """Exact bit length of every uint64 (0 for 0)"""
+    x = x.copy()
+    length = np.zeros(len(x), dtype='int64')
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = x >= (np.uint64(1) << np.uint64(shift))
+        length[wide] += shift
+        x[wide] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+class HyperLogLog:
+    """Approximate number of distinct values"""
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype='uint8')
+
+    def update(self, values):
+        hashes, _ = _hash_keys(values)
+        if len(hashes) == 0:
+            return
+
+        suffix_bits = 64 - self.precision
+        index = (hashes >> np.uint64(suffix_bits)).astype('int64')
+        rest = hashes & np.uint64((1 << suffix_bits) - 1)
+        # Position of the first 1 bit in the remaining hash bits
+        rank = (suffix_bits - _bit_length(rest) + 1).astype('uint8')
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype('float64')))
+
+        # Linear counting is more accurate while many registers are empty
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'precision': self.precision,
+                'registers': base64.b64encode(self.registers.tobytes()).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, saved):
+        sketch = cls(saved['precision'])
+        sketch.registers = np.frombuffer(base64.b64decode(saved['registers']), dtype='uint8').copy()
+        return sketch
+
+
+# Odd 64-bit multipliers deriving one independent hash per count-min row
+_ROW_MULTIPLIERS = np.array([0x9E3779B97F4A7C15, 0xBF58476D1CE4E5B9, 0x94D049BB133111EB,
+                             0xD6E8FEB86659FD93, 0xA0761D6478BD642F, 0xE7037ED1A0B428DB],
+                            dtype='uint64')
+
+
+class CountMinSketch:
+    """Approximate per-key counts with heavy-hitter tracking"""
+
+    def __init__(self, width_bits=12, depth=4, capacity=100):
+        if depth > len(_ROW_MULTIPLIERS):
+            raise ValueError(f"depth must be at most {len(_ROW_MULTIPLIERS)}")
+        self.width_bits = width_bits
+        self.depth = depth
+        self.capacity = capacity
+        self.table = np.zeros((depth, 1 << width_bits), dtype='int64')
+        self.candidates = pd.Index([])
+
+    def _columns(self, hashes):
+        """Column of every hash in each row"""
+        shift = np.uint64(64 - self.width_bits)
+        return [((hashes * _ROW_MULTIPLIERS[row]) >> shift).astype('int64') for row in range(self.depth)]
+
+    def update(self, values):
+        hashes, keys = _hash_keys(values)
+        if len(hashes) == 0:
+            return
+        for row, columns in enumerate(self._columns(hashes)):
+            self.table[row] += np.bincount(columns, minlength=self.table.shape[1])
+        self._trim(self.candidates.append(pd.Index(pd.unique(keys))))
+
+    def estimate(self, keys):
+        """Estimated count of every key (never below the true count)"""
+        hashes, _ = _hash_keys(keys)
+        columns = self._columns(hashes)
+        return np.min([self.table[row, columns[row]] for row in range(self.depth)], axis=0)
+
+    def _trim(self, candidates):
+        """Keep the capacity most frequent candidate keys"""
+        candidates = candidates.unique()
+        if len(candidates) > self.capacity:
+            order = np.argsort(-self.estimate(candidates), kind='stable')[:self.capacity]
+            candidates = candidates[order]
+        self.candidates = candidates
+
+    def merge(self, other):
+        if other.table.shape != self.table.shape:
+            raise ValueError("Cannot merge count-min sketches of different shape")
+        self.table += other.table
+        self._trim(self.candidates.append(other.candidates))
+        return self
+
+    def top(self, k=10):
+        """{key: estimated count} of the k heaviest keys seen"""
+        if len(self.candidates) == 0:
+            return {}
+        estimates = self.estimate(self.candidates)
+        order = np.argsort(-estimates, kind='stable')[:k]
+        return {(key.item() if hasattr(key, 'item') else key): int(estimates[position])
+                for key, position in zip(self.candidates[order], order)}
+
+    def to_dict(self):
+        return {'width_bits': self.width_bits, 'depth': self.depth, 'capacity': self.capacity,
+                'table': self.table.tolist(),
+                'candidates': [key.item() if hasattr(key, 'item') else key for key in self.candidates]}
+
+    @classmethod
+    def from_dict(cls, saved):
+        sketch = cls(saved['width_bits'], saved['depth'], saved['capacity'])
+        sketch.table = np.array(saved['table'], dtype='int64')
+        sketch.candidates = pd.Index(saved['candidates'])
+        return sketch
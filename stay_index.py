@@ -0,0 +1,242 @@
+"""
+Stay Interval Index
+===================
+
+Point-in-time "who was where" queries over transfers and icustays, for the
+3D room explorer.
+
+TimelineIndex groups intervals by key (care unit, subject) and keeps, per
+key, the +1/-1 events of its intervals in time order plus a checkpoint every
+``checkpoint_every`` events listing the intervals open at that point. A
+stabbing query ("who was in the unit at T") is a binary search for T, the
+nearest checkpoint at or before it and the arrivals since, so it costs
+O(log n + checkpoint_every + k) for k matches and never scans the table.
+Range queries ("who was in the unit between T0 and T1") add the arrivals in
+the range. Intervals are half-open: a stay ending at T is no longer present
+at T.
+
+Everything is stored as flat integer arrays (times in epoch seconds), so
+StayIndex.to_dict() is plain JSON that the web layer can load and query
+with the same binary searches, without pandas. Stays without a unit or an
+end time, or ending before they start, are not indexed.
+"""
+
+import numpy as np
+import pandas as pd
+
+STAY_SOURCES = ['transfers', 'icustays']
+
+# Source table -> (unit column, stay id column)
+STAY_COLUMNS = {
+    'transfers': ('careunit', 'transfer_id'),
+    'icustays': ('first_careunit', 'stay_id')
+}
+
+
+def _seconds(time):
+    """Epoch seconds of a timestamp (str, datetime, pd.Timestamp or numpy datetime64)"""
+    return int(np.datetime64(pd.Timestamp(time), 's').astype('int64'))
+
+
+class TimelineIndex:
+    """Stabbing and range queries over half-open intervals grouped by integer key"""
+
+    def __init__(self, keys, starts, ends, checkpoint_every=64):
+        keys = np.asarray(keys, dtype='int64')
+        self.starts = np.asarray(starts, dtype='int64')
+        self.ends = np.asarray(ends, dtype='int64')
+        self.checkpoint_every = checkpoint_every
+        count = len(keys)
+
+        self.keys, key_ids = np.unique(keys, return_inverse=True)
+        rows = np.arange(count, dtype='int64')
+
+        # Events sorted by (key, time), departures before arrivals at the same instant;
+        # arrivals are stored as the row and departures as ~row (negative)
+        event_keys = np.concatenate([key_ids, key_ids])
+        event_times = np.concatenate([self.starts, self.ends])
+        arrival = np.concatenate([np.ones(count, dtype='int8'), np.zeros(count, dtype='int8')])
+        order = np.lexsort((arrival, event_times, event_keys))
+        self.times = event_times[order]
+        self.events = np.concatenate([rows, ~rows])[order]
+        self.bounds = np.searchsorted(event_keys[order], np.arange(len(self.keys) + 1))
+
+        # Checkpoint m of a key sits before its event m * checkpoint_every and lists
+        # the rows whose arrival comes before it and whose departure does not
+        positions = np.empty(2 * count, dtype='int64')
+        positions[order] = np.arange(2 * count)
+        first_event = self.bounds[key_ids]
+        arrived = (positions[:count] - first_event) // checkpoint_every + 1
+        departed = (positions[count:] - first_event) // checkpoint_every
+        spans = np.maximum(departed - arrived + 1, 0)
+
+        per_key = np.diff(self.bounds) // checkpoint_every + 1
+        self.checkpoint_bounds = np.concatenate([[0], np.cumsum(per_key)])
+        span_starts = np.repeat(np.cumsum(spans) - spans, spans)
+        checkpoints = (np.repeat(self.checkpoint_bounds[key_ids] + arrived, spans)
+                       + np.arange(spans.sum()) - span_starts)
+        checkpoint_order = np.lexsort((np.repeat(rows, spans), checkpoints))
+        self.checkpoint_rows = np.repeat(rows, spans)[checkpoint_order]
+        self.checkpoint_offsets = np.searchsorted(checkpoints[checkpoint_order],
+                                                  np.arange(self.checkpoint_bounds[-1] + 1))
+
+    def _key_position(self, key):
+        position = np.searchsorted(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return position
+        return None
+
+    def _open_rows(self, position, time):
+        """Rows of a key open just after time, plus the key's event offset past time"""
+        first, last = self.bounds[position], self.bounds[position + 1]
+        seen = int(np.searchsorted(self.times[first:last], time, side='right'))
+        checkpoint = seen // self.checkpoint_every
+        offset = self.checkpoint_bounds[position] + checkpoint
+
+        arrivals = self.events[first + checkpoint * self.checkpoint_every:first + seen]
+        candidates = np.concatenate([
+            self.checkpoint_rows[self.checkpoint_offsets[offset]:self.checkpoint_offsets[offset + 1]],
+            arrivals[arrivals >= 0]
+        ])
+        return candidates[self.ends[candidates] > time], seen
+
+    def at(self, key, time):
+        """Rows whose interval contains time (epoch seconds)"""
+        position = self._key_position(key)
+        if position is None:
+            return np.empty(0, dtype='int64')
+        rows, _ = self._open_rows(position, time)
+        return np.sort(rows)
+
+    def overlapping(self, key, start, end):
+        """Rows whose interval overlaps [start, end) (epoch seconds)"""
+        position = self._key_position(key)
+        if position is None or end <= start:
+            return np.empty(0, dtype='int64')
+        rows, seen = self._open_rows(position, start)
+
+        first, last = self.bounds[position], self.bounds[position + 1]
+        until = int(np.searchsorted(self.times[first:last], end, side='left'))
+        arrivals = self.events[first + seen:first + until]
+        return np.sort(np.concatenate([rows, arrivals[arrivals >= 0]]))
+
+    def to_dict(self):
+        """Index arrays as JSON-ready lists (interval starts/ends are stored by the owner)"""
+        return {
+            'checkpoint_every': self.checkpoint_every,
+            'keys': self.keys.tolist(),
+            'bounds': self.bounds.tolist(),
+            'times': self.times.tolist(),
+            'events': self.events.tolist(),
+            'checkpoint_bounds': self.checkpoint_bounds.tolist(),
+            'checkpoint_offsets': self.checkpoint_offsets.tolist(),
+            'checkpoint_rows': self.checkpoint_rows.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data, starts, ends):
+        index = cls.__new__(cls)
+        index.starts = np.asarray(starts, dtype='int64')
+        index.ends = np.asarray(ends, dtype='int64')
+        index.checkpoint_every = data['checkpoint_every']
+        for name in ('keys', 'bounds', 'times', 'events', 'checkpoint_bounds',
+                     'checkpoint_offsets', 'checkpoint_rows'):
+            setattr(index, name, np.asarray(data[name], dtype='int64'))
+        return index
+
+
+class StayIndex:
+    """Care unit stays from transfers and icustays, indexed by unit and by subject"""
+
+    def __init__(self, stays, units, checkpoint_every=64):
+        # stays: columns source, subject_id, hadm_id (-1 if unknown), stay_id, unit
+        # (position in units), intime, outtime (epoch seconds) as integer arrays
+        self.stays = {column: np.asarray(values, dtype='int64') for column, values in stays.items()}
+        self.units = list(units)
+        self._unit_codes = {unit: code for code, unit in enumerate(self.units)}
+
+        intime, outtime = self.stays['intime'], self.stays['outtime']
+        self.by_unit = TimelineIndex(self.stays['unit'], intime, outtime, checkpoint_every)
+        self.by_subject = TimelineIndex(self.stays['subject_id'], intime, outtime, checkpoint_every)
+
+    @classmethod
+    def from_tables(cls, transfers=None, icustays=None, checkpoint_every=64):
+        """Build from the transfers and/or icustays frames"""
+        frames = []
+        for source, table in zip(STAY_SOURCES, (transfers, icustays)):
+            if table is None:
+                continue
+            unit_column, id_column = STAY_COLUMNS[source]
+            intime, outtime = pd.to_datetime(table['intime']), pd.to_datetime(table['outtime'])
+            valid = table[unit_column].notna() & intime.notna() & outtime.notna() & (outtime > intime)
+            frames.append(pd.DataFrame({
+                'source': STAY_SOURCES.index(source),
+                'subject_id': table['subject_id'][valid].astype('int64'),
+                'hadm_id': table['hadm_id'][valid].astype('Int64').fillna(-1).astype('int64'),
+                'stay_id': table[id_column][valid].astype('int64'),
+                'unit': table[unit_column][valid].astype(object),
+                'intime': intime[valid].to_numpy().astype('datetime64[s]').astype('int64'),
+                'outtime': outtime[valid].to_numpy().astype('datetime64[s]').astype('int64')
+            }))
+
+        stays = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=['source', 'subject_id', 'hadm_id', 'stay_id', 'unit', 'intime', 'outtime'])
+        unit_codes, units = pd.factorize(stays['unit'], sort=True)
+        stays['unit'] = unit_codes
+        return cls({column: stays[column].to_numpy() for column in stays.columns}, units, checkpoint_every)
+
+    def _records(self, rows, source=None):
+        if source is not None:
+            rows = rows[self.stays['source'][rows] == STAY_SOURCES.index(source)]
+        return [{
+            'source': STAY_SOURCES[self.stays['source'][row]],
+            'subject_id': int(self.stays['subject_id'][row]),
+            'hadm_id': int(self.stays['hadm_id'][row]) if self.stays['hadm_id'][row] >= 0 else None,
+            'stay_id': int(self.stays['stay_id'][row]),
+            'unit': self.units[self.stays['unit'][row]],
+            'intime': str(np.datetime64(int(self.stays['intime'][row]), 's')),
+            'outtime': str(np.datetime64(int(self.stays['outtime'][row]), 's'))
+        } for row in rows]
+
+    def in_unit(self, unit, time, source=None):
+        """Stays in a care unit at a point in time"""
+        if unit not in self._unit_codes:
+            return []
+        return self._records(self.by_unit.at(self._unit_codes[unit], _seconds(time)), source)
+
+    def in_unit_between(self, unit, start, end, source=None):
+        """Stays in a care unit at any time in [start, end)"""
+        if unit not in self._unit_codes:
+            return []
+        rows = self.by_unit.overlapping(self._unit_codes[unit], _seconds(start), _seconds(end))
+        return self._records(rows, source)
+
+    def locate(self, subject_id, time, source=None):
+        """Where a subject was at a point in time"""
+        return self._records(self.by_subject.at(subject_id, _seconds(time)), source)
+
+    def locate_between(self, subject_id, start, end, source=None):
+        """A subject's stays overlapping [start, end)"""
+        return self._records(self.by_subject.overlapping(subject_id, _seconds(start), _seconds(end)), source)
+
+    def to_dict(self):
+        """JSON-ready index: stay columns plus both timelines"""
+        return {
+            'format': 1,
+            'sources': STAY_SOURCES,
+            'units': self.units,
+            'stays': {column: values.tolist() for column, values in self.stays.items()},
+            'by_unit': self.by_unit.to_dict(),
+            'by_subject': self.by_subject.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls.__new__(cls)
+        index.stays = {column: np.asarray(values, dtype='int64') for column, values in data['stays'].items()}
+        index.units = list(data['units'])
+        index._unit_codes = {unit: code for code, unit in enumerate(index.units)}
+        intime, outtime = index.stays['intime'], index.stays['outtime']
+        index.by_unit = TimelineIndex.from_dict(data['by_unit'], intime, outtime)
+        index.by_subject = TimelineIndex.from_dict(data['by_subject'], intime, outtime)
+        return index
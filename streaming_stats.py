@@ -0,0 +1,96 @@
+"""
+Streaming Statistics
+====================
+
+Mergeable accumulators for computing exact statistics over tables that are
+read chunk by chunk, so memory depends on the number of groups rather than
+the number of rows.
+
+Per-group moments are kept as (count, mean, M2) and combined with Chan et
+al.'s parallel variance update, which is exact and order independent: the
+state of two chunks (or two workers) can be merged at any time.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class RunningMoments:
+    """Per-key count, mean and variance accumulated over many chunks"""
+
+    def __init__(self):
+        self.state = pd.DataFrame({'count': pd.Series(dtype='float64'),
+                                   'mean': pd.Series(dtype='float64'),
+                                   'm2': pd.Series(dtype='float64')})
+
+    def update(self, keys, values):
+        """Fold one chunk of (key, value) pairs into the running state"""
+        chunk = pd.DataFrame({'key': np.asarray(keys), 'value': np.asarray(values, dtype='float64')})
+        chunk = chunk.dropna(subset=['value'])
+        if chunk.empty:
+            return
+
+        grouped = chunk.groupby('key')['value']
+        count = grouped.count().astype('float64')
+        mean = grouped.mean()
+        m2 = grouped.var(ddof=0).fillna(0) * count
+
+        self._merge_state(pd.DataFrame({'count': count, 'mean': mean, 'm2': m2}))
+
+    def to_dict(self):
+        """JSON-friendly state: {key: [count, mean, m2]}"""
+        return {str(key): [row['count'], row['mean'], row['m2']]
+                for key, row in self.state.iterrows()}
+
+    @classmethod
+    def from_dict(cls, saved, key_type=int):
+        """Rebuild an accumulator from to_dict() output"""
+        moments = cls()
+        if saved:
+            moments.state = pd.DataFrame.from_dict(
+                {key_type(key): value for key, value in saved.items()},
+                orient='index', columns=['count', 'mean', 'm2'])
+        return moments
+
+    def merge(self, other):
+        """Merge the state of another accumulator (e.g. from another worker)"""
+        self._merge_state(other.state)
+        return self
+
+    def _merge_state(self, other):
+        a, b = self.state.align(other, join='outer', fill_value=0)
+        n = a['count'] + b['count']
+        safe_n = n.where(n > 0, 1)
+        delta = b['mean'] - a['mean']
+
+        self.state = pd.DataFrame({
+            'count': n,
+            'mean': a['mean'] + delta * b['count'] / safe_n,
+            'm2': a['m2'] + b['m2'] + delta ** 2 * a['count'] * b['count'] / safe_n
+        })
+
+    def combined(self, keys):
+        """Pooled count/mean/std across several keys"""
+        rows = self.state.loc[self.state.index.intersection(keys)]
+        n = rows['count'].sum()
+        if n == 0:
+            return None
+
+        mean = (rows['count'] * rows['mean']).sum() / n
+        m2 = rows['m2'].sum() + (rows['count'] * (rows['mean'] - mean) ** 2).sum()
+        return self._summary(n, mean, m2)
+
+    def summary(self):
+        """Count/mean/variance/std for every key"""
+        return {key: self._summary(row['count'], row['mean'], row['m2'])
+                for key, row in self.state.iterrows()}
+
+    @staticmethod
+    def _summary(n, mean, m2, ddof=1):
+        variance = m2 / (n - ddof) if n > ddof else np.nan
+        return {
+            'mean': mean,
+            'variance': variance,
+            'std': np.sqrt(variance),
+            'count': int(n)
+        }
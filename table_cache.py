@@ -0,0 +1,105 @@
+"""
+Columnar Table Cache
+====================
+
+On-disk Parquet cache for the CSV tables read by HospitalDataProcessor.
+
+Each cached table is stored as ``<name>.parquet`` next to a small
+``<name>.meta.json`` sidecar recording the source file path, size and
+modification time (plus any read options). A cached copy is only used when
+all of these still match, so tables whose source changed are re-ingested
+while everything else loads typed columns directly.
+
+Requires pyarrow; without it the cache is disabled and every table is
+parsed from CSV as before.
+"""
+
+import os
+import json
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+
+class TableCache:
+    def __init__(self, cache_dir='.table_cache', rebuild=False):
+        self.cache_dir = cache_dir
+        self.rebuild = rebuild
+        self.enabled = PARQUET_AVAILABLE
+        self.stats = {}
+
+        if not self.enabled:
+            print("pyarrow not installed - table cache disabled")
+
+    def _paths(self, name):
+        base = os.path.join(self.cache_dir, name)
+        return base + '.parquet', base + '.meta.json'
+
+    def source_signature(self, source_path, read_options=None):
+        """Describe a source file so stale cache entries can be detected"""
+        stat = os.stat(source_path)
+        return {
+            'path': os.path.abspath(source_path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'read_options': read_options or {}
+        }
+
+    def load(self, name, source_path, read_options=None):
+        """Return the cached frame for a table, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        data_path, meta_path = self._paths(name)
+        signature = self.source_signature(source_path, read_options)
+
+        if not self.rebuild and os.path.exists(data_path) and os.path.exists(meta_path):
+            try:
+                with open(meta_path) as f:
+                    cached_signature = json.load(f)
+                if cached_signature == signature:
+                    df = pd.read_parquet(data_path)
+                    self.stats[name] = 'hit'
+                    return df
+            except Exception as e:
+                print(f"Ignoring unreadable cache entry for {name}: {e}")
+
+        self.stats[name] = 'rebuild' if self.rebuild else 'miss'
+        return None
+
+    def store(self, name, source_path, df, read_options=None):
+        """Write a freshly parsed table to the cache"""
+        if not self.enabled:
+            return
+
+        data_path, meta_path = self._paths(name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        try:
+            df.to_parquet(data_path, index=False)
+        except Exception as e:
+            # Mixed-type object columns cannot always be written as Parquet
+            print(f"Could not cache {name}: {e}")
+            if os.path.exists(data_path):
+                os.remove(data_path)
+            return
+
+        # Metadata is written last so a partial write never looks valid
+        with open(meta_path, 'w') as f:
+            json.dump(self.source_signature(source_path, read_options), f)
+
+    def report(self):
+        """Print cache hits and misses per table"""
+        if not self.enabled or not self.stats:
+            return
+
+        hits = sum(1 for status in self.stats.values() if status == 'hit')
+        print(f"Table cache ({self.cache_dir}): {hits} hits, "
+              f"{len(self.stats) - hits} misses")
+        for name, status in self.stats.items():
+            print(f"  {name}: {status}")
@@ -0,0 +1,177 @@
+"""
+MIMIC-IV Table Schemas
+======================
+
+Per-table registry of the columns HospitalDataProcessor actually uses,
+with compact dtypes and the datetime columns to parse at read time.
+
+Only the declared columns are read, ids are stored as 32-bit integers,
+measurements as float32 and low-cardinality labels as categoricals.
+Id columns that can be empty in MIMIC-IV (e.g. ``hadm_id`` on transfers
+and labevents) use the nullable ``Int32`` dtype.
+
+Tables without an entry are read in full with inferred dtypes.
+"""
+
+TABLE_SCHEMAS = {
+    'patients': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'gender': 'category',
+            'anchor_age': 'int16'
+        },
+        'parse_dates': ['dod']
+    },
+    'admissions': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'int32',
+            'admission_type': 'category',
+            'admission_location': 'category',
+            'discharge_location': 'category',
+            'hospital_expire_flag': 'int8'
+        },
+        'parse_dates': ['admittime', 'dischtime']
+    },
+    'transfers': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'Int32',
+            'transfer_id': 'int32',
+            'eventtype': 'category',
+            'careunit': 'category'
+        },
+        'parse_dates': ['intime', 'outtime']
+    },
+    'labevents': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'Int32',
+            'itemid': 'int32',
+            'valuenum': 'float32',
+            'flag': 'category',
+            'priority': 'category'
+        },
+        'parse_dates': ['charttime', 'storetime']
+    },
+    'diagnoses_icd': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'int32',
+            'icd_code': 'category',
+            'icd_version': 'int8'
+        },
+        'parse_dates': []
+    },
+    'services': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'int32',
+            'prev_service': 'category',
+            'curr_service': 'category'
+        },
+        'parse_dates': ['transfertime']
+    },
+    'icustays': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'int32',
+            'stay_id': 'int32',
+            'first_careunit': 'category',
+            'last_careunit': 'category',
+            'los': 'float32'
+        },
+        'parse_dates': ['intime', 'outtime']
+    },
+    'emar': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'Int32',
+            'pharmacy_id': 'Int32',
+            'poe_id': 'str',
+            'medication': 'category',
+            'event_txt': 'category'
+        },
+        'parse_dates': ['charttime']
+    },
+    'pharmacy': {
+        'dtypes': {
+            'hadm_id': 'int32',
+            'pharmacy_id': 'int32',
+            'poe_id': 'str',
+            'route': 'category'
+        },
+        'parse_dates': ['entertime', 'verifiedtime']
+    },
+    'prescriptions': {
+        'dtypes': {
+            'hadm_id': 'int32',
+            'pharmacy_id': 'int32',
+            'drug_type': 'category',
+            'drug': 'category'
+        },
+        'parse_dates': []
+    },
+    'chartevents': {
+        'dtypes': {
+            'itemid': 'int32',
+            'valuenum': 'float32'
+        },
+        'parse_dates': []
+    },
+    'inputevents': {
+        'dtypes': {
+            'subject_id': 'int32',
+            'hadm_id': 'int32',
+            'stay_id': 'int32',
+            'itemid': 'int32',
+            'amount': 'float32',
+            'amountuom': 'category',
+            'rate': 'float32',
+            'rateuom': 'category',
+            'ordercategorydescription': 'category'
+        },
+        'parse_dates': ['starttime', 'endtime']
+    },
+    'ingredientevents': {
+        'dtypes': {
+            'stay_id': 'int32',
+            'itemid': 'int32',
+            'amount': 'float32',
+            'amountuom': 'category',
+            'rate': 'float32',
+            'rateuom': 'category'
+        },
+        'parse_dates': ['starttime', 'endtime']
+    },
+    'outputevents': {
+        'dtypes': {
+            'stay_id': 'int32',
+            'itemid': 'int32',
+            'value': 'float32',
+            'valueuom': 'category'
+        },
+        'parse_dates': ['charttime']
+    }
+}
+
+
+def schema_read_options(name, available_columns):
+    """pandas read options (usecols/dtype/parse_dates) for a registered table
+
+    Columns declared in the schema but missing from the source file are
+    skipped, so older or partial extracts still load.
+    """
+    schema = TABLE_SCHEMAS.get(name)
+    if schema is None:
+        return {}
+
+    available = set(available_columns)
+    dtypes = {col: dtype for col, dtype in schema['dtypes'].items() if col in available}
+    parse_dates = [col for col in schema['parse_dates'] if col in available]
+
+    return {
+        'usecols': sorted(set(dtypes) | set(parse_dates)),
+        'dtype': dtypes,
+        'parse_dates': parse_dates
+    }
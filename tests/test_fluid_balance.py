@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fluid_balance import FluidBalance, allocate
+
+
+def brute_force(keys, starts, ends, amounts, bin_seconds):
+    """Overlap of every row with every bin it touches, one row at a time"""
+    totals = {}
+    for key, start, end, amount in zip(keys, starts, ends, amounts):
+        if end <= start:
+            totals[(key, start // bin_seconds)] = totals.get((key, start // bin_seconds), 0.0) + amount
+            continue
+        for bin_ in range(start // bin_seconds, -(-end // bin_seconds)):
+            overlap = min(end, (bin_ + 1) * bin_seconds) - max(start, bin_ * bin_seconds)
+            totals[(key, bin_)] = totals.get((key, bin_), 0.0) + amount * overlap / (end - start)
+    return totals
+
+
+def test_infusion_split_across_bins():
+    # 300 mL from 00:30 to 03:30: half hours in the first and last bin, full hours between
+    totals = allocate([1], [1800], [3 * 3600 + 1800], [300.0])
+
+    assert totals.to_dict() == pytest.approx({(1, 0): 50.0, (1, 1): 100.0, (1, 2): 100.0, (1, 3): 50.0})
+    assert totals.sum() == pytest.approx(300.0)
+
+
+def test_interval_on_bin_edges_stays_inside_its_bins():
+    totals = allocate([1, 1], [3600, 7200], [7200, 7200], [60.0, 5.0])
+
+    # [01:00, 02:00) fills bin 1 only; the point at 02:00 opens bin 2
+    assert totals.to_dict() == pytest.approx({(1, 1): 60.0, (1, 2): 5.0})
+
+
+def test_zero_length_and_reversed_rows_go_to_the_start_bin():
+    totals = allocate([1, 2], [5000, 9000], [5000, 8000], [10.0, 20.0])
+
+    assert totals.to_dict() == pytest.approx({(1, 1): 10.0, (2, 2): 20.0})
+
+
+def test_missing_and_zero_amounts_are_skipped():
+    totals = allocate([1, 1, 1], [0, 0, 0], [3600, 3600, 3600], [np.nan, 0.0, 12.0])
+
+    assert totals.to_dict() == pytest.approx({(1, 0): 12.0})
+
+
+def test_open_ended_input_is_charted_at_its_start():
+    balance = FluidBalance()
+    balance.update_inputs(pd.DataFrame({
+        'stay_id': [1, 1],
+        'starttime': pd.to_datetime(['2150-01-01 00:30', '2150-01-01 05:10']),
+        'endtime': pd.to_datetime(['2150-01-01 01:30', None]),
+        'amount': [100.0, 40.0],
+        'amountuom': ['mL', 'mL']
+    }))
+
+    start_bin = pd.Timestamp('2150-01-01').value // 10**9 // 3600
+    assert balance.inputs.to_dict() == pytest.approx({(1, start_bin): 50.0, (1, start_bin + 1): 50.0,
+                                                       (1, start_bin + 5): 40.0})
+
+
+@pytest.mark.parametrize('bin_seconds', [60, 3600, 4 * 3600])
+def test_matches_brute_force(bin_seconds):
+    rng = np.random.default_rng(bin_seconds)
+    n = 200
+    keys = rng.integers(1, 6, n)
+    starts = 1_000_000 + rng.integers(0, 3 * 86400, n)
+    ends = starts + rng.choice([0, 1, 59, 3600, 7 * 3600 + 13, 2 * 86400], n)
+    ends[:5] = starts[:5] - 30
+    amounts = rng.uniform(1, 500, n)
+
+    totals = allocate(keys, starts, ends, amounts, bin_seconds)
+    expected = brute_force(keys, starts, ends, amounts, bin_seconds)
+    expected = {key: amount for key, amount in expected.items() if abs(amount) > 1e-6}
+
+    assert set(totals.index) == set(expected)
+    assert totals.to_dict() == pytest.approx(expected, rel=1e-9, abs=1e-6)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processor import HospitalDataProcessor
+from occupancy import Occupancy
+
+
+def transfers_frame():
+    """Two overlapping stays and a lone stay ten years later in MICU; one overnight stay in CCU"""
+    return pd.DataFrame({
+        'careunit': ['MICU', 'MICU', 'MICU', 'CCU'],
+        'intime': pd.to_datetime(['2150-01-01 00:00', '2150-01-01 01:00', '2160-01-01 10:00', '2150-01-01 23:30']),
+        'outtime': pd.to_datetime(['2150-01-01 02:00', '2150-01-01 03:00', '2160-01-01 11:00', '2150-01-02 00:30'])
+    })
+
+
+def occupancy_of(transfers):
+    return Occupancy(transfers['careunit'], transfers['intime'], transfers['outtime'])
+
+
+def test_mean_census_covers_in_use_time_only():
+    summary = occupancy_of(transfers_frame()).summary('MICU')
+
+    # 5 patient-hours over the 4 hours with occupants, not over the ten-year span
+    assert summary['mean_census'] == pytest.approx(1.25)
+    assert summary['peak_census'] == 2
+    assert summary['patient_days'] == pytest.approx(round(5 / 24, 2))
+    assert summary['in_use_days'] == pytest.approx(round(4 / 24, 2))
+    assert summary['busiest_period'] == '2150-01-01T01:00:00'
+    assert summary['busiest_period_census'] == pytest.approx(2.0)
+
+
+def test_utilization_needs_a_capacity():
+    occupancy = occupancy_of(transfers_frame())
+
+    summary = occupancy.summary('MICU')
+    assert summary['utilization'] is None
+    assert summary['capacity'] is None
+
+    assert occupancy.summary('MICU', capacity=4)['utilization'] == pytest.approx(31.25)
+
+
+def test_hourly_census_while_in_use():
+    occupancy = occupancy_of(transfers_frame())
+
+    expected = np.zeros(24)
+    expected[[0, 1, 2, 10]] = [1.0, 2.0, 1.0, 1.0]
+    np.testing.assert_allclose(occupancy.hourly_census('MICU'), expected)
+
+    # Overnight stay is split over the hours it overlaps
+    expected = np.zeros(24)
+    expected[[0, 23]] = 1.0
+    np.testing.assert_allclose(occupancy.hourly_census('CCU'), expected)
+
+
+def test_hourly_census_matches_minute_sampling():
+    rng = np.random.default_rng(7)
+    starts = pd.Timestamp('2150-01-01') + pd.to_timedelta(rng.integers(0, 4 * 24 * 60, 40), unit='min')
+    ends = starts + pd.to_timedelta(rng.integers(1, 12 * 60, 40), unit='min')
+    occupancy = Occupancy(np.full(40, 'MICU', dtype=object), starts, ends)
+
+    minutes = pd.date_range(starts.min(), ends.max(), freq='min', inclusive='left')
+    census = occupancy.census_at('MICU', minutes)
+    in_use = census > 0
+    totals = np.bincount(minutes.hour[in_use], weights=census[in_use], minlength=24)
+    samples = np.bincount(minutes.hour[in_use], minlength=24)
+    expected = np.divide(totals, samples, out=np.zeros(24), where=samples > 0)
+
+    np.testing.assert_allclose(occupancy.hourly_census('MICU'), expected)
+
+
+def test_process_occupancy_without_capacities():
+    processor = HospitalDataProcessor(cache_dir=None)
+    processor.data['transfers'] = transfers_frame()
+    processor.process_occupancy()
+
+    care_units = processor.processed_data['occupancy']['care_units']
+    assert care_units['MICU']['mean_census'] == pytest.approx(1.25)
+    assert care_units['MICU']['utilization'] is None
+    assert care_units['CCU']['utilization'] is None
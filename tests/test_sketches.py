@@ -0,0 +1,175 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketches import CountMinSketch, GroupedQuantileSketch, HyperLogLog, QuantileSketch
+
+
+def copy_of(sketch):
+    return type(sketch).from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+
+def merged(*sketches):
+    first = copy_of(sketches[0])
+    for sketch in sketches[1:]:
+        first.merge(sketch)
+    return first
+
+
+def buckets(sketch):
+    """Bucket counts of a quantile sketch, independent of merge order"""
+    return sorted(map(tuple, sketch.to_dict()['buckets']))
+
+
+def thirds(values):
+    return np.array_split(np.asarray(values), 3)
+
+
+def lower_quantile(values, q):
+    """Value at rank floor(q * (n - 1)), the rank the sketches report"""
+    return np.sort(values)[int(q * (len(values) - 1))]
+
+
+QS = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+
+@pytest.mark.parametrize('relative_accuracy', [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    rng = np.random.default_rng(1)
+    values = np.concatenate([rng.lognormal(2, 1.5, 20000), -rng.lognormal(0, 1, 5000)])
+    sketch = QuantileSketch(relative_accuracy)
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+
+    for q, estimate in sketch.quantiles(QS).items():
+        exact = lower_quantile(values, q)
+        assert abs(estimate - exact) <= relative_accuracy * abs(exact) * (1 + 1e-9)
+    assert sketch.summary()['count'] == len(values)
+
+
+def test_grouped_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(2)
+    keys = rng.integers(0, 5, 30000)
+    values = rng.gamma(2.0, 10.0 * (keys + 1))
+    sketch = GroupedQuantileSketch(0.02)
+    sketch.update(keys, values)
+
+    for key in range(5):
+        for q, estimate in sketch.quantiles(key, QS).items():
+            exact = lower_quantile(values[keys == key], q)
+            assert abs(estimate - exact) <= 0.02 * exact * (1 + 1e-9)
+    assert sketch.quantiles(99) is None
+
+
+def test_pre_aggregated_counts_match_repeated_values():
+    values = np.array([1.5, 20.0, 300.0])
+    counts = np.array([3, 1, 6])
+    weighted = QuantileSketch()
+    weighted.update(values, counts)
+    repeated = QuantileSketch()
+    repeated.update(np.repeat(values, counts))
+
+    assert buckets(weighted) == buckets(repeated)
+
+
+def test_quantile_merge_is_associative():
+    rng = np.random.default_rng(3)
+    values = rng.normal(50, 20, 9000)
+    a, b, c = (QuantileSketch() for _ in range(3))
+    for sketch, part in zip((a, b, c), thirds(values)):
+        sketch.update(part)
+    whole = QuantileSketch()
+    whole.update(values)
+
+    left = merged(merged(a, b), c)
+    right = merged(a, merged(b, c))
+    assert buckets(left) == buckets(right) == buckets(whole)
+    assert left.quantiles(QS) == right.quantiles(QS) == whole.quantiles(QS)
+
+
+def test_quantile_merge_rejects_other_accuracy():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.02))
+
+
+def test_distinct_count_error():
+    # Standard error is 1.04 / sqrt(2 ** 14), about 0.8%; allow three of them
+    for distinct in (1000, 100_000):
+        sketch = HyperLogLog()
+        sketch.update(np.arange(distinct) * 7 + 3)
+        sketch.update(np.arange(distinct // 2) * 7 + 3)
+        assert abs(sketch.count() - distinct) <= 3 * 1.04 / np.sqrt(2 ** 14) * distinct
+
+
+def test_distinct_count_ignores_integer_width():
+    narrow, wide = HyperLogLog(), HyperLogLog()
+    narrow.update(np.arange(5000, dtype='int32'))
+    wide.update(pd.Series(np.arange(5000), dtype='Int64'))
+
+    assert np.array_equal(narrow.registers, wide.registers)
+
+
+def test_distinct_merge_is_associative():
+    values = np.arange(60000) % 45000
+    a, b, c = (HyperLogLog(precision=12) for _ in range(3))
+    for sketch, part in zip((a, b, c), thirds(values)):
+        sketch.update(part)
+    whole = HyperLogLog(precision=12)
+    whole.update(values)
+
+    left = merged(merged(a, b), c)
+    right = merged(a, merged(b, c))
+    assert np.array_equal(left.registers, right.registers)
+    assert np.array_equal(left.registers, whole.registers)
+
+
+def frequency_stream(seed):
+    """Zipf-like stream: a few heavy keys over a long tail"""
+    rng = np.random.default_rng(seed)
+    return rng.zipf(1.3, 100_000) % 20000
+
+
+def test_count_min_error_bound():
+    values = frequency_stream(4)
+    sketch = CountMinSketch(width_bits=12, depth=4)
+    sketch.update(values)
+
+    keys, exact = np.unique(values, return_counts=True)
+    estimates = sketch.estimate(keys)
+    assert (estimates >= exact).all()
+
+    # Overcount within e / width * N except with probability exp(-depth) per key
+    bound = np.e / 2 ** 12 * len(values)
+    assert np.mean(estimates - exact > bound) <= np.exp(-4)
+
+
+def test_count_min_top_keys():
+    values = frequency_stream(5)
+    sketch = CountMinSketch(capacity=50)
+    for chunk in np.array_split(values, 10):
+        sketch.update(chunk)
+
+    exact = pd.Series(values).value_counts()
+    assert list(sketch.top(5)) == exact.index[:5].tolist()
+
+
+def test_count_min_merge_is_associative():
+    values = frequency_stream(6)
+    a, b, c = (CountMinSketch(width_bits=10, depth=3, capacity=30) for _ in range(3))
+    for sketch, part in zip((a, b, c), thirds(values)):
+        sketch.update(part)
+    whole = CountMinSketch(width_bits=10, depth=3, capacity=30)
+    whole.update(values)
+
+    left = merged(merged(a, b), c)
+    right = merged(a, merged(b, c))
+    assert np.array_equal(left.table, right.table)
+    assert np.array_equal(left.table, whole.table)
+    assert left.top(10) == right.top(10) == whole.top(10)
+
+
+def test_count_min_merge_rejects_other_shape():
+    with pytest.raises(ValueError):
+        CountMinSketch(width_bits=10).merge(CountMinSketch(width_bits=12))
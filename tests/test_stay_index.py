@@ -0,0 +1,142 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stay_index import StayIndex, TimelineIndex
+
+
+def naive_at(keys, starts, ends, key, time):
+    return np.flatnonzero((keys == key) & (starts <= time) & (ends > time))
+
+
+def naive_overlapping(keys, starts, ends, key, start, end):
+    if end <= start:
+        return np.empty(0, dtype='int64')
+    return np.flatnonzero((keys == key) & (starts < end) & (ends > start))
+
+
+def random_intervals(seed, count=300):
+    rng = np.random.default_rng(seed)
+    keys = rng.integers(0, 4, count)
+    starts = rng.integers(0, 1000, count)
+    ends = starts + rng.integers(1, 120, count)
+    return keys, starts, ends
+
+
+def stays_frames():
+    transfers = pd.DataFrame({
+        'subject_id': [1, 1, 2, 3],
+        'hadm_id': [10, 10, 20, None],
+        'transfer_id': [100, 101, 200, 300],
+        'careunit': ['MICU', 'CCU', 'MICU', None],
+        'intime': pd.to_datetime(['2150-01-01 00:00', '2150-01-01 06:00', '2150-01-01 03:00', '2150-01-01 00:00']),
+        'outtime': pd.to_datetime(['2150-01-01 06:00', '2150-01-02 00:00', '2150-01-01 09:00', '2150-01-01 01:00'])
+    })
+    icustays = pd.DataFrame({
+        'subject_id': [1],
+        'hadm_id': [10],
+        'stay_id': [1000],
+        'first_careunit': ['MICU'],
+        'intime': pd.to_datetime(['2150-01-01 00:00']),
+        'outtime': pd.to_datetime(['2150-01-01 06:00'])
+    })
+    return transfers, icustays
+
+
+def test_intervals_are_half_open():
+    # Back-to-back stays: the first ends at 10 as the second starts
+    index = TimelineIndex([7, 7], [0, 10], [10, 20])
+
+    assert index.at(7, 0).tolist() == [0]
+    assert index.at(7, 9).tolist() == [0]
+    assert index.at(7, 10).tolist() == [1]
+    assert index.at(7, 20).tolist() == []
+    assert index.at(7, -1).tolist() == []
+
+    assert index.overlapping(7, 10, 11).tolist() == [1]
+    assert index.overlapping(7, 9, 10).tolist() == [0]
+    assert index.overlapping(7, 20, 30).tolist() == []
+    assert index.overlapping(7, -5, 0).tolist() == []
+    assert index.overlapping(7, 9, 11).tolist() == [0, 1]
+
+
+def test_empty_range_and_unknown_key():
+    index = TimelineIndex([7], [0], [10])
+
+    assert index.overlapping(7, 5, 5).tolist() == []
+    assert index.overlapping(7, 6, 5).tolist() == []
+    assert index.at(8, 5).tolist() == []
+    assert index.overlapping(3, 0, 10).tolist() == []
+
+
+def test_no_intervals():
+    index = TimelineIndex([], [], [])
+
+    assert index.at(0, 0).tolist() == []
+    assert index.overlapping(0, 0, 10).tolist() == []
+
+
+@pytest.mark.parametrize('checkpoint_every', [1, 3, 64])
+def test_matches_brute_force(checkpoint_every):
+    keys, starts, ends = random_intervals(checkpoint_every)
+    index = TimelineIndex(keys, starts, ends, checkpoint_every)
+
+    for key in range(5):
+        for time in range(-1, 1130, 7):
+            assert index.at(key, time).tolist() == naive_at(keys, starts, ends, key, time).tolist()
+            assert (index.overlapping(key, time, time + 25).tolist()
+                    == naive_overlapping(keys, starts, ends, key, time, time + 25).tolist())
+
+
+def test_timeline_json_round_trip():
+    keys, starts, ends = random_intervals(11)
+    index = TimelineIndex(keys, starts, ends, checkpoint_every=4)
+    loaded = TimelineIndex.from_dict(json.loads(json.dumps(index.to_dict())), starts.tolist(), ends.tolist())
+
+    for key in range(4):
+        for time in range(0, 1100, 13):
+            assert loaded.at(key, time).tolist() == index.at(key, time).tolist()
+            assert loaded.overlapping(key, time, time + 40).tolist() == index.overlapping(key, time, time + 40).tolist()
+
+
+def test_stay_index_queries():
+    transfers, icustays = stays_frames()
+    index = StayIndex.from_tables(transfers, icustays)
+
+    # Stays without a unit are not indexed
+    assert index.units == ['CCU', 'MICU']
+    assert index.in_unit('Nowhere', '2150-01-01 04:00') == []
+
+    present = index.in_unit('MICU', '2150-01-01 04:00')
+    assert sorted((stay['source'], stay['stay_id']) for stay in present) == [
+        ('icustays', 1000), ('transfers', 100), ('transfers', 200)]
+    assert [stay['stay_id'] for stay in index.in_unit('MICU', '2150-01-01 04:00', source='icustays')] == [1000]
+
+    # Subject 1 moved from MICU to CCU at 06:00
+    assert [stay['unit'] for stay in index.locate(1, '2150-01-01 06:00')] == ['CCU']
+    assert [stay['stay_id'] for stay in index.in_unit_between('MICU', '2150-01-01 06:00', '2150-01-01 07:00')] == [200]
+    assert index.locate(3, '2150-01-01 00:30') == []
+
+
+def test_stay_index_json_round_trip():
+    transfers, icustays = stays_frames()
+    index = StayIndex.from_tables(transfers, icustays)
+    loaded = StayIndex.from_dict(json.loads(json.dumps(index.to_dict())))
+
+    for time in pd.date_range('2150-01-01', '2150-01-02', freq='90min'):
+        for unit in index.units:
+            assert loaded.in_unit(unit, time) == index.in_unit(unit, time)
+        for subject_id in (1, 2, 3):
+            assert loaded.locate(subject_id, time) == index.locate(subject_id, time)
+            assert (loaded.locate_between(subject_id, time, time + pd.Timedelta('3h'))
+                    == index.locate_between(subject_id, time, time + pd.Timedelta('3h')))
+
+
+def test_stay_index_without_tables():
+    index = StayIndex.from_tables()
+
+    assert index.units == []
+    assert index.in_unit('MICU', '2150-01-01') == []
+    assert index.locate(1, '2150-01-01') == []